@@ -14,7 +14,7 @@ class DataGraph(object):
         else:
             self.display = display
 
-    def render(self, df, encoding, output):
+    def render(self, df, encoding, output, aggregator=None):
         with output:
             max_rows = pd.get_option("display.max_rows")
             max_cols = pd.get_option("display.max_columns")
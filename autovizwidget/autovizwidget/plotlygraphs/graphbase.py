@@ -4,23 +4,26 @@
 from plotly.graph_objs import Figure, Data, Layout
 from plotly.offline import iplot
 try:
-    from pandas.core.base import DataError
-except:
-    from pandas.core.groupby import DataError
+    from pandas.errors import DataError
+except ImportError:
+    try:
+        from pandas.core.base import DataError
+    except:
+        from pandas.core.groupby import DataError
 
 from ..widget.encoding import Encoding
 from ..widget.invalidencodingerror import InvalidEncodingError
 
 
 class GraphBase(object):
-    def render(self, df, encoding, output):
+    def render(self, df, encoding, output, aggregator=None):
         if encoding.x is None or encoding.y is None:
             with output:
                 print("\n\n\nPlease select an X and Y axis.")
                 return
 
         try:
-            data = self._get_data(df, encoding)
+            data = self._get_data(df, encoding, aggregator)
         except InvalidEncodingError as err:
             with output:
                 print("\n\n\n{}".format(err))
@@ -62,11 +65,18 @@ class GraphBase(object):
             return "log"
         return "-"
 
-    def _get_data(self, df, encoding):
+    def _get_data(self, df, encoding, aggregator=None):
         raise NotImplementedError()
 
     @staticmethod
-    def _get_x_y_values(df, encoding):
+    def _get_x_y_values(df, encoding, aggregator=None):
+        """aggregator, if given, is called with the X column, Y column and Y aggregation and returns the aggregated
+        X and Y values computed from the data df was taken from, or None to aggregate df itself."""
+        if aggregator is not None and encoding.y_aggregation != Encoding.y_agg_none:
+            values = aggregator(encoding.x, encoding.y, encoding.y_aggregation)
+            if values is not None:
+                return values
+
         try:
             x_values, y_values = GraphBase._get_x_y_values_aggregated(df,
                                                                       encoding.x,
@@ -16,11 +16,11 @@ from ..widget.encoding import Encoding
 class GraphRenderer(object):
 
     @staticmethod
-    def render(df, encoding, output):
+    def render(df, encoding, output, aggregator=None):
         with output:
             init_notebook_mode()
 
-        GraphRenderer._get_graph(encoding.chart_type).render(df, encoding, output)
+        GraphRenderer._get_graph(encoding.chart_type).render(df, encoding, output, aggregator)
 
     @staticmethod
     def display_x(chart_type):
@@ -8,6 +8,6 @@ from .graphbase import GraphBase
 
 class LineGraph(GraphBase):
 
-    def _get_data(self, df, encoding):
-        x_values, y_values = GraphBase._get_x_y_values(df, encoding)
+    def _get_data(self, df, encoding, aggregator=None):
+        x_values, y_values = GraphBase._get_x_y_values(df, encoding, aggregator)
         return [Scatter(x=x_values, y=y_values)]
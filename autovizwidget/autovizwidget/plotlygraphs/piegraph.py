@@ -4,9 +4,12 @@
 from plotly.graph_objs import Pie, Figure, Data
 from plotly.offline import iplot
 try:
-    from pandas.core.base import DataError
-except:
-    from pandas.core.groupby import DataError
+    from pandas.errors import DataError
+except ImportError:
+    try:
+        from pandas.core.base import DataError
+    except:
+        from pandas.core.groupby import DataError
     
 import autovizwidget.utils.configuration as conf
 from .graphbase import GraphBase
@@ -14,14 +17,14 @@ from .graphbase import GraphBase
 
 class PieGraph(GraphBase):
     @staticmethod
-    def render(df, encoding, output):
+    def render(df, encoding, output, aggregator=None):
         if encoding.x is None:
             with output:
                 print("\n\n\nPlease select an X axis.")
                 return
 
         try:
-            values, labels = PieGraph._get_x_values_labels(df, encoding)
+            values, labels = PieGraph._get_x_values_labels(df, encoding, aggregator)
         except TypeError:
             with output:
                 print("\n\n\nCannot group by X selection because of its type: '{}'. Please select another column."
@@ -60,11 +63,11 @@ class PieGraph(GraphBase):
         return False
 
     @staticmethod
-    def _get_x_values_labels(df, encoding):
+    def _get_x_values_labels(df, encoding, aggregator=None):
         if encoding.y is None:
             series = df.groupby([encoding.x]).size()
             values = series.values.tolist()
             labels = series.index.tolist()
         else:
-            labels, values = GraphBase._get_x_y_values(df, encoding)
+            labels, values = GraphBase._get_x_y_values(df, encoding, aggregator)
         return values, labels
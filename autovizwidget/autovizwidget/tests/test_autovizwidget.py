@@ -64,6 +64,7 @@ def test_on_render_viz():
     assert_equals(renderer.render.mock_calls[0][1][1], encoding)
     assert_equals(renderer.render.mock_calls[0][1][2], output)
     assert_frame_equal(renderer.render.mock_calls[0][1][0], df)
+    assert_equals(renderer.render.mock_calls[0][2], {"aggregator": None})
 
     encoding_widget.show_x.assert_called_once_with(True)
     encoding_widget.show_y.assert_called_once_with(True)
@@ -132,3 +133,13 @@ def test_convert_to_displayable_dataframe():
     assert_equals(result[u'bool_col'][0], 'True')
     assert_equals(result[u'bool_col'][1], 'False')
     spark_events.emit_graph_render_event.assert_called_once_with(encoding.chart_type)
+
+
+@with_setup(_setup, _teardown)
+def test_on_render_viz_with_aggregator():
+    aggregator = MagicMock()
+    widget = AutoVizWidget(df, encoding, renderer, ipywidget_factory,
+                           encoding_widget, ipython_display, spark_events=spark_events, testing=True,
+                           aggregator=aggregator)
+
+    assert_equals(renderer.render.mock_calls[0][2], {"aggregator": aggregator})
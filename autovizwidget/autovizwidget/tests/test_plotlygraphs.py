@@ -67,6 +67,25 @@ def test_graphbase_get_x_y_values():
         pass
 
 
+def test_graphbase_get_x_y_values_with_aggregator():
+    df = pd.DataFrame([{u'date': u'6/1/13', u'temp_diff': 12}, {u'date': u'6/1/13', u'temp_diff': 0}])
+    aggregator = MagicMock(return_value=([u'6/1/13', u'6/1/14'], [40, 2]))
+
+    encoding = Encoding(chart_type=Encoding.chart_type_line, x="date", y="temp_diff", y_aggregation=Encoding.y_agg_sum)
+    assert GraphBase._get_x_y_values(df, encoding, aggregator) == ([u'6/1/13', u'6/1/14'], [40, 2])
+    aggregator.assert_called_once_with("date", "temp_diff", Encoding.y_agg_sum)
+
+    # The aggregator can decline, and the sample is aggregated locally.
+    aggregator.return_value = None
+    assert GraphBase._get_x_y_values(df, encoding, aggregator) == ([u'6/1/13'], [12])
+
+    # Without an aggregation function there is nothing to push down.
+    aggregator.reset_mock()
+    encoding = Encoding(chart_type=Encoding.chart_type_line, x="date", y="temp_diff", y_aggregation=Encoding.y_agg_none)
+    assert GraphBase._get_x_y_values(df, encoding, aggregator) == ([u'6/1/13', u'6/1/13'], [12, 0])
+    assert not aggregator.called
+
+
 def test_pie_graph_display_methods():
     assert PieGraph.display_x()
     assert PieGraph.display_y()
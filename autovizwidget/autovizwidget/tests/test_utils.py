@@ -111,3 +111,18 @@ def test_select_y():
     selected_x = 'col1'
     selected_y = utils.select_y(data, selected_x, ['N', 'T', 'Q', 'O'])
     assert selected_y == 'col2'
+
+
+def test_set_aggregator():
+    df = pd.DataFrame({u'a': [1]})
+    other = pd.DataFrame({u'a': [1]})
+    aggregator = object()
+
+    utils.set_aggregator(df, aggregator)
+
+    assert utils.get_aggregator(df) is aggregator
+    assert utils.get_aggregator(other) is None
+
+    key = id(df)
+    del df
+    assert key not in utils._aggregators
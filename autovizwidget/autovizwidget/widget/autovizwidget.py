@@ -14,7 +14,7 @@ from ..utils.events import AutoVizEvents
 
 class AutoVizWidget(Box):
     def __init__(self, df, encoding, renderer=None, ipywidget_factory=None, encoding_widget=None, ipython_display=None,
-                 nested_widget_mode=False, spark_events=None, testing=False, **kwargs):
+                 nested_widget_mode=False, spark_events=None, testing=False, aggregator=None, **kwargs):
         assert encoding is not None
         assert df is not None
         assert type(df) is pd.DataFrame
@@ -44,6 +44,9 @@ class AutoVizWidget(Box):
 
         self.encoding = encoding
 
+        # Computes aggregated chart values from the data df was taken from, instead of from df itself.
+        self.aggregator = aggregator
+
         # Widget that will become the only child of AutoVizWidget
         self.widget = self.ipywidget_factory.get_vbox()
 
@@ -78,7 +81,7 @@ class AutoVizWidget(Box):
         self.encoding_widget.show_logarithmic_x_axis(self.renderer.display_logarithmic_x_axis(self.encoding.chart_type))
         self.encoding_widget.show_logarithmic_y_axis(self.renderer.display_logarithmic_y_axis(self.encoding.chart_type))
         if len(self.df) > 0:
-            self.renderer.render(self.df, self.encoding, self.to_display)
+            self.renderer.render(self.df, self.encoding, self.to_display, aggregator=self.aggregator)
         else:
             with self.to_display:
                 self.ipython_display.display(self.ipywidget_factory.get_html('No results.'))
@@ -1,3 +1,5 @@
+import weakref
+
 import pandas as pd
 
 from .encoding import Encoding
@@ -112,9 +114,27 @@ def select_y(data, x_name, order=None, aggregator=None):
     return chosen_y
 
 
+# id(df) -> (weak reference to df, aggregator). Entries are dropped when their DataFrame is garbage collected.
+_aggregators = {}
+
+
+def set_aggregator(df, aggregator):
+    """Makes charts of df aggregate through aggregator, e.g. on the cluster df was sampled from, rather than over
+    the rows of df. See GraphBase._get_x_y_values for the aggregator's signature."""
+    key = id(df)
+    _aggregators[key] = (weakref.ref(df, lambda _: _aggregators.pop(key, None)), aggregator)
+
+
+def get_aggregator(df):
+    entry = _aggregators.get(id(df))
+    if entry is None or entry[0]() is not df:
+        return None
+    return entry[1]
+
+
 def display_dataframe(df):
     selected_x = select_x(df)
     selected_y = select_y(df, selected_x)
     encoding = Encoding(chart_type=Encoding.chart_type_table, x=selected_x, y=selected_y,
                         y_aggregation=Encoding.y_agg_max)
-    return AutoVizWidget(df, encoding)
+    return AutoVizWidget(df, encoding, aggregator=get_aggregator(df))
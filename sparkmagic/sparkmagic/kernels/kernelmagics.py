@@ -6,6 +6,11 @@ Provides the %spark magic."""
 
 from __future__ import print_function
 import json
+import os
+import threading
+from datetime import datetime
+from time import sleep
+from xml.sax.saxutils import escape
 from IPython.core.magic import magics_class
 from IPython.core.magic import needs_local_scope, cell_magic, line_magic
 from IPython.core.magic_arguments import argument, magic_arguments
@@ -19,6 +24,9 @@ from sparkmagic.utils.sparkevents import SparkEvents
 from sparkmagic.utils.constants import LANGS_SUPPORTED
 from sparkmagic.livyclientlib.command import Command
 from sparkmagic.livyclientlib.endpoint import Endpoint
+from sparkmagic.livyclientlib.resultcache import get_result_cache
+from sparkmagic.livyclientlib.diskresultcache import get_disk_result_cache
+from sparkmagic.livyclientlib.sessionstore import SessionStore
 from sparkmagic.magics.sparkmagicsbase import SparkMagicBase
 from sparkmagic.livyclientlib.exceptions import handle_expected_exceptions, wrap_unexpected_exceptions, \
     BadUserDataException
@@ -43,6 +51,88 @@ def _event(f):
     return wrapped
 
 
+class _CapturingDisplay(object):
+    """Forwards to an IpythonDisplay, except on threads that called capture(), whose output is kept instead so
+    that it can be shown later from the thread running the cell."""
+    def __init__(self, display):
+        self.display = display
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.calls = []
+
+    def release(self):
+        calls = getattr(self._local, u"calls", None)
+        self._local.calls = None
+        return calls or []
+
+    def replay(self, calls):
+        for (name, args, kwargs) in calls:
+            getattr(self.display, name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.display, name)
+        calls = getattr(self._local, u"calls", None)
+        if calls is None or not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: calls.append((name, args, kwargs))
+
+
+class _BackgroundSessionStart(object):
+    """Starts a session on a daemon thread. What the session displays while starting is kept and only shown
+    by result(), so it appears under the cell that waits for the session instead of whichever cell is
+    running when the session comes up. A start replacing a cancelled one waits for that one's thread to end
+    first, so the two sessions are never registered at the same time."""
+    def __init__(self, add_session, properties, display, previous=None):
+        self._display = display
+        self._output = []
+        self._exception = None
+        self._lock = threading.Lock()
+        self._abandon = None
+        self._thread = threading.Thread(target=self._run, args=(add_session, properties, previous),
+                                        name=u"BackgroundSessionStart")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, add_session, properties, previous):
+        if previous is not None:
+            previous.wait()
+        self._display.capture()
+        try:
+            add_session(properties)
+        except Exception as e:
+            self._exception = e
+        finally:
+            self._output = self._display.release()
+            with self._lock:
+                abandon = self._abandon
+            if abandon is not None:
+                # Cancelled: a session added after cancel() returned, such as a pooled one, is deleted too.
+                abandon()
+
+    def cancel(self, abandon):
+        """Gives up on the session without waiting for it to start. abandon deletes the session, and returns
+        False while the session is still waiting for Livy to give it an id; it is retried until then, or until
+        the thread ends, which deleting the session makes it do soon. Nothing the start displayed is shown."""
+        with self._lock:
+            self._abandon = abandon
+        while not abandon() and not self.done():
+            sleep(0.05)
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def wait(self):
+        self._thread.join()
+
+    def result(self):
+        """Waits for the session, shows what it displayed and raises what starting it raised."""
+        self.wait()
+        self._display.replay(self._output)
+        if self._exception is not None:
+            raise self._exception
+
+
 @magics_class
 class KernelMagics(SparkMagicBase):
     def __init__(self, shell, data=None, spark_events=None):
@@ -57,6 +147,11 @@ class KernelMagics(SparkMagicBase):
         self.endpoint = None
         self.fatal_error = False
         self.fatal_error_message = u""
+        # Set while a session started in the background has not been used by any cell yet.
+        self._background_start = None
+        # The last cancelled background start, which the next one waits for.
+        self._cancelled_start = None
+        self._session_store = SessionStore()
         if spark_events is None:
             spark_events = SparkEvents()
         self._spark_events = spark_events
@@ -111,10 +206,17 @@ class KernelMagics(SparkMagicBase):
       <ul>
         <li>-o VAR_NAME: The Spark dataframe of name VAR_NAME will be available in the %%local Python context as a
           <a href="http://pandas.pydata.org/">Pandas</a> dataframe with the same name.</li>
-        <li>-m METHOD: Sample method, either <tt>take</tt> or <tt>sample</tt>.</li>
+        <li>-m METHOD: Sample method, one of <tt>take</tt>, <tt>sample</tt>, <tt>stratified</tt> (an equal share
+            of the rows for each value of the --stratify column), <tt>reservoir</tt> (exactly MAXROWS random rows) or
+            <tt>partition</tt> (the first rows of every partition).</li>
         <li>-n MAXROWS: The maximum number of rows of a dataframe that will be pulled from Livy to Jupyter.
             If this number is negative, then the number of rows will be unlimited.</li>
         <li>-r FRACTION: Fraction used for sampling.</li>
+        <li>--stratify COLUMN: Column to stratify by, with <tt>-m stratified</tt>.</li>
+        <li>--refresh: Pull the dataframe again even if it is cached on disk (see disk_result_cache_max_bytes).</li>
+        <li>--lazy: VAR_NAME will hold a handle to the remote dataframe instead of a Pandas dataframe. Its
+          <tt>len()</tt>, <tt>columns</tt>, <tt>shape</tt>, <tt>head(n)</tt>, <tt>describe()</tt> and column
+          selection run on the cluster; <tt>to_pandas()</tt> or displaying it pulls the rows.</li>
       </ul>
     </td>
   </tr>
@@ -127,10 +229,19 @@ class KernelMagics(SparkMagicBase):
         <li>-o VAR_NAME: The result of the SQL query will be available in the %%local Python context as a
           <a href="http://pandas.pydata.org/">Pandas</a> dataframe.</li>
         <li>-q: The magic will return None instead of the dataframe (no visualization).</li>
-        <li>-m, -n, -r are the same as the %%spark parameters above.</li>
+        <li>-m, -n, -r, --stratify are the same as the %%spark parameters above.</li>
+        <li>--refresh: Run the query again even if its result is cached (see sql_result_cache_max_bytes).</li>
       </ul>
     </td>
   </tr>
+  <tr>
+    <td>cache</td>
+    <td>%%cache stats</td>
+    <td>Manages the results cached by %%sql and %%spark -o. <tt>list</tt> shows the results cached on disk,
+    <tt>stats</tt> shows the cache sizes and hit counts and <tt>clear</tt> removes every cached result. Results
+    cached on disk are reused by new sessions on the same endpoint, after a kernel restart or notebook reopen,
+    unless disk_result_cache_per_session is set.</td>
+  </tr>
   <tr>
     <td>local</td>
     <td>%%local<br/>a = 1</td>
@@ -153,7 +264,7 @@ class KernelMagics(SparkMagicBase):
     def info(self, line, cell=u"", local_ns=None):
         parse_argstring_or_throw(self.info, line)
         self._assure_cell_body_is_empty(KernelMagics.info.__name__, cell)
-        if self.session_started:
+        if self._session_available():
             current_session_id = self.spark_controller.get_session_id_for_client(self.session_name)
         else:
             current_session_id = None
@@ -171,12 +282,44 @@ class KernelMagics(SparkMagicBase):
     def logs(self, line, cell="", local_ns=None):
         parse_argstring_or_throw(self.logs, line)
         self._assure_cell_body_is_empty(KernelMagics.logs.__name__, cell)
-        if self.session_started:
+        if self._session_available():
             out = self.spark_controller.get_logs()
             self.ipython_display.write(out)
         else:
             self.ipython_display.write(u"No logs yet.")
 
+    @magic_arguments()
+    @cell_magic
+    @argument("command", type=str, default="list", nargs="?", help="One of list, stats or clear.")
+    @wrap_unexpected_exceptions
+    @handle_expected_exceptions
+    @_event
+    def cache(self, line, cell="", local_ns=None):
+        args = parse_argstring_or_throw(self.cache, line)
+        self._assure_cell_body_is_empty(KernelMagics.cache.__name__, cell)
+        disk_cache = get_disk_result_cache()
+        if args.command == u"list":
+            entries = disk_cache.entries()
+            if entries:
+                self.ipython_display.html(_cache_entries_html(entries))
+            else:
+                self.ipython_display.write(u"No cached results.")
+        elif args.command == u"stats":
+            stats = disk_cache.stats()
+            memory_cache = get_result_cache()
+            self.ipython_display.write(
+                u"Disk cache {}: {} results, {} of {} bytes, {} hits, {} misses, results expire after {} seconds.\n"
+                u"Memory cache: {} results, {} of {} bytes."
+                .format(stats[u"path"], stats[u"entries"], stats[u"bytes"], stats[u"max_bytes"], stats[u"hits"],
+                        stats[u"misses"], stats[u"ttl_seconds"], len(memory_cache), memory_cache.size(),
+                        memory_cache.max_bytes))
+        elif args.command == u"clear":
+            disk_cache.clear()
+            get_result_cache().clear()
+            self.ipython_display.write(u"Cleared cached results.")
+        else:
+            raise BadUserDataException(u"Cache command must be one of list, stats or clear.")
+
     @magic_arguments()
     @cell_magic
     @argument("-f", "--force", type=bool, default=False, nargs="?", const=True, help="If present, user understands.")
@@ -190,7 +333,12 @@ class KernelMagics(SparkMagicBase):
             self.ipython_display.send_error(u"Could not parse JSON object from input '{}'".format(cell))
             return
         args = parse_argstring_or_throw(self.configure, line)
-        if self.session_started:
+        if self._background_start is not None:
+            # No cell has used the session started in the background yet, so it is restarted without -f.
+            self._do_not_call_delete_session(u"")
+            self._override_session_settings(dictionary)
+            self._start_session_in_background()
+        elif self.session_started:
             if not args.force:
                 self.ipython_display.send_error(u"A session has already been started. If you intend to recreate the "
                                                 u"session with new configurations, please include the -f argument.")
@@ -198,9 +346,14 @@ class KernelMagics(SparkMagicBase):
             else:
                 self._do_not_call_delete_session(u"")
                 self._override_session_settings(dictionary)
-                self._do_not_call_start_session(u"")
+                if conf.start_session_in_background():
+                    self._start_session_in_background()
+                else:
+                    self._do_not_call_start_session(u"")
         else:
             self._override_session_settings(dictionary)
+            if conf.start_session_in_background():
+                self._start_session_in_background()
         self.info(u"")
 
     @magic_arguments()
@@ -208,12 +361,18 @@ class KernelMagics(SparkMagicBase):
     @needs_local_scope
     @argument("-o", "--output", type=str, default=None, help="If present, indicated variable will be stored in variable"
                                                              "of this name in user's local context.")
-    @argument("-m", "--samplemethod", type=str, default=None, help="Sample method for dataframe: either take or sample")
+    @argument("-m", "--samplemethod", type=str, default=None, help="Sample method for dataframe: one of take, sample, "
+                                                                    "stratified, reservoir or partition")
     @argument("-n", "--maxrows", type=int, default=None, help="Maximum number of rows that will be pulled back "
                                                                         "from the dataframe on the server for storing")
     @argument("-r", "--samplefraction", type=float, default=None, help="Sample fraction for sampling from dataframe")
+    @argument("--stratify", type=str, default=None, help="Column to stratify by, with -m stratified")
     @argument("-c", "--coerce", type=str, default=None, help="Whether to automatically coerce the types (default, pass True if being explicit) "
                                                                         "of the dataframe or not (pass False)")
+    @argument("--refresh", type=bool, default=False, const=True, nargs="?", help="Pull the -o dataframe again even "
+                                                                                  "if it is cached on disk.")
+    @argument("--lazy", type=bool, default=False, const=True, nargs="?", help="Store a handle to the remote "
+                                                                               "dataframe instead of pulling its rows.")
     @wrap_unexpected_exceptions
     @handle_expected_exceptions
     def spark(self, line, cell="", local_ns=None):
@@ -222,7 +381,8 @@ class KernelMagics(SparkMagicBase):
 
             coerce = get_coerce_value(args.coerce)
 
-            self.execute_spark(cell, args.output, args.samplemethod, args.maxrows, args.samplefraction, None, coerce)
+            self.execute_spark(cell, args.output, args.samplemethod, args.maxrows, args.samplefraction, None, coerce,
+                               args.refresh, args.lazy, args.stratify)
         else:
             return
 
@@ -232,12 +392,16 @@ class KernelMagics(SparkMagicBase):
     @argument("-o", "--output", type=str, default=None, help="If present, query will be stored in variable of this "
                                                              "name.")
     @argument("-q", "--quiet", type=bool, default=False, const=True, nargs="?", help="Return None instead of the dataframe.")
-    @argument("-m", "--samplemethod", type=str, default=None, help="Sample method for SQL queries: either take or sample")
+    @argument("-m", "--samplemethod", type=str, default=None, help="Sample method for SQL queries: one of take, "
+                                                                    "sample, stratified, reservoir or partition")
     @argument("-n", "--maxrows", type=int, default=None, help="Maximum number of rows that will be pulled back "
                                                                         "from the server for SQL queries")
     @argument("-r", "--samplefraction", type=float, default=None, help="Sample fraction for sampling from SQL queries")
+    @argument("--stratify", type=str, default=None, help="Column to stratify by, with -m stratified")
     @argument("-c", "--coerce", type=str, default=None, help="Whether to automatically coerce the types (default, pass True if being explicit) "
                                                                         "of the dataframe or not (pass False)")
+    @argument("--refresh", type=bool, default=False, const=True, nargs="?", help="Run the query even if its result "
+                                                                                  "is cached, and cache the new result.")
     @wrap_unexpected_exceptions
     @handle_expected_exceptions
     def sql(self, line, cell="", local_ns=None):
@@ -247,7 +411,7 @@ class KernelMagics(SparkMagicBase):
             coerce = get_coerce_value(args.coerce)
 
             return self.execute_sqlquery(cell, args.samplemethod, args.maxrows, args.samplefraction,
-                                         None, args.output, args.quiet, coerce)
+                                         None, args.output, args.quiet, coerce, args.refresh, args.stratify)
         else:
             return
 
@@ -310,27 +474,131 @@ class KernelMagics(SparkMagicBase):
             self.ipython_display.send_error(self.fatal_error_message)
             return False
 
+        if self._background_start is not None:
+            return self._wait_for_background_session()
+
         if not self.session_started:
-            skip = False
             properties = conf.get_session_properties(self.language)
             self.session_started = True
 
             try:
-                self.spark_controller.add_session(self.session_name, self.endpoint, skip, properties)
+                self._add_session(properties)
             except Exception as e:
-                self.fatal_error = True
-                self.fatal_error_message = conf.fatal_error_suggestion().format(e)
-                self.logger.error(u"Error creating session: {}".format(e))
-                self.ipython_display.send_error(self.fatal_error_message)
+                self._session_start_failed(e)
                 return False
 
         return self.session_started
 
+    def _add_session(self, properties):
+        key = self._kernel_key()
+        if key is not None and self._reattach_session(key, properties):
+            return
+        if not (conf.session_pool_size() > 0 and
+                self.spark_controller.add_pooled_session(self.session_name, self.endpoint, properties)):
+            self.spark_controller.add_session(self.session_name, self.endpoint, False, properties)
+        if key is not None:
+            self._session_store.set(key, self.endpoint.url,
+                                    self.spark_controller.get_session_id_for_client(self.session_name), properties)
+
+    def _reattach_session(self, key, properties):
+        """Reattaches to the session this notebook used before the kernel restarted, if it is still alive and
+        was started with the same properties. A kernel is often restarted to apply a changed %%configure."""
+        entry = self._session_store.get(key)
+        if entry is None:
+            return False
+        (url, session_id, properties_key) = entry
+        if url != self.endpoint.url:
+            return False
+        if properties_key != SessionStore.properties_key(properties):
+            # The old session is replaced by one with the new properties rather than left running.
+            try:
+                self.spark_controller.delete_session_by_id(self.endpoint, session_id)
+            except Exception as e:
+                self.logger.error(u"Could not delete session {}: {}".format(session_id, e))
+            return False
+        if self.spark_controller.reattach_session(self.session_name, self.endpoint, properties, session_id):
+            return True
+        self._session_store.remove(key)
+        return False
+
+    @staticmethod
+    def _kernel_key():
+        """Returns what the kernel's session is stored under when persist_kernel_sessions is on: the notebook
+        path when Jupyter provides it, or else the connection file, which a restarted kernel keeps. Returns None
+        when sessions are not persisted."""
+        if not conf.persist_kernel_sessions():
+            return None
+        key = os.environ.get(u"JPY_SESSION_NAME")
+        if key:
+            return key
+        try:
+            from ipykernel.connect import get_connection_file
+            return get_connection_file()
+        except Exception:
+            return None
+
+    def _session_start_failed(self, e):
+        self.fatal_error = True
+        self.fatal_error_message = conf.fatal_error_suggestion().format(e)
+        self.logger.error(u"Error creating session: {}".format(e))
+        self.ipython_display.send_error(self.fatal_error_message)
+
+    def _start_session_in_background(self):
+        """Starts the session on a background thread, so that cells which do not need it, like %%local ones,
+        keep running while YARN starts the driver. The first cell that needs the session waits for it in
+        _do_not_call_start_session."""
+        display = self.spark_controller.ipython_display
+        if not isinstance(display, _CapturingDisplay):
+            # Sessions display through the controller, so that is where output from the thread is caught.
+            display = self.spark_controller.ipython_display = _CapturingDisplay(display)
+        properties = conf.get_session_properties(self.language)
+        self.session_started = True
+        self._background_start = _BackgroundSessionStart(self._add_session, properties, display,
+                                                         self._cancelled_start)
+        self._cancelled_start = None
+
+    def _cancel_background_session(self):
+        """Deletes the session starting in the background as soon as Livy has given it an id, instead of
+        waiting for YARN to start it, so a %%configure cell right after the kernel starts does not wait for a
+        session it is about to replace."""
+        background_start = self._background_start
+        self._background_start = None
+        self._cancelled_start = background_start
+        key = self._kernel_key()
+        if key is not None:
+            self._session_store.remove(key)
+        background_start.cancel(lambda: self.spark_controller.abandon_session(self.session_name))
+
+    def _wait_for_background_session(self):
+        """Waits for the session started in the background. Returns False, having reported the error, if it
+        could not be started."""
+        background_start = self._background_start
+        self._background_start = None
+        try:
+            background_start.result()
+        except Exception as e:
+            self._session_start_failed(e)
+            return False
+        return True
+
+    def _session_available(self):
+        """Whether the session can be used without waiting for it to start."""
+        if self._background_start is not None:
+            return self._background_start.done() and self._wait_for_background_session()
+        return self.session_started
+
     @cell_magic
     @handle_expected_exceptions
     def _do_not_call_delete_session(self, line, cell="", local_ns=None):
         try:
+            if self._background_start is not None:
+                # No cell has used the session yet, so it is deleted without waiting for it to start.
+                self._cancel_background_session()
+                return
             if self.session_started:
+                key = self._kernel_key()
+                if key is not None:
+                    self._session_store.remove(key)
                 self.spark_controller.delete_session_by_name(self.session_name)
         except:
             # The exception will be logged and handled in the frontend.
@@ -338,6 +606,17 @@ class KernelMagics(SparkMagicBase):
         finally:
             self.session_started = False
 
+    @cell_magic
+    @handle_expected_exceptions
+    def _do_not_call_release_session(self, line, cell="", local_ns=None):
+        # Called instead of _do_not_call_delete_session when the kernel restarts. Leaves a persisted session
+        # running for the restarted kernel to reattach to.
+        if self._kernel_key() is None:
+            return self._do_not_call_delete_session(line)
+        if self._background_start is not None:
+            self._wait_for_background_session()
+        self.session_started = False
+
     @magic_arguments()
     @cell_magic
     @argument("-l", "--language", type=str, help="Language to use.")
@@ -355,6 +634,8 @@ class KernelMagics(SparkMagicBase):
 
         self.language = language
         self.refresh_configuration()
+        if conf.start_session_in_background() and self.endpoint.url:
+            self._start_session_in_background()
 
     @magic_arguments()
     @line_magic
@@ -370,11 +651,18 @@ class KernelMagics(SparkMagicBase):
         server = args.server
         auth = args.auth
 
+        # A session started in the background that no cell has used yet moves to the new endpoint.
+        restart = self._background_start is not None
+        if restart:
+            self._do_not_call_delete_session(u"")
+
         if self.session_started:
             error = u"Cannot change the endpoint if a session has been started."
             raise BadUserDataException(error)
 
         self.endpoint = Endpoint(server, auth, username, password)
+        if restart:
+            self._start_session_in_background()
 
     def refresh_configuration(self):
         credentials = getattr(conf, 'base64_kernel_' + self.language + '_credentials')()
@@ -408,5 +696,15 @@ class KernelMagics(SparkMagicBase):
                                        .format(magic_name, cell.strip()))
 
 
+def _cache_entries_html(entries):
+    rows = u"".join(u"<tr><td><tt>{}</tt></td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>"
+                    .format(escape(entry.get(u"description", u"")), entry.get(u"rows"), entry.get(u"columns"),
+                            entry[u"bytes"], entry.get(u"format"),
+                            datetime.fromtimestamp(entry[u"created"]).strftime(u"%Y-%m-%d %H:%M:%S"))
+                    for entry in entries)
+    return u"<table>\n<tr><th>Code</th><th>Rows</th><th>Columns</th><th>Bytes</th><th>Format</th><th>Cached at</th>" \
+           u"</tr>{}</table>".format(rows)
+
+
 def load_ipython_extension(ip):
     ip.register_magics(KernelMagics)
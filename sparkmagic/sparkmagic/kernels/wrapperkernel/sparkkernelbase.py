@@ -54,7 +54,10 @@ class SparkKernelBase(IPythonKernel):
 
     def do_shutdown(self, restart):
         # Cleanup
-        self._delete_session()
+        if restart and conf.persist_kernel_sessions():
+            self._release_session()
+        else:
+            self._delete_session()
 
         return self._do_shutdown_ipykernel(restart)
 
@@ -95,6 +98,10 @@ ip.display_formatter.ipython_display_formatter.for_type_by_name('pandas.core.fra
         code = "%%_do_not_call_delete_session\n "
         self._execute_cell_for_user(code, True, False)
 
+    def _release_session(self):
+        code = "%%_do_not_call_release_session\n "
+        self._execute_cell_for_user(code, True, False)
+
     def _execute_cell(self, code, silent, store_history=True, user_expressions=None, allow_stdin=False,
                       shutdown_if_error=False, log_if_error=None):
         reply_content = self._execute_cell_for_user(code, silent, store_history, user_expressions, allow_stdin)
@@ -0,0 +1,47 @@
+# Distributed under the terms of the Modified BSD License.
+from collections import deque
+
+
+class AdaptivePollingPolicy(object):
+    """Decides how long to wait before polling a running statement again.
+
+    The first poll always waits only min_seconds, so short statements are picked up almost as soon
+    as they finish. After that, if Livy reports the statement's progress, the next poll is scheduled
+    halfway to the predicted end. Otherwise the wait grows exponentially from min_seconds up to
+    max_seconds, so long-running statements cost Livy few requests. While the statement is younger
+    than the typical completion time observed on this session, the wait is also capped at the time
+    left until then, so that a poll lands close to when statements usually finish. History only ever
+    shortens a wait: a quick statement that follows slow ones is polled as often as any other."""
+
+    def __init__(self, min_seconds, max_seconds, backoff_factor=1.5, history_size=20):
+        self.min_seconds = min_seconds
+        self.max_seconds = max(min_seconds, max_seconds)
+        self.backoff_factor = backoff_factor
+        self._completion_times = deque(maxlen=history_size)
+
+    def seconds_to_sleep(self, retries, elapsed_seconds=0, progress=None):
+        if retries <= 1:
+            return self.min_seconds
+
+        if progress is not None and 0 < progress < 1 and elapsed_seconds > 0:
+            predicted_remaining = elapsed_seconds * (1 - progress) / progress
+            return self._clamp(predicted_remaining / 2)
+
+        cap = self.max_seconds
+        typical = self.typical_completion_seconds()
+        if typical is not None and elapsed_seconds < typical:
+            cap = self._clamp(typical - elapsed_seconds)
+
+        return min(cap, self.min_seconds * self.backoff_factor ** (retries - 1))
+
+    def record_completion(self, elapsed_seconds):
+        self._completion_times.append(elapsed_seconds)
+
+    def typical_completion_seconds(self):
+        if not self._completion_times:
+            return None
+        times = sorted(self._completion_times)
+        return times[len(times) // 2]
+
+    def _clamp(self, seconds):
+        return min(self.max_seconds, max(self.min_seconds, seconds))
@@ -0,0 +1,61 @@
+# Distributed under the terms of the Modified BSD License.
+import json
+from tornado import gen
+
+from .asyncreliablehttpclient import AsyncReliableHttpClient
+from .livyreliablehttpclient import LivyReliableHttpClient
+
+
+class AsyncLivyReliableHttpClient(object):
+    """Non-blocking counterpart of LivyReliableHttpClient with the same methods. Every method returns a future
+    that resolves to what the blocking method would have returned. Propagates HttpClientExceptions up."""
+    def __init__(self, http_client, endpoint):
+        self.endpoint = endpoint
+        self._http_client = http_client
+
+    @staticmethod
+    def from_endpoint(endpoint):
+        headers = LivyReliableHttpClient._get_headers()
+        retry_policy = LivyReliableHttpClient._get_retry_policy()
+        return AsyncLivyReliableHttpClient(AsyncReliableHttpClient(endpoint, headers, retry_policy), endpoint)
+
+    @gen.coroutine
+    def post_statement(self, session_id, data):
+        r = yield self._http_client.post(LivyReliableHttpClient._statements_url(session_id), [201], data)
+        raise gen.Return(self._json(r))
+
+    @gen.coroutine
+    def get_statement(self, session_id, statement_id):
+        r = yield self._http_client.get(LivyReliableHttpClient._statement_url(session_id, statement_id), [200])
+        raise gen.Return(self._json(r))
+
+    @gen.coroutine
+    def get_sessions(self):
+        r = yield self._http_client.get("/sessions", [200])
+        raise gen.Return(self._json(r))
+
+    @gen.coroutine
+    def post_session(self, properties):
+        r = yield self._http_client.post("/sessions", [201], properties)
+        raise gen.Return(self._json(r))
+
+    @gen.coroutine
+    def get_session(self, session_id):
+        r = yield self._http_client.get(LivyReliableHttpClient._session_url(session_id), [200])
+        raise gen.Return(self._json(r))
+
+    @gen.coroutine
+    def delete_session(self, session_id):
+        yield self._http_client.delete(LivyReliableHttpClient._session_url(session_id), [200, 404])
+
+    @gen.coroutine
+    def get_all_session_logs(self, session_id):
+        r = yield self._http_client.get(LivyReliableHttpClient._session_url(session_id) + "/log?from=0", [200])
+        raise gen.Return(self._json(r))
+
+    def get_headers(self):
+        return self._http_client.get_headers()
+
+    @staticmethod
+    def _json(response):
+        return json.loads(response.body.decode("utf-8"))
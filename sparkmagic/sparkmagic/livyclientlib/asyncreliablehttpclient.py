@@ -0,0 +1,92 @@
+# Distributed under the terms of the Modified BSD License.
+import json
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.utils.sparklogger import SparkLog
+import sparkmagic.utils.constants as constants
+from sparkmagic.livyclientlib.exceptions import HttpClientException
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
+
+
+class AsyncReliableHttpClient(object):
+    """Non-blocking counterpart of ReliableHttpClient. Uses tornado's AsyncHTTPClient, so requests run on the
+    current IOLoop (the asyncio loop on tornado 5+) and waits between retries do not block the thread.
+    Kerberos is not supported by tornado's client; use the blocking ReliableHttpClient for kerberized endpoints."""
+
+    def __init__(self, endpoint, headers, retry_policy, http_client=None):
+        self._endpoint = endpoint
+        self._headers = headers
+        self._retry_policy = retry_policy
+        self._auth_username = None
+        self._auth_password = None
+        if self._endpoint.auth == constants.AUTH_BASIC:
+            self._auth_username = self._endpoint.username
+            self._auth_password = self._endpoint.password
+        elif self._endpoint.auth != constants.NO_AUTH:
+            raise BadUserConfigurationException(u"Unsupported auth {} for asynchronous requests"
+                                                .format(self._endpoint.auth))
+
+        self.logger = SparkLog(u"AsyncReliableHttpClient")
+
+        self.verify_ssl = not conf.ignore_ssl_errors()
+        if http_client is None:
+            http_client = AsyncHTTPClient()
+        self._http_client = http_client
+
+    def get_headers(self):
+        return self._headers
+
+    def compose_url(self, relative_url):
+        r_u = "/{}".format(relative_url.rstrip(u"/").lstrip(u"/"))
+        return self._endpoint.url + r_u
+
+    def get(self, relative_url, accepted_status_codes):
+        """Sends a get request. Returns a future resolving to the response."""
+        return self._send_request(relative_url, accepted_status_codes, u"GET")
+
+    def post(self, relative_url, accepted_status_codes, data):
+        """Sends a post request. Returns a future resolving to the response."""
+        return self._send_request(relative_url, accepted_status_codes, u"POST", data)
+
+    def delete(self, relative_url, accepted_status_codes):
+        """Sends a delete request. Returns a future resolving to the response."""
+        return self._send_request(relative_url, accepted_status_codes, u"DELETE")
+
+    @gen.coroutine
+    def _send_request(self, relative_url, accepted_status_codes, method, data=None):
+        url = self.compose_url(relative_url)
+        body = None if data is None else json.dumps(data)
+        retry_count = 0
+        while True:
+            request = HTTPRequest(url, method=method, headers=self._headers, body=body,
+                                  auth_username=self._auth_username, auth_password=self._auth_password,
+                                  validate_cert=self.verify_ssl)
+            try:
+                r = yield self._http_client.fetch(request)
+            except HTTPError as e:
+                r = e.response
+                error = r is None
+                if error:
+                    self.logger.error(u"Request to '{}' failed with '{}'".format(url, e))
+            except IOError as e:
+                r = None
+                error = True
+                self.logger.error(u"Request to '{}' failed with '{}'".format(url, e))
+            else:
+                error = False
+
+            status = None if r is None else r.code
+            if error or status not in accepted_status_codes:
+                if self._retry_policy.should_retry(status, error, retry_count):
+                    yield gen.sleep(self._retry_policy.seconds_to_sleep(retry_count))
+                    retry_count += 1
+                    continue
+
+                if error:
+                    raise HttpClientException(u"Error sending http request and maximum retry encountered.")
+                else:
+                    raise HttpClientException(u"Invalid status code '{}' from {} with error payload: {}"
+                                              .format(status, url, r.body))
+            raise gen.Return(r)
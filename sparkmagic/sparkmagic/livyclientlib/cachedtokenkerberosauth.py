@@ -0,0 +1,56 @@
+# Distributed under the terms of the Modified BSD License.
+import threading
+from time import time
+
+from requests.auth import AuthBase
+
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+class CachedTokenKerberosAuth(AuthBase):
+    """Wraps an HTTPKerberosAuth so the negotiated Authorization header is remembered and sent
+    preemptively until it expires, instead of waiting for a 401 challenge on every new connection.
+    If the server rejects the cached token with a 401, the token is dropped and the wrapped auth
+    negotiates again. Cookies returned by Livy or Knox are kept by the requests.Session itself."""
+
+    def __init__(self, kerberos_auth, token_lifetime_seconds):
+        self._kerberos_auth = kerberos_auth
+        self._token_lifetime_seconds = token_lifetime_seconds
+        self._token = None
+        self._token_expiration = 0
+        self._lock = threading.Lock()
+
+        self.logger = SparkLog(u"CachedTokenKerberosAuth")
+
+    def __call__(self, request):
+        token = self.get_cached_token()
+        if token is not None:
+            request.headers['Authorization'] = token
+        request.register_hook('response', self.handle_response)
+        return request
+
+    def get_cached_token(self):
+        with self._lock:
+            if self._token is not None and time() >= self._token_expiration:
+                self._token = None
+            return self._token
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+
+    def handle_response(self, response, **kwargs):
+        sent_token = response.request.headers.get('Authorization')
+        if response.status_code == 401 and sent_token is not None:
+            self.logger.debug(u"Cached Kerberos token was rejected. Negotiating a new one.")
+            self.invalidate()
+
+        response = self._kerberos_auth.handle_response(response, **kwargs)
+
+        token = response.request.headers.get('Authorization')
+        if response.status_code < 400 and token is not None and token.startswith(u"Negotiate ") \
+                and token != sent_token:
+            with self._lock:
+                self._token = token
+                self._token_expiration = time() + self._token_lifetime_seconds
+        return response
@@ -1,6 +1,8 @@
 import textwrap
+from time import time
 
 from hdijupyterutils.guid import ObjectWithGuid
+from tornado import gen
 
 import sparkmagic.utils.configuration as conf
 from sparkmagic.utils.sparklogger import SparkLog
@@ -43,8 +45,30 @@ class Command(ObjectWithGuid):
                                                                   self.guid, statement_id, True, "", "")
             return output
 
+    @gen.coroutine
+    def execute_async(self, session):
+        """Non-blocking version of execute. Returns a future resolving to the (success, output) tuple."""
+        self._spark_events.emit_statement_execution_start_event(session.guid, session.kind, session.id, self.guid)
+        statement_id = -1
+        try:
+            yield session.wait_for_idle_async()
+            data = {u"code": self.code}
+            response = yield session.async_http_client.post_statement(session.id, data)
+            statement_id = response[u'id']
+            output = yield self._get_statement_output_async(session, statement_id)
+        except Exception as e:
+            self._spark_events.emit_statement_execution_end_event(session.guid, session.kind, session.id,
+                                                                  self.guid, statement_id, False, e.__class__.__name__,
+                                                                  str(e))
+            raise
+        else:
+            self._spark_events.emit_statement_execution_end_event(session.guid, session.kind, session.id,
+                                                                  self.guid, statement_id, True, "", "")
+            raise gen.Return(output)
+
     def _get_statement_output(self, session, statement_id):
         retries = 1
+        start_time = time()
         
         while True:
             statement = session.http_client.get_statement(session.id, statement_id)
@@ -53,19 +77,42 @@ class Command(ObjectWithGuid):
             self.logger.debug(u"Status of statement {} is {}.".format(statement_id, status))
 
             if status not in FINAL_STATEMENT_STATUS:
-                session.sleep(retries)
+                session.sleep(retries, time() - start_time, statement.get(u"progress"))
                 retries += 1
-            else:                
-                statement_output = statement[u"output"]
-
-                if statement_output is None:
-                    return (True, u"")
-
-                if statement_output[u"status"] == u"ok":
-                    return (True, statement_output[u"data"][u"text/plain"])
-                elif statement_output[u"status"] == u"error":
-                    return (False,
-                           statement_output[u"evalue"] + u"\n" + u"".join(statement_output[u"traceback"]))
-                else:
-                    raise LivyUnexpectedStatusException(u"Unknown output status from Livy: '{}'"
-                                                        .format(statement_output[u"status"]))
+            else:
+                session.record_statement_completion(time() - start_time)
+                return self._parse_statement_output(statement)
+
+    @gen.coroutine
+    def _get_statement_output_async(self, session, statement_id):
+        retries = 1
+        start_time = time()
+
+        while True:
+            statement = yield session.async_http_client.get_statement(session.id, statement_id)
+            status = statement[u"state"].lower()
+
+            self.logger.debug(u"Status of statement {} is {}.".format(statement_id, status))
+
+            if status not in FINAL_STATEMENT_STATUS:
+                yield session.sleep_async(retries, time() - start_time, statement.get(u"progress"))
+                retries += 1
+            else:
+                session.record_statement_completion(time() - start_time)
+                raise gen.Return(self._parse_statement_output(statement))
+
+    @staticmethod
+    def _parse_statement_output(statement):
+        statement_output = statement[u"output"]
+
+        if statement_output is None:
+            return (True, u"")
+
+        if statement_output[u"status"] == u"ok":
+            return (True, statement_output[u"data"][u"text/plain"])
+        elif statement_output[u"status"] == u"error":
+            return (False,
+                    statement_output[u"evalue"] + u"\n" + u"".join(statement_output[u"traceback"]))
+        else:
+            raise LivyUnexpectedStatusException(u"Unknown output status from Livy: '{}'"
+                                                .format(statement_output[u"status"]))
@@ -0,0 +1,231 @@
+# Distributed under the terms of the Modified BSD License.
+import hashlib
+import json
+import os
+import threading
+from time import time
+
+import pandas as pd
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+_PARQUET = u".parquet"
+_PICKLE = u".pkl"
+_META = u".json"
+
+
+class DiskResultCache(object):
+    """Keeps DataFrames pulled from Livy on disk, so they survive kernel restarts and notebook reopens.
+
+    Each entry is a data file named after the hash of its key, plus a small JSON file describing it. DataFrames
+    are written as Parquet when pyarrow is installed and every column round-trips through it, and pickled
+    otherwise. The data file's modification time is when the entry was written, and it expires ttl_seconds
+    later; the JSON file's modification time is when the entry was last read. Once the data files take more
+    than max_bytes, the least recently read entries are removed. A max_bytes of 0 disables the cache.
+
+    Callers key entries by endpoint and by the query or code and its sampling options, so a new session on the
+    same endpoint reuses them. With disk_result_cache_per_session on, the key also holds the session id, for
+    results that depend on a session's temporary views, and invalidate() drops a session's entries when it is
+    deleted."""
+
+    def __init__(self, path=None, max_bytes=None, ttl_seconds=None):
+        self.logger = SparkLog(u"DiskResultCache")
+
+        self._path = path
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        path = self._path if self._path is not None else conf.disk_result_cache_path()
+        return os.path.expanduser(path)
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes if self._max_bytes is not None else conf.disk_result_cache_max_bytes()
+
+    @property
+    def ttl_seconds(self):
+        return self._ttl_seconds if self._ttl_seconds is not None else conf.disk_result_cache_ttl_seconds()
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def session_id(session):
+        """The session id entries from session are keyed by, or None when every session shares them."""
+        return session.id if conf.disk_result_cache_per_session() else None
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode(u"utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data_path = self._data_path(key)
+            if data_path is None or self._expired(data_path):
+                self.misses += 1
+                return None
+            try:
+                if data_path.endswith(_PARQUET):
+                    df = pd.read_parquet(data_path)
+                else:
+                    df = pd.read_pickle(data_path)
+            except Exception as e:
+                self.logger.error(u"Could not read cached result {}: {}".format(data_path, e))
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._touch(self._file(key, _META))
+            self.hits += 1
+            return df
+
+    def put(self, key, df, description=u"", endpoint_url=None, session_id=None):
+        """Stores df under key. The cache is best effort: a failed write is logged and the entry dropped."""
+        with self._lock:
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                self._remove(key)
+                data_path = self._write(key, df)
+                with open(self._file(key, _META), u"w") as f:
+                    json.dump({u"description": description, u"rows": len(df), u"columns": len(df.columns),
+                               u"format": data_path[data_path.rindex(u".") + 1:], u"endpoint_url": endpoint_url,
+                               u"session_id": session_id}, f)
+                self._evict()
+            except (IOError, OSError) as e:
+                self.logger.error(u"Could not cache result in {}: {}".format(self.path, e))
+                self._remove(key)
+
+    def entries(self):
+        """Returns a dict per live entry, most recently read first."""
+        with self._lock:
+            self._evict()
+            return self._entries()
+
+    def invalidate(self, endpoint_url, session_id=None):
+        """Drops the entries of one session, or of every session on the endpoint if session_id is None."""
+        with self._lock:
+            for entry in self._entries():
+                if entry.get(u"endpoint_url") == endpoint_url and \
+                        (session_id is None or entry.get(u"session_id") == session_id):
+                    self._remove(entry[u"key"])
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries():
+                self._remove(entry[u"key"])
+
+    def stats(self):
+        entries = self.entries()
+        return {u"path": self.path, u"entries": len(entries), u"bytes": sum(e[u"bytes"] for e in entries),
+                u"max_bytes": self.max_bytes, u"ttl_seconds": self.ttl_seconds, u"hits": self.hits,
+                u"misses": self.misses}
+
+    def _write(self, key, df):
+        """Writes to a temporary file and renames it, so readers never see a partial file."""
+        if _parquet_safe(df):
+            temporary_path = self._file(key, _PARQUET + u".tmp")
+            try:
+                df.to_parquet(temporary_path, engine=u"pyarrow")
+                return self._rename(temporary_path, self._file(key, _PARQUET))
+            except (ValueError, TypeError, NotImplementedError) as e:
+                self.logger.debug(u"Could not write result as Parquet, pickling it instead: {}".format(e))
+        temporary_path = self._file(key, _PICKLE + u".tmp")
+        df.to_pickle(temporary_path)
+        return self._rename(temporary_path, self._file(key, _PICKLE))
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for name in os.listdir(self.path):
+            if not name.endswith(_META):
+                continue
+            key = name[:-len(_META)]
+            data_path = self._data_path(key)
+            if data_path is None:
+                continue
+            meta_path = self._file(key, _META)
+            try:
+                with open(meta_path) as f:
+                    entry = json.load(f)
+                entry.update({u"key": key, u"bytes": os.path.getsize(data_path),
+                              u"created": os.path.getmtime(data_path), u"accessed": os.path.getmtime(meta_path)})
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append(entry)
+        return sorted(entries, key=lambda e: e[u"accessed"], reverse=True)
+
+    def _evict(self):
+        total = 0
+        for entry in self._entries():
+            if self._expired(self._data_path(entry[u"key"])) or total + entry[u"bytes"] > self.max_bytes:
+                self._remove(entry[u"key"])
+            else:
+                total += entry[u"bytes"]
+
+    def _expired(self, data_path):
+        return time() - os.path.getmtime(data_path) > self.ttl_seconds
+
+    def _data_path(self, key):
+        for extension in (_PARQUET, _PICKLE):
+            path = self._file(key, extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _file(self, key, extension):
+        return os.path.join(self.path, key + extension)
+
+    def _remove(self, key):
+        for extension in (_PARQUET, _PICKLE, _META):
+            try:
+                os.remove(self._file(key, extension))
+            except OSError:
+                pass
+
+    @staticmethod
+    def _rename(source, destination):
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+        return destination
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+
+def _parquet_safe(df):
+    """Parquet needs pyarrow and string column names, and reads lists and dicts back as other types, so only
+    frames whose object columns hold strings are written as Parquet."""
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    if not all(isinstance(column_name, str) for column_name in df.columns):
+        return False
+    return all(pd.api.types.infer_dtype(df[column_name], skipna=True) in (u"string", u"empty")
+               for column_name in df.columns if df[column_name].dtype == object)
+
+
+_disk_result_cache = None
+_disk_result_cache_lock = threading.Lock()
+
+
+def get_disk_result_cache():
+    """Returns the process-wide DiskResultCache."""
+    global _disk_result_cache
+    with _disk_result_cache_lock:
+        if _disk_result_cache is None:
+            _disk_result_cache = DiskResultCache()
+        return _disk_result_cache
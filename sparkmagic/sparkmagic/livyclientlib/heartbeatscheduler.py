@@ -0,0 +1,123 @@
+# Distributed under the terms of the Modified BSD License.
+import heapq
+import itertools
+import random
+import threading
+from time import time
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+class HeartbeatScheduler(object):
+    """Keeps Livy sessions alive from a single daemon thread per process.
+
+    Sessions are grouped by endpoint and each endpoint has one entry in a heap ordered by due time. When an
+    endpoint is due, all of its sessions are refreshed together, so a shared SessionStatusPoller can serve them
+    with a single request. Every new due time gets a random jitter of up to heartbeat_jitter_seconds so that
+    many kernels do not hit Livy at the same instant.
+
+    An endpoint keeps its heap entry while it is due or being refreshed, even if its last session is removed
+    in the meantime, so that adding a session back does not give the endpoint a second entry."""
+
+    def __init__(self):
+        self.logger = SparkLog(u"HeartbeatScheduler")
+
+        self._sessions = dict()
+        self._heap = []
+        # Endpoints that have an entry in the heap, or whose heartbeat is being sent.
+        self._scheduled = set()
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, session):
+        with self._condition:
+            self.logger.info(u'Starting heartbeat for session {}'.format(session.id))
+            endpoint = session.endpoint
+            if endpoint not in self._sessions:
+                self._sessions[endpoint] = []
+            if endpoint not in self._scheduled:
+                self._schedule(endpoint, conf.heartbeat_refresh_seconds())
+            if session not in self._sessions[endpoint]:
+                self._sessions[endpoint].append(session)
+            self._start_thread()
+            self._condition.notify()
+
+    def remove(self, session):
+        with self._condition:
+            self.logger.info(u'Stopping heartbeat for session {}'.format(session.id))
+            sessions = self._sessions.get(session.endpoint, [])
+            if session in sessions:
+                sessions.remove(session)
+            if not sessions:
+                # The endpoint's heap entry is dropped the next time it comes due.
+                self._sessions.pop(session.endpoint, None)
+
+    def sessions(self):
+        with self._condition:
+            return [s for sessions in self._sessions.values() for s in sessions]
+
+    def run_pending(self, now=None):
+        """Sends the heartbeats that are due. Returns the number of endpoints that were refreshed."""
+        due = []
+        with self._condition:
+            if now is None:
+                now = time()
+            while self._heap and self._heap[0][0] <= now:
+                (_, _, endpoint) = heapq.heappop(self._heap)
+                if endpoint in self._sessions:
+                    due.append((endpoint, list(self._sessions[endpoint])))
+                else:
+                    self._scheduled.discard(endpoint)
+
+        for (endpoint, sessions) in due:
+            delay = conf.heartbeat_refresh_seconds()
+            for session in sessions:
+                try:
+                    session.refresh_status_and_info()
+                except Exception as e:
+                    session.logger.error(u'{}'.format(e))
+                    delay = conf.heartbeat_retry_seconds()
+
+            with self._condition:
+                if endpoint in self._sessions:
+                    self._schedule(endpoint, delay)
+                else:
+                    self._scheduled.discard(endpoint)
+        return len(due)
+
+    def _schedule(self, endpoint, delay):
+        due_time = time() + delay + random.uniform(0, conf.heartbeat_jitter_seconds())
+        heapq.heappush(self._heap, (due_time, next(self._counter), endpoint))
+        self._scheduled.add(endpoint)
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=u"HeartbeatScheduler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                wait_seconds = self._heap[0][0] - time()
+                if wait_seconds > 0:
+                    self._condition.wait(wait_seconds)
+                    continue
+            self.run_pending()
+
+
+_heartbeat_scheduler = None
+_heartbeat_scheduler_lock = threading.Lock()
+
+
+def get_heartbeat_scheduler():
+    """Returns the process-wide HeartbeatScheduler."""
+    global _heartbeat_scheduler
+    with _heartbeat_scheduler_lock:
+        if _heartbeat_scheduler is None:
+            _heartbeat_scheduler = HeartbeatScheduler()
+        return _heartbeat_scheduler
@@ -18,8 +18,7 @@ class LivyReliableHttpClient(object):
 
     @staticmethod
     def from_endpoint(endpoint):
-        headers = {"Content-Type": "application/json" }
-        headers.update(conf.custom_headers())
+        headers = LivyReliableHttpClient._get_headers()
         retry_policy = LivyReliableHttpClient._get_retry_policy()
         return LivyReliableHttpClient(ReliableHttpClient(endpoint, headers, retry_policy), endpoint)
 
@@ -47,6 +46,9 @@ class LivyReliableHttpClient(object):
     def get_headers(self):
         return self._http_client.get_headers()
 
+    def close(self):
+        self._http_client.close()
+
     @staticmethod
     def _session_url(session_id):
         return "/sessions/{}".format(session_id)
@@ -59,6 +61,12 @@ class LivyReliableHttpClient(object):
     def _statement_url(session_id, statement_id):
         return "/sessions/{}/statements/{}".format(session_id, statement_id)
 
+    @staticmethod
+    def _get_headers():
+        headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip" }
+        headers.update(conf.custom_headers())
+        return headers
+
     @staticmethod
     def _get_retry_policy():
         policy = conf.retry_policy()
@@ -1,8 +1,9 @@
 ﻿# Distributed under the terms of the Modified BSD License.
-import threading
+import json
 from time import sleep, time
 
 from hdijupyterutils.guid import ObjectWithGuid
+from tornado import gen
 
 import sparkmagic.utils.configuration as conf
 import sparkmagic.utils.constants as constants
@@ -10,53 +11,20 @@ from sparkmagic.utils.sparklogger import SparkLog
 from sparkmagic.utils.sparkevents import SparkEvents
 from sparkmagic.utils.utils import get_sessions_info_html
 from .configurableretrypolicy import ConfigurableRetryPolicy
+from .adaptivepollingpolicy import AdaptivePollingPolicy
+from .asynclivyreliablehttpclient import AsyncLivyReliableHttpClient
 from .command import Command
+from .heartbeatscheduler import get_heartbeat_scheduler
+from .resultcache import get_result_cache
+from .diskresultcache import get_disk_result_cache
 from .exceptions import LivyClientTimeoutException, \
     LivyUnexpectedStatusException, BadUserDataException, SqlContextNotFoundException
 
 
-class _HeartbeatThread(threading.Thread):
-    def __init__(self, livy_session, refresh_seconds, retry_seconds, run_at_most=None):
-        super(_HeartbeatThread, self).__init__()
-        
-        self.livy_session = livy_session
-        self.refresh_seconds = refresh_seconds
-        self.retry_seconds = retry_seconds
-        self.run_at_most = run_at_most
-
-    def run(self):
-        i = 0
-        if self.livy_session is not None:
-            self.livy_session.logger.info(u'Starting heartbeat for session {}'.format(self.livy_session.id))
-        else:
-            self.livy_session.logger.info(u'Will not start heartbeat because session is none')
-        
-        while self.livy_session is not None:
-            try:
-                self.livy_session.refresh_status_and_info()
-                sleep(self.refresh_seconds)
-            except Exception as e:
-                self.livy_session.logger.error(u'{}'.format(e))
-                sleep(self.retry_seconds)
-            
-            if self.run_at_most is not None:
-                i += 1
-                
-                if i >= self.run_at_most:
-                    return
-
-    def stop(self):
-        if self.livy_session is not None:
-            self.livy_session.logger.info(u'Stopping heartbeat for session {}'.format(self.livy_session.id))
-        
-        self.livy_session = None
-        self.join()
-
-
 class LivySession(ObjectWithGuid):
     def __init__(self, http_client, properties, ipython_display,
                  session_id=-1, spark_events=None,
-                 heartbeat_timeout=0, heartbeat_thread=None):
+                 heartbeat_timeout=0, heartbeat_scheduler=None, status_poller=None):
         super(LivySession, self).__init__()
         assert constants.LIVY_KIND_PARAM in list(properties.keys())
         kind = properties[constants.LIVY_KIND_PARAM]
@@ -71,13 +39,18 @@ class LivySession(ObjectWithGuid):
         self.properties = properties
         self.ipython_display = ipython_display
         self._should_heartbeat = should_heartbeat
-        self._user_passed_heartbeat_thread = heartbeat_thread
+        if heartbeat_scheduler is None:
+            heartbeat_scheduler = get_heartbeat_scheduler()
+        self._heartbeat_scheduler = heartbeat_scheduler
+        self._heartbeating = False
 
         if spark_events is None:
             spark_events = SparkEvents()
         self._spark_events = spark_events
 
         self._policy = ConfigurableRetryPolicy(retry_seconds_to_sleep_list=[0.2, 0.5, 0.5, 1, 1, 2], max_retries=5000)
+        self._statement_polling_policy = AdaptivePollingPolicy(conf.statement_poll_min_seconds(),
+                                                               conf.statement_poll_max_seconds())
         wait_for_idle_timeout_seconds = conf.wait_for_idle_timeout_seconds()
 
         assert wait_for_idle_timeout_seconds > 0
@@ -92,19 +65,25 @@ class LivySession(ObjectWithGuid):
         self._app_id = None
         self._logs = u""
         self._http_client = http_client
+        self._async_http_client = None
+        self._status_poller = status_poller
         self._wait_for_idle_timeout_seconds = wait_for_idle_timeout_seconds
         self._printed_resource_warning = False
 
         self.kind = kind
         self.id = session_id
         self.session_info = u""
-        
-        self._heartbeat_thread = None
+        # The session JSON Livy last returned, and when, so accessors need not fetch it again.
+        self._session_json = None
+        self._session_json_time = 0
+        # What the session probe reported when the session started; empty if it could not run.
+        self.spark_info = {}
+
         if session_id == -1:
             self.status = constants.NOT_STARTED_SESSION_STATUS
         else:
             self.status = constants.BUSY_SESSION_STATUS
-            self._start_heartbeat_thread()
+            self._start_heartbeat()
 
     def __str__(self):
         return u"Session id: {}\tYARN id: {}\tKind: {}\tState: {}\n\tSpark UI: {}\n\tDriver Log: {}"\
@@ -112,18 +91,28 @@ class LivySession(ObjectWithGuid):
 
     def start(self):
         """Start the session against actual livy server."""
+        self._start(lambda: self._http_client.post_session(self.properties))
+
+    def attach(self, session_id):
+        """Takes over a session that was created elsewhere, such as one claimed from the session pool, instead
+        of creating a new one. Waits for it to be idle like start() does."""
+        self._start(lambda: self._http_client.get_session(session_id))
+
+    def _start(self, create_session):
         self._spark_events.emit_session_creation_start_event(self.guid, self.kind)
         self._printed_resource_warning = False
 
         try:
-            r = self._http_client.post_session(self.properties)
+            r = create_session()
             self.id = r[u"id"]
             self.status = str(r[u"state"])
+            if self._status_poller is not None:
+                self._status_poller.register(self)
 
             self.ipython_display.writeln(u"Starting Spark application")
             
-            # Start heartbeat thread to keep Livy interactive session alive.
-            self._start_heartbeat_thread()
+            # Register with the heartbeat scheduler to keep Livy interactive session alive.
+            self._start_heartbeat()
             
             # We wait for livy_session_startup_timeout_seconds() for the session to start up.
             try:
@@ -135,24 +124,20 @@ class LivySession(ObjectWithGuid):
             html = get_sessions_info_html([self], self.id)
             self.ipython_display.html(html)
 
-            command = Command("spark")
-            (success, out) = command.execute(self)
-
-            if success:
-                self.ipython_display.writeln(u"SparkSession available as 'spark'.")
-                self.sql_context_variable_name = "spark"
+            info = self._probe()
+            if info is not None:
+                self.spark_info = info
+                if info.get(u"appId"):
+                    self._app_id = info[u"appId"]
+                self._use_sql_context(info.get(u"spark"), info.get(u"sqlContext"), info.get(u"hive"))
             else:
-                command = Command("sqlContext")
-                (success, out) = command.execute(self)
+                # Sessions where the probe cannot run are checked one context variable at a time.
+                (success, out) = Command("spark").execute(self)
                 if success:
-                    self.ipython_display.writeln(u"SparkContext available as 'sc'.")
-                    if ("hive" in out.lower()):
-                        self.ipython_display.writeln(u"HiveContext available as 'sqlContext'.")
-                    else:
-                        self.ipython_display.writeln(u"SqlContext available as 'sqlContext'.")
-                    self.sql_context_variable_name = "sqlContext"
+                    self._use_sql_context(True, False, False)
                 else:
-                    raise SqlContextNotFoundException(u"Neither SparkSession nor HiveContext/SqlContext is available.")
+                    (success, out) = Command("sqlContext").execute(self)
+                    self._use_sql_context(False, success, success and "hive" in out.lower())
         except Exception as e:
             self._spark_events.emit_session_creation_end_event(self.guid, self.kind, self.id, self.status,
                                                                False, e.__class__.__name__, str(e))
@@ -160,15 +145,59 @@ class LivySession(ObjectWithGuid):
         else:
             self._spark_events.emit_session_creation_end_event(self.guid, self.kind, self.id, self.status, True, "", "")
 
+    def _probe(self):
+        """Runs the session probe, a single statement reporting the context variables, Hive support, Spark
+        version and application id and UI URL. Returns what it reported, or None if it did not run."""
+        if self.kind == constants.SESSION_KIND_SPARK:
+            code = constants.SCALA_SESSION_PROBE
+        elif self.kind == constants.SESSION_KIND_SPARKR:
+            code = constants.R_SESSION_PROBE
+        else:
+            code = constants.PYSPARK_SESSION_PROBE
+        (success, out) = Command(code).execute(self)
+        if not success:
+            return None
+        try:
+            info = json.loads([line for line in out.splitlines() if line.strip()][-1])
+        except (ValueError, IndexError):
+            return None
+        return info if isinstance(info, dict) else None
+
+    def _use_sql_context(self, spark, sql_context, hive):
+        if spark:
+            self.ipython_display.writeln(u"SparkSession available as 'spark'.")
+            self.sql_context_variable_name = "spark"
+        elif sql_context:
+            self.ipython_display.writeln(u"SparkContext available as 'sc'.")
+            if hive:
+                self.ipython_display.writeln(u"HiveContext available as 'sqlContext'.")
+            else:
+                self.ipython_display.writeln(u"SqlContext available as 'sqlContext'.")
+            self.sql_context_variable_name = "sqlContext"
+        else:
+            raise SqlContextNotFoundException(u"Neither SparkSession nor HiveContext/SqlContext is available.")
+
     def get_app_id(self):
         if self._app_id is None:
-            self._app_id = self._http_client.get_session(self.id).get("appId")
+            self._app_id = self._get_session_json().get("appId")
         return self._app_id
 
     def get_app_info(self):
-        appInfo = self._http_client.get_session(self.id).get("appInfo")
+        appInfo = self._get_session_json().get("appInfo")
         return appInfo if appInfo is not None else {}
 
+    def _get_session_json(self):
+        """Returns the session JSON from the last status refresh, refreshing first if it is older than
+        session_info_max_age_seconds."""
+        if self._session_json is None or \
+                time() - self._session_json_time >= conf.session_info_max_age_seconds():
+            self._set_session_json(self._http_client.get_session(self.id))
+        return self._session_json
+
+    def _set_session_json(self, response):
+        self._session_json = response
+        self._session_json_time = time()
+
     def get_app_info_member(self, member_name):
         return self.get_app_info().get(member_name)
 
@@ -181,12 +210,22 @@ class LivySession(ObjectWithGuid):
         return self._logs
 
     def get_spark_ui_url(self):
-        return self.get_app_info_member("sparkUiUrl")
+        url = self.get_app_info_member("sparkUiUrl")
+        if url is None:
+            # Livy only knows the UI URL of applications it can look up, e.g. on YARN.
+            url = self.spark_info.get(u"uiUrl")
+        return url
 
     @property
     def http_client(self):
         return self._http_client
 
+    @property
+    def async_http_client(self):
+        if self._async_http_client is None:
+            self._async_http_client = AsyncLivyReliableHttpClient.from_endpoint(self.endpoint)
+        return self._async_http_client
+
     @property
     def endpoint(self):
         return self._http_client.endpoint
@@ -204,9 +243,14 @@ class LivySession(ObjectWithGuid):
             
             if self.status != constants.NOT_STARTED_SESSION_STATUS:
                 self._http_client.delete_session(session_id)
-                self._stop_heartbeat_thread()
+                self._stop_heartbeat()
+                if self._status_poller is not None:
+                    self._status_poller.unregister(self)
                 self.status = constants.DEAD_SESSION_STATUS
                 self.id = -1
+                get_result_cache().invalidate(self.endpoint.url, session_id)
+                if conf.disk_result_cache_per_session():
+                    get_disk_result_cache().invalidate(self.endpoint.url, session_id)
             else:
                 self.ipython_display.send_error(u"Cannot delete session {} that is in state '{}'."
                                                 .format(session_id, self.status))
@@ -230,26 +274,33 @@ class LivySession(ObjectWithGuid):
         retries = 1
         while True:
             self.refresh_status_and_info()
-            if self.status == constants.IDLE_SESSION_STATUS:
+            if self._is_idle(seconds_to_wait):
                 return
 
-            if self.status in constants.FINAL_STATUS:
-                error = u"Session {} unexpectedly reached final status '{}'."\
-                    .format(self.id, self.status)
-                self.logger.error(error)
-                raise LivyUnexpectedStatusException(u'{} See logs:\n{}'.format(error, self.get_logs()))
+            start_time = time()
+            sleep_time = self._policy.seconds_to_sleep(retries)
+            retries += 1
+
+            self.logger.debug(u"Session {} in state {}. Sleeping {} seconds."
+                              .format(self.id, self.status, sleep_time))
+            sleep(sleep_time)
+            seconds_to_wait -= time() - start_time
+
+    @gen.coroutine
+    def wait_for_idle_async(self, seconds_to_wait=None):
+        """Non-blocking version of wait_for_idle. Yields to the event loop instead of sleeping.
 
-            if seconds_to_wait <= 0.0:
-                error = u"Session {} did not reach idle status in time. Current status is {}."\
-                    .format(self.id, self.status)
-                self.logger.error(error)
-                raise LivyClientTimeoutException(error)
+        Parameters:
+            seconds_to_wait : number of seconds to wait before giving up.
+        """
+        if seconds_to_wait is None:
+            seconds_to_wait = self._wait_for_idle_timeout_seconds
 
-            if constants.YARN_RESOURCE_LIMIT_MSG in self.session_info and \
-                not self._printed_resource_warning:
-                self.ipython_display.send_error(constants.RESOURCE_LIMIT_WARNING\
-                                                .format(conf.resource_limit_mitigation_suggestion()))
-                self._printed_resource_warning = True
+        retries = 1
+        while True:
+            yield self.refresh_status_and_info_async()
+            if self._is_idle(seconds_to_wait):
+                return
 
             start_time = time()
             sleep_time = self._policy.seconds_to_sleep(retries)
@@ -257,42 +308,86 @@ class LivySession(ObjectWithGuid):
 
             self.logger.debug(u"Session {} in state {}. Sleeping {} seconds."
                               .format(self.id, self.status, sleep_time))
-            sleep(sleep_time)
+            yield gen.sleep(sleep_time)
             seconds_to_wait -= time() - start_time
 
-    def sleep(self, retries):
-        sleep(self._policy.seconds_to_sleep(retries))
+    def _is_idle(self, seconds_to_wait):
+        """Returns True if the session is idle, False if it is worth waiting longer, and raises if the
+        session reached a final status or there is no time left to wait."""
+        if self.status == constants.IDLE_SESSION_STATUS:
+            return True
+
+        if self.status in constants.FINAL_STATUS:
+            error = u"Session {} unexpectedly reached final status '{}'."\
+                .format(self.id, self.status)
+            self.logger.error(error)
+            raise LivyUnexpectedStatusException(u'{} See logs:\n{}'.format(error, self.get_logs()))
+
+        if seconds_to_wait <= 0.0:
+            error = u"Session {} did not reach idle status in time. Current status is {}."\
+                .format(self.id, self.status)
+            self.logger.error(error)
+            raise LivyClientTimeoutException(error)
+
+        if constants.YARN_RESOURCE_LIMIT_MSG in self.session_info and \
+            not self._printed_resource_warning:
+            self.ipython_display.send_error(constants.RESOURCE_LIMIT_WARNING\
+                                            .format(conf.resource_limit_mitigation_suggestion()))
+            self._printed_resource_warning = True
+
+        return False
+
+    def sleep(self, retries, elapsed_seconds=0, progress=None):
+        """Sleeps before polling a running statement again. See AdaptivePollingPolicy."""
+        sleep(self._statement_polling_policy.seconds_to_sleep(retries, elapsed_seconds, progress))
+
+    def sleep_async(self, retries, elapsed_seconds=0, progress=None):
+        return gen.sleep(self._statement_polling_policy.seconds_to_sleep(retries, elapsed_seconds, progress))
+
+    def record_statement_completion(self, elapsed_seconds):
+        self._statement_polling_policy.record_completion(elapsed_seconds)
 
     # This function will refresh the status and get the logs in a single call.
     # Only the status will be returned as the return value.
     def refresh_status_and_info(self):
-        response = self._http_client.get_session(self.id)
+        if self._status_poller is not None:
+            response = self._status_poller.get_session(self.id)
+        else:
+            response = self._http_client.get_session(self.id)
+        self.update_status_and_info(response)
+
+    @gen.coroutine
+    def refresh_status_and_info_async(self):
+        response = yield self.async_http_client.get_session(self.id)
+        self.update_status_and_info(response)
+
+    def update_status_and_info(self, response):
         status = response[u'state']
         log_array = response[u'log']
 
         if status in constants.POSSIBLE_SESSION_STATUS:
             self.status = status
             self.session_info = u"\n".join(log_array)
+            self._set_session_json(response)
         else:
            raise LivyUnexpectedStatusException(u"Status '{}' not supported by session.".format(status))
 
-    def _start_heartbeat_thread(self):
-        if self._should_heartbeat and self._heartbeat_thread is None:
-            refresh_seconds = conf.heartbeat_refresh_seconds()
-            retry_seconds = conf.heartbeat_retry_seconds()
-            
-            if self._user_passed_heartbeat_thread is None:
-                self._heartbeat_thread = _HeartbeatThread(self, refresh_seconds, retry_seconds)
-            else:
-                self._heartbeat_thread = self._user_passed_heartbeat_thread
-            
-            self._heartbeat_thread.daemon = True
-            self._heartbeat_thread.start()
-
-    def _stop_heartbeat_thread(self):
-        if self._heartbeat_thread is not None:
-            self._heartbeat_thread.stop()
-            self._heartbeat_thread = None
+    def _start_heartbeat(self):
+        if self._should_heartbeat and not self._heartbeating:
+            self._heartbeat_scheduler.add(self)
+            self._heartbeating = True
+
+    def detach(self):
+        """Stops the heartbeats and status polling for the session, without deleting it. For a session that
+        failed to attach, so it is not kept alive and refreshed for the life of the kernel."""
+        self._stop_heartbeat()
+        if self._status_poller is not None:
+            self._status_poller.unregister(self)
+
+    def _stop_heartbeat(self):
+        if self._heartbeating:
+            self._heartbeat_scheduler.remove(self)
+            self._heartbeating = False
 
     def get_row_html(self, current_session_id):
         return u"""<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td><td>{6}</td></tr>""".format(
@@ -3,6 +3,7 @@
 import json
 from time import sleep
 import requests
+from requests.adapters import HTTPAdapter
 from requests_kerberos import HTTPKerberosAuth, REQUIRED
 
 import sparkmagic.utils.configuration as conf
@@ -11,10 +12,13 @@ from sparkmagic.utils.constants import MAGICS_LOGGER_NAME
 import sparkmagic.utils.constants as constants
 from sparkmagic.livyclientlib.exceptions import HttpClientException
 from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
+from sparkmagic.livyclientlib.cachedtokenkerberosauth import CachedTokenKerberosAuth
 
 
 class ReliableHttpClient(object):
-    """Http client that is reliable in its requests. Uses requests library."""
+    """Http client that is reliable in its requests. Uses requests library.
+    All requests go through a single requests.Session, so connections to the endpoint are kept alive
+    and pooled across calls instead of being set up again for every request."""
 
     def __init__(self, endpoint, headers, retry_policy):
         self._endpoint = endpoint
@@ -22,6 +26,8 @@ class ReliableHttpClient(object):
         self._retry_policy = retry_policy
         if self._endpoint.auth == constants.AUTH_KERBEROS:
             self._auth = HTTPKerberosAuth(mutual_authentication=REQUIRED)
+            if conf.kerberos_token_cache_seconds() > 0:
+                self._auth = CachedTokenKerberosAuth(self._auth, conf.kerberos_token_cache_seconds())
         elif self._endpoint.auth == constants.AUTH_BASIC:
             self._auth = (self._endpoint.username, self._endpoint.password)
         elif self._endpoint.auth != constants.NO_AUTH:
@@ -34,24 +40,37 @@ class ReliableHttpClient(object):
             self.logger.debug(u"ATTENTION: Will ignore SSL errors. This might render you vulnerable to attacks.")
             requests.packages.urllib3.disable_warnings()
 
+        self._session = self._create_session()
+
     def get_headers(self):
         return self._headers
 
+    def close(self):
+        """Closes all pooled connections held by this client."""
+        self._session.close()
+
     def compose_url(self, relative_url):
         r_u = "/{}".format(relative_url.rstrip(u"/").lstrip(u"/"))
         return self._endpoint.url + r_u
 
     def get(self, relative_url, accepted_status_codes):
         """Sends a get request. Returns a response."""
-        return self._send_request(relative_url, accepted_status_codes, requests.get)
+        return self._send_request(relative_url, accepted_status_codes, self._session.get)
 
     def post(self, relative_url, accepted_status_codes, data):
         """Sends a post request. Returns a response."""
-        return self._send_request(relative_url, accepted_status_codes, requests.post, data)
+        return self._send_request(relative_url, accepted_status_codes, self._session.post, data)
 
     def delete(self, relative_url, accepted_status_codes):
         """Sends a delete request. Returns a response."""
-        return self._send_request(relative_url, accepted_status_codes, requests.delete)
+        return self._send_request(relative_url, accepted_status_codes, self._session.delete)
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=conf.http_pool_connections(), pool_maxsize=conf.http_pool_maxsize())
+        session.mount(u"http://", adapter)
+        session.mount(u"https://", adapter)
+        return session
 
     def _send_request(self, relative_url, accepted_status_codes, function, data=None):
         return self._send_request_helper(self.compose_url(relative_url), accepted_status_codes, function, data, 0)
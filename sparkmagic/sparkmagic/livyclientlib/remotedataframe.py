@@ -0,0 +1,113 @@
+# Distributed under the terms of the Modified BSD License.
+import json
+
+from IPython.display import display
+
+import sparkmagic.utils.constants as constants
+from sparkmagic.utils.utils import split_schema_line
+from .command import Command
+from .sparkstorecommand import SparkStoreCommand
+from .exceptions import BadUserDataException
+
+
+class RemoteDataFrame(object):
+    """A handle to a DataFrame that stays in the Livy session.
+
+    Row counts, column names, head(), describe() and column selection each run a small statement against the
+    session, so only their results are transferred. The rows are only pulled, with the sampling options the
+    handle was created with, by to_pandas() or when the handle is displayed. The handle refers to the remote
+    variable by name, so it reflects whatever the variable holds when it is used, except for the column names:
+    they are fetched once and kept, so call refresh() after reassigning the variable to a different schema."""
+
+    def __init__(self, spark_controller, session_name, dataframe, samplemethod=None, maxrows=None,
+                 samplefraction=None, coerce=None, stratify=None):
+        self._spark_controller = spark_controller
+        self._session_name = session_name
+        self.dataframe = dataframe
+        self.samplemethod = samplemethod
+        self.maxrows = maxrows
+        self.samplefraction = samplefraction
+        self._coerce = coerce
+        self.stratify = stratify
+        self._columns = None
+
+    @property
+    def kind(self):
+        return self._spark_controller.get_session_by_name_or_default(self._session_name).kind
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            (fields, _) = split_schema_line(self._run(self._schema_print()))
+            self._columns = [name for (name, _) in fields]
+        return list(self._columns)
+
+    def refresh(self):
+        """Forgets the column names, so the next use fetches them from the session again."""
+        self._columns = None
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    def __len__(self):
+        return int(self._run(self._count_print()).strip())
+
+    def __getitem__(self, columns):
+        """Selects one column or a list of columns, on the remote side."""
+        if not isinstance(columns, list):
+            columns = [columns]
+        names = u", ".join(json.dumps(column) for column in columns)
+        if self.kind == constants.SESSION_KIND_SPARKR:
+            dataframe = u'select({}, {})'.format(self.dataframe, names)
+        else:
+            dataframe = u'{}.select({})'.format(self.dataframe, names)
+        return RemoteDataFrame(self._spark_controller, self._session_name, dataframe, self.samplemethod,
+                               self.maxrows, self.samplefraction, self._coerce, self.stratify)
+
+    def head(self, n=5):
+        return self._store(self.dataframe, u'take', n)
+
+    def describe(self):
+        if self.kind == constants.SESSION_KIND_SPARKR:
+            dataframe = u'describe({})'.format(self.dataframe)
+        else:
+            dataframe = u'{}.describe()'.format(self.dataframe)
+        return self._store(dataframe, u'take', -1)
+
+    def to_pandas(self):
+        return self._store(self.dataframe, self.samplemethod, self.maxrows, self.samplefraction, self.stratify)
+
+    def _ipython_display_(self):
+        # Shown through the pandas display path, so autoviz handles it like any -o output.
+        display(self.to_pandas())
+
+    def __repr__(self):
+        return u'RemoteDataFrame({})'.format(self.dataframe)
+
+    def _store(self, dataframe, samplemethod, maxrows, samplefraction=None, stratify=None):
+        command = SparkStoreCommand(dataframe, samplemethod, maxrows, samplefraction, coerce=self._coerce,
+                                    stratify=stratify)
+        return self._spark_controller.run_command(command, self._session_name)
+
+    def _run(self, command):
+        (success, out) = self._spark_controller.run_command(command, self._session_name)
+        if not success:
+            raise BadUserDataException(out)
+        return out
+
+    def _schema_print(self):
+        kind = self.kind
+        if kind == constants.SESSION_KIND_SPARK:
+            return Command(constants.SCALA_SCHEMA_PRINT.format(self.dataframe))
+        elif kind == constants.SESSION_KIND_SPARKR:
+            return Command(constants.R_SCHEMA_PRINT.format(self.dataframe))
+        return Command(constants.PYSPARK_SCHEMA_PRINT.format(self.dataframe))
+
+    def _count_print(self):
+        kind = self.kind
+        if kind == constants.SESSION_KIND_SPARK:
+            return Command(u'println({}.count())'.format(self.dataframe))
+        elif kind == constants.SESSION_KIND_SPARKR:
+            return Command(u'cat(count({}))'.format(self.dataframe))
+        return Command(u'print({}.count())'.format(self.dataframe))
@@ -0,0 +1,90 @@
+# Distributed under the terms of the Modified BSD License.
+import threading
+from collections import OrderedDict
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+class ResultCache(object):
+    """Keeps the DataFrames of recent SQL queries in memory, so re-running a query against the same session
+    does not go back to Livy.
+
+    Entries are keyed by endpoint URL and session id first, so all of a session's entries can be dropped
+    when it is deleted. The least recently used entries are evicted once the DataFrames together take more
+    than max_bytes. A max_bytes of 0 disables the cache."""
+
+    def __init__(self, max_bytes=None):
+        self.logger = SparkLog(u"ResultCache")
+
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            return conf.sql_result_cache_max_bytes()
+        return self._max_bytes
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Returns a copy of the cached DataFrame, or None. Copies keep in-place changes made by the user
+        out of the cache."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            return entry[0].copy()
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                self.logger.debug(u"Not caching a result of {} bytes.".format(size))
+                return
+            self._entries[key] = (df.copy(), size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, endpoint_url, session_id=None):
+        """Drops the entries of one session, or of every session on the endpoint if session_id is None."""
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key[0] == endpoint_url and (session_id is None or key[1] == session_id)]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide ResultCache."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
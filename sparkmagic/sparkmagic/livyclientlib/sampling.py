@@ -0,0 +1,109 @@
+# Distributed under the terms of the Modified BSD License.
+import json
+
+import sparkmagic.utils.constants as constants
+from .exceptions import BadUserDataException
+
+
+def validate_sampling(samplemethod, stratify):
+    if samplemethod not in constants.SAMPLE_METHODS:
+        raise BadUserDataException(u'samplemethod (-m) must be one of ({})'
+                                   .format(u', '.join(constants.SAMPLE_METHODS)))
+    if samplemethod == constants.SAMPLE_METHOD_STRATIFIED and not stratify:
+        raise BadUserDataException(u'samplemethod (-m) stratified needs a column to stratify by (--stratify)')
+
+
+def sampling_code(kind, dataframe, samplemethod, maxrows, samplefraction, stratify=None):
+    """Returns (setup, dataframe): code to run ahead of the statement, and an expression for the sampled
+    DataFrame. The samples are taken on the cluster, so only the selected rows are serialized:
+
+    * stratified: sampleBy the stratify column, with each of its values getting an equal share of maxrows, or
+      samplefraction of its rows when maxrows is negative. Rows where the column is null are left out.
+    * reservoir: exactly maxrows rows, picked uniformly by ordering on a random column, which Spark runs as
+      a per-partition top-k rather than a full sort.
+    * partition: the first maxrows / partitions rows of every partition.
+
+    take and sample are applied to the serialized rows by the callers, so for them the setup is empty and the
+    dataframe is returned unchanged, as it is for reservoir and partition when maxrows is negative."""
+    if samplemethod == constants.SAMPLE_METHOD_STRATIFIED:
+        builder = _STRATIFIED
+    elif samplemethod in (constants.SAMPLE_METHOD_RESERVOIR, constants.SAMPLE_METHOD_PARTITION) and maxrows >= 0:
+        builder = _RESERVOIR if samplemethod == constants.SAMPLE_METHOD_RESERVOIR else _PARTITION
+    else:
+        return (u'', dataframe)
+    if kind == constants.SESSION_KIND_SPARK:
+        language = u'scala'
+    elif kind == constants.SESSION_KIND_SPARKR:
+        language = u'r'
+    else:
+        language = u'python'
+    (setup, sampled) = builder[language]
+    names = {u'var': constants.LONG_RANDOM_VARIABLE_NAME, u'column': json.dumps(stratify),
+             u'maxrows': maxrows, u'fraction': samplefraction}
+    if samplemethod == constants.SAMPLE_METHOD_STRATIFIED:
+        setup = setup[maxrows >= 0]
+    setup = (_BIND_DATAFRAME[language] + setup).format(dataframe=dataframe, **names)
+    return (setup.rstrip(u'\n'), sampled.format(**names))
+
+
+def with_sampling_setup(kind, setup, code):
+    """Returns code preceded by the setup sampling_code returned. In Scala both go in one block, as the REPL
+    would otherwise echo each of the setup's vals into the statement output, ahead of the records."""
+    if not setup:
+        return code
+    if kind == constants.SESSION_KIND_SPARK:
+        return u'{{ {}\n{} }}'.format(setup, code)
+    return u'{}\n{}'.format(setup, code)
+
+
+_BIND_DATAFRAME = {
+    u'python': u'{var}_df = {dataframe}\n',
+    u'scala': u'val {var}_df = {dataframe}\n',
+    u'r': u'{var}_df <- {dataframe}\n',
+}
+
+# (setup when maxrows is negative, setup when it is not), sampled dataframe
+_STRATIFIED = {
+    u'python': ((u'{var}_fractions = dict((r[0], {fraction}) for r in '
+                 u'{var}_df.select({column}).distinct().collect() if r[0] is not None)\n',
+                 u'{var}_counts = [r for r in {var}_df.groupBy({column}).count().collect() if r[0] is not None]\n'
+                 u'{var}_share = max(1, {maxrows} // max(1, len({var}_counts)))\n'
+                 u'{var}_fractions = dict((r[0], min(1.0, float({var}_share) / r[1])) for r in {var}_counts)\n'),
+                u'{var}_df.sampleBy({column}, {var}_fractions)'),
+    u'scala': ((u'val {var}_fractions = {var}_df.select({column}).distinct().collect().filter(r => !r.isNullAt(0))'
+                u'.map(r => (r.get(0), {fraction})).toMap\n',
+                u'val {var}_counts = {var}_df.groupBy({column}).count().collect().filter(r => !r.isNullAt(0))\n'
+                u'val {var}_share = math.max(1, {maxrows} / math.max(1, {var}_counts.length))\n'
+                u'val {var}_fractions = {var}_counts.map(r => (r.get(0), math.min(1.0, {var}_share.toDouble / '
+                u'r.getLong(1)))).toMap\n'),
+               u'{var}_df.stat.sampleBy({column}, {var}_fractions, scala.util.Random.nextLong)'),
+    u'r': ((u'{var}_values <- collect(distinct(select({var}_df, {column})))[[1]]\n'
+            u'{var}_values <- {var}_values[!is.na({var}_values)]\n'
+            u'{var}_fractions <- as.list(rep({fraction}, length({var}_values)))\n'
+            u'names({var}_fractions) <- {var}_values\n',
+            u'{var}_counts <- collect(count(groupBy({var}_df, {column})))\n'
+            u'{var}_counts <- {var}_counts[!is.na({var}_counts[[1]]), ]\n'
+            u'{var}_share <- max(1, {maxrows} %/% max(1, nrow({var}_counts)))\n'
+            u'{var}_fractions <- as.list(pmin(1, {var}_share / {var}_counts$count))\n'
+            u'names({var}_fractions) <- {var}_counts[[1]]\n'),
+           u'sampleBy({var}_df, {column}, {var}_fractions, sample.int(.Machine$integer.max, 1))'),
+}
+
+_RESERVOIR = {
+    u'python': (u'from pyspark.sql.functions import rand as {var}_rand\n',
+                u'{var}_df.orderBy({var}_rand()).limit({maxrows})'),
+    u'scala': (u'', u'{var}_df.orderBy(org.apache.spark.sql.functions.rand()).limit({maxrows})'),
+    u'r': (u'', u'limit(orderBy({var}_df, rand()), {maxrows})'),
+}
+
+_PARTITION = {
+    u'python': (u'{var}_per_partition = -(-{maxrows} // max(1, {var}_df.rdd.getNumPartitions()))\n',
+                u'{var}_df.sql_ctx.createDataFrame({var}_df.rdd.mapPartitions('
+                u'lambda rows: __import__("itertools").islice(rows, {var}_per_partition)), {var}_df.schema)'),
+    u'scala': (u'val {var}_partitions = math.max(1, {var}_df.rdd.getNumPartitions)\n'
+               u'val {var}_per_partition = ({maxrows} + {var}_partitions - 1) / {var}_partitions\n',
+               u'{var}_df.sparkSession.createDataFrame({var}_df.rdd.mapPartitions(_.take({var}_per_partition)), '
+               u'{var}_df.schema)'),
+    u'r': (u'{var}_per_partition <- ceiling({maxrows} / max(1, getNumPartitions({var}_df)))\n',
+           u'dapply({var}_df, function(p) head(p, {var}_per_partition), schema({var}_df))'),
+}
@@ -0,0 +1,173 @@
+# Distributed under the terms of the Modified BSD License.
+import hashlib
+import json
+import os
+import threading
+
+import sparkmagic.utils.configuration as conf
+import sparkmagic.utils.constants as constants
+from sparkmagic.utils.sparklogger import SparkLog
+from .livyreliablehttpclient import LivyReliableHttpClient
+
+
+_ENTRY = u".json"
+_CLAIMED = u".claimed"
+
+
+class SessionPool(object):
+    """Keeps idle Livy sessions ready for kernels to claim, so a kernel does not wait for YARN to start a driver.
+
+    The pool is a directory shared by every process of the user, with one small JSON file per pooled session.
+    Files are named after a key made from the endpoint URL and the session properties, so a kernel only claims
+    a session created with the same kind and session_configs it would have used itself. A kernel claims a
+    session by renaming its file, which only one process can do. replenish() drops the sessions Livy no longer
+    has and creates new ones until each target has `size` sessions; the server extension runs it every
+    heartbeat_refresh_seconds, which also keeps the pooled sessions alive when a heartbeat timeout is set."""
+
+    def __init__(self, path=None, size=None):
+        self.logger = SparkLog(u"SessionPool")
+
+        self._path = path
+        self._size = size
+        self._http_clients = dict()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self):
+        path = self._path if self._path is not None else conf.session_pool_path()
+        return os.path.expanduser(path)
+
+    @property
+    def size(self):
+        return self._size if self._size is not None else conf.session_pool_size()
+
+    def enabled(self):
+        return self.size > 0
+
+    @staticmethod
+    def key(endpoint, properties):
+        return hashlib.sha256(json.dumps([endpoint.url, properties], sort_keys=True).encode(u"utf-8"))\
+            .hexdigest()[:32]
+
+    def claim(self, endpoint, properties):
+        """Returns the id of a pooled session for the endpoint and properties, which is no longer in the pool,
+        or None if the pool has none."""
+        key = self.key(endpoint, properties)
+        for (name, _) in self._entries(key):
+            claimed_path = os.path.join(self.path, u"{}.{}{}".format(name, os.getpid(), _CLAIMED))
+            try:
+                os.rename(os.path.join(self.path, name), claimed_path)
+            except OSError:
+                # Another kernel claimed it first.
+                continue
+            try:
+                with open(claimed_path) as f:
+                    return json.load(f)[u"id"]
+            except (IOError, OSError, ValueError, KeyError) as e:
+                self.logger.error(u"Could not read pooled session {}: {}".format(name, e))
+            finally:
+                self._remove(claimed_path)
+        return None
+
+    def replenish(self, targets):
+        """Tops up the pool for each (endpoint, properties) target."""
+        for (endpoint, properties) in targets:
+            try:
+                self._replenish(endpoint, properties)
+            except Exception as e:
+                self.logger.error(u"Could not replenish the session pool for {}: {}".format(endpoint.url, e))
+
+    def start(self, targets):
+        """Replenishes the pool from a daemon thread until stop() is called."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(targets,), name=u"SessionPool")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, targets):
+        while not self._stop.is_set():
+            self.replenish(targets)
+            self._stop.wait(conf.heartbeat_refresh_seconds())
+
+    def _replenish(self, endpoint, properties):
+        http_client = self._http_client(endpoint)
+        key = self.key(endpoint, properties)
+        states = dict((s[u"id"], s[u"state"]) for s in http_client.get_sessions()[u"sessions"])
+        pooled = 0
+        for (name, session_id) in self._entries(key):
+            if session_id not in states or states[session_id] in constants.FINAL_STATUS:
+                self.logger.debug(u"Dropping pooled session {} in state {}.".format(session_id,
+                                                                                   states.get(session_id)))
+                self._remove(os.path.join(self.path, name))
+                continue
+            pooled += 1
+            if conf.livy_server_heartbeat_timeout_seconds() > 0:
+                # Fetching a session is what counts as a heartbeat for Livy.
+                http_client.get_session(session_id)
+        for _ in range(self.size - pooled):
+            session_id = http_client.post_session(self._session_properties(properties))[u"id"]
+            self.logger.info(u"Added session {} to the session pool.".format(session_id))
+            self._add(key, endpoint, session_id)
+
+    def _add(self, key, endpoint, session_id):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        name = u"{}-{}{}".format(key, session_id, _ENTRY)
+        temporary_path = os.path.join(self.path, name + u".tmp")
+        with open(temporary_path, u"w") as f:
+            json.dump({u"url": endpoint.url, u"id": session_id}, f)
+        os.rename(temporary_path, os.path.join(self.path, name))
+
+    def _entries(self, key):
+        """Returns (file name, session id) of the sessions pooled under key, oldest session first."""
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        prefix = key + u"-"
+        for name in os.listdir(self.path):
+            if name.startswith(prefix) and name.endswith(_ENTRY):
+                try:
+                    entries.append((name, int(name[len(prefix):-len(_ENTRY)])))
+                except ValueError:
+                    continue
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def _http_client(self, endpoint):
+        if endpoint not in self._http_clients:
+            self._http_clients[endpoint] = LivyReliableHttpClient.from_endpoint(endpoint)
+        return self._http_clients[endpoint]
+
+    @staticmethod
+    def _session_properties(properties):
+        """Pooled sessions get the heartbeat timeout LivySession would have added."""
+        properties = dict(properties)
+        if conf.livy_server_heartbeat_timeout_seconds() > 0:
+            properties[constants.LIVY_HEARTBEAT_TIMEOUT_PARAM] = conf.livy_server_heartbeat_timeout_seconds()
+        return properties
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    """Returns the process-wide SessionPool."""
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = SessionPool()
+        return _session_pool
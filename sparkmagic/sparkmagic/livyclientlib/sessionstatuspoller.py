@@ -0,0 +1,67 @@
+# Distributed under the terms of the Modified BSD License.
+import threading
+from time import time
+
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+class SessionStatusPoller(object):
+    """Refreshes the status of every registered LivySession on one endpoint with a single GET /sessions.
+
+    Each fetch is fanned out to all registered sessions, and is reused by any session that asks for its
+    status again within max_age_seconds. With a single registered session the poller asks for that session
+    directly, since listing every session on the endpoint would cost more than it saves."""
+
+    def __init__(self, http_client, max_age_seconds):
+        self.logger = SparkLog(u"SessionStatusPoller")
+
+        self._http_client = http_client
+        self._max_age_seconds = max_age_seconds
+        self._sessions = dict()
+        self._responses = dict()
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def register(self, session):
+        with self._lock:
+            self._sessions[session.id] = session
+
+    def unregister(self, session):
+        with self._lock:
+            self._sessions.pop(session.id, None)
+            self._responses.pop(session.id, None)
+
+    def get_session(self, session_id):
+        """Returns the Livy JSON for the given session, fetching it only if the last fetch is too old."""
+        with self._lock:
+            if len(self._sessions) > 1:
+                if self._fetched_at is None or time() - self._fetched_at >= self._max_age_seconds:
+                    self._fetch()
+                response = self._responses.get(session_id)
+            else:
+                response = None
+
+        if response is None:
+            # The session is not part of the listing, e.g. it was created after the last fetch.
+            response = self._http_client.get_session(session_id)
+        return response
+
+    def update(self, sessions):
+        """Stores the sessions from a GET /sessions made elsewhere and fans them out."""
+        with self._lock:
+            self._store(sessions)
+
+    def _fetch(self):
+        self.logger.debug(u"Refreshing status of {} sessions.".format(len(self._sessions)))
+        self._store(self._http_client.get_sessions()[u"sessions"])
+
+    def _store(self, sessions):
+        self._responses = dict((s[u"id"], s) for s in sessions)
+        self._fetched_at = time()
+        for (session_id, session) in self._sessions.items():
+            response = self._responses.get(session_id)
+            if response is not None:
+                try:
+                    session.update_status_and_info(response)
+                except Exception as e:
+                    self.logger.error(u"Could not update status of session {}: {}".format(session_id, e))
@@ -0,0 +1,85 @@
+# Distributed under the terms of the Modified BSD License.
+import hashlib
+import json
+import os
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+class SessionStore(object):
+    """Remembers which Livy session each kernel used, so a restarted kernel can reattach to it instead of
+    starting a new one. Sessions are kept in a single JSON file, keyed by notebook path, of the form
+    {key: {"url": endpoint url, "id": session id, "properties": hash of the session properties}}. The hash
+    lets a kernel restarted to apply a new %%configure start a new session instead of reattaching."""
+
+    def __init__(self, path=None):
+        self.logger = SparkLog(u"SessionStore")
+
+        self._path = path
+
+    @property
+    def path(self):
+        path = self._path if self._path is not None else conf.kernel_sessions_path()
+        return os.path.expanduser(path)
+
+    @staticmethod
+    def properties_key(properties):
+        return hashlib.sha256(json.dumps(properties, sort_keys=True).encode(u"utf-8")).hexdigest()[:32]
+
+    def get(self, key):
+        """Returns (endpoint url, session id, properties hash) stored for key, or None."""
+        entry = self._read().get(key)
+        if not isinstance(entry, dict):
+            return None
+        try:
+            return entry[u"url"], int(entry[u"id"]), entry[u"properties"]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def set(self, key, url, session_id, properties):
+        sessions = self._read()
+        sessions[key] = {u"url": url, u"id": session_id, u"properties": self.properties_key(properties)}
+        self._write(sessions)
+
+    def remove(self, key):
+        sessions = self._read()
+        if sessions.pop(key, None) is not None:
+            self._write(sessions)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                sessions = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return sessions if isinstance(sessions, dict) else {}
+
+    def _write(self, sessions):
+        directory = os.path.dirname(self.path)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Kernels share the file, so it is replaced in one step rather than written in place.
+            temporary_path = u"{}.{}.tmp".format(self.path, os.getpid())
+            with open(temporary_path, u"w") as f:
+                json.dump(sessions, f, indent=2, sort_keys=True)
+            _replace(temporary_path, self.path)
+        except Exception as e:
+            # Failing to remember the session only costs a new session after the next restart.
+            self.logger.error(u"Could not write kernel sessions to {}: {}".format(self.path, e))
+
+
+def _replace(source, destination):
+    """os.replace where it exists. Python 2's os.rename cannot replace a file on Windows, so the old file is
+    removed first there."""
+    if hasattr(os, u"replace"):
+        os.replace(source, destination)
+        return
+    try:
+        os.rename(source, destination)
+    except OSError:
+        if not os.path.exists(destination):
+            raise
+        os.remove(destination)
+        os.rename(source, destination)
@@ -6,6 +6,8 @@ from sparkmagic.utils.sparklogger import SparkLog
 from .sessionmanager import SessionManager
 from .livyreliablehttpclient import LivyReliableHttpClient
 from .livysession import LivySession
+from .sessionstatuspoller import SessionStatusPoller
+from .sessionpool import get_session_pool
 from sparkmagic.utils.constants import MAGICS_LOGGER_NAME
 
 
@@ -14,6 +16,9 @@ class SparkController(object):
         self.logger = SparkLog(u"SparkController")
         self.ipython_display = ipython_display
         self.session_manager = SessionManager()
+        # One http client (and so one connection pool and auth context) per endpoint.
+        self._http_clients = dict()
+        self._status_pollers = dict()
 
     def get_app_id(self, client_name=None):
         session_to_use = self.get_session_by_name_or_default(client_name)
@@ -42,11 +47,14 @@ class SparkController(object):
     def get_all_sessions_endpoint(self, endpoint):
         http_client = self._http_client(endpoint)
         sessions = http_client.get_sessions()[u"sessions"]
-        session_list = [self._livy_session(http_client, {constants.LIVY_KIND_PARAM: s[constants.LIVY_KIND_PARAM]},
-                                           self.ipython_display, s[u"id"])
-                        for s in sessions]
-        for s in session_list:
-            s.refresh_status_and_info()
+        self._status_poller(endpoint).update(sessions)
+        session_list = []
+        for s in sessions:
+            session = self._livy_session(http_client, {constants.LIVY_KIND_PARAM: s[constants.LIVY_KIND_PARAM]},
+                                         self.ipython_display, s[u"id"])
+            # GET /sessions already returned everything a refresh would fetch.
+            session.update_status_and_info(s)
+            session_list.append(session)
         return session_list
 
     def get_all_sessions_endpoint_info(self, endpoint):
@@ -55,6 +63,7 @@ class SparkController(object):
 
     def cleanup(self):
         self.session_manager.clean_up_all()
+        self._close_http_clients()
 
     def cleanup_endpoint(self, endpoint):
         for session in self.get_all_sessions_endpoint(endpoint):
@@ -71,11 +80,26 @@ class SparkController(object):
         else:
             http_client = self._http_client(endpoint)
             response = http_client.get_session(session_id)
-            http_client = self._http_client(endpoint)
             session = self._livy_session(http_client, {constants.LIVY_KIND_PARAM: response[constants.LIVY_KIND_PARAM]},
                                         self.ipython_display, session_id)
             session.delete()
 
+    def abandon_session(self, name):
+        """Removes the session from the session manager and deletes it, without waiting for it to finish
+        starting; a start still waiting for it then fails. Returns False, doing nothing, while the session has
+        not been created on Livy yet, as there is nothing to delete until then."""
+        session = self.session_manager.sessions.get(name)
+        if session is None:
+            return True
+        if session.status == constants.NOT_STARTED_SESSION_STATUS:
+            return False
+        self.session_manager.sessions.pop(name, None)
+        try:
+            session.delete()
+        except Exception as e:
+            self.logger.error(u"Could not delete session {}: {}".format(session.id, e))
+        return True
+
     def add_session(self, name, endpoint, skip_if_exists, properties):
         if skip_if_exists and (name in self.session_manager.get_sessions_list()):
             self.logger.debug(u"Skipping {} because it already exists in list of sessions.".format(name))
@@ -85,6 +109,43 @@ class SparkController(object):
         self.session_manager.add_session(name, session)
         session.start()
 
+    def add_pooled_session(self, name, endpoint, properties):
+        """Adds a session claimed from the session pool instead of starting one. Returns False, having added
+        nothing, when the pool has no usable session for the endpoint and properties."""
+        http_client = self._http_client(endpoint)
+        session_pool = get_session_pool()
+        while True:
+            session_id = session_pool.claim(endpoint, properties)
+            if session_id is None:
+                return False
+            session = self._livy_session(http_client, dict(properties), self.ipython_display)
+            try:
+                session.attach(session_id)
+            except Exception as e:
+                self.logger.error(u"Could not use pooled session {}: {}".format(session_id, e))
+                session.detach()
+                try:
+                    http_client.delete_session(session_id)
+                except Exception:
+                    pass
+                continue
+            self.session_manager.add_session(name, session)
+            return True
+
+    def reattach_session(self, name, endpoint, properties, session_id):
+        """Adds the existing session session_id instead of starting one. Returns False, having added nothing,
+        when Livy no longer has a usable session with that id."""
+        http_client = self._http_client(endpoint)
+        session = self._livy_session(http_client, properties, self.ipython_display)
+        try:
+            session.attach(session_id)
+        except Exception as e:
+            self.logger.error(u"Could not reattach to session {}: {}".format(session_id, e))
+            session.detach()
+            return False
+        self.session_manager.add_session(name, session)
+        return True
+
     def get_session_id_for_client(self, name):
         return self.session_manager.get_session_id_for_client(name)
 
@@ -104,12 +165,25 @@ class SparkController(object):
     def get_managed_clients(self):
         return self.session_manager.sessions
 
-    @staticmethod
-    def _livy_session(http_client, properties, ipython_display,
+    def _livy_session(self, http_client, properties, ipython_display,
                       session_id=-1):
         return LivySession(http_client, properties, ipython_display,
-                           session_id, heartbeat_timeout=conf.livy_server_heartbeat_timeout_seconds())
-
-    @staticmethod
-    def _http_client(endpoint):
-        return LivyReliableHttpClient.from_endpoint(endpoint)
+                           session_id, heartbeat_timeout=conf.livy_server_heartbeat_timeout_seconds(),
+                           status_poller=self._status_poller(http_client.endpoint))
+
+    def _http_client(self, endpoint):
+        if endpoint not in self._http_clients:
+            self._http_clients[endpoint] = LivyReliableHttpClient.from_endpoint(endpoint)
+        return self._http_clients[endpoint]
+
+    def _status_poller(self, endpoint):
+        if endpoint not in self._status_pollers:
+            self._status_pollers[endpoint] = SessionStatusPoller(self._http_client(endpoint),
+                                                                 conf.session_status_max_age_seconds())
+        return self._status_pollers[endpoint]
+
+    def _close_http_clients(self):
+        for http_client in self._http_clients.values():
+            http_client.close()
+        self._http_clients.clear()
+        self._status_pollers.clear()
@@ -1,14 +1,22 @@
-from sparkmagic.utils.utils import records_to_dataframe
+import pandas as pd
+from tornado import gen
+
+from sparkmagic.utils.utils import coerced_pandas_df_to_numeric_datetime, records_to_dataframe, pyspark_arrow_code, \
+    split_schema_line, apply_spark_schema, compact_dataframe
 import sparkmagic.utils.configuration as conf
 import sparkmagic.utils.constants as constants
 from sparkmagic.utils.sparkevents import SparkEvents
 from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.diskresultcache import DiskResultCache, get_disk_result_cache
+from sparkmagic.livyclientlib.sampling import sampling_code, validate_sampling, with_sampling_setup
 from sparkmagic.livyclientlib.exceptions import DataFrameParseException, BadUserDataException
 
 import ast
 
 class SparkStoreCommand(Command):
-    def __init__(self, output_var, samplemethod=None, maxrows=None, samplefraction=None, spark_events=None, coerce=None):
+    def __init__(self, output_var, samplemethod=None, maxrows=None, samplefraction=None, spark_events=None, coerce=None,
+                 compress=None, arrow=None, schema=None, page_size=None, source=None, refresh=False,
+                 disk_cache=None, stratify=None):
         super(SparkStoreCommand, self).__init__("", spark_events)
 
         if samplemethod is None:
@@ -17,9 +25,16 @@ class SparkStoreCommand(Command):
             maxrows = conf.default_maxrows()
         if samplefraction is None:
             samplefraction = conf.default_samplefraction()
+        if compress is None:
+            compress = conf.compress_dataframe_transfer()
+        if arrow is None:
+            arrow = conf.arrow_dataframe_transfer()
+        if schema is None:
+            schema = conf.dataframe_schema_transfer()
+        if page_size is None:
+            page_size = conf.dataframe_page_size()
 
-        if samplemethod not in {u'take', u'sample'}:
-            raise BadUserDataException(u'samplemethod (-m) must be one of (take, sample)')
+        validate_sampling(samplemethod, stratify)
         if not isinstance(maxrows, int):
             raise BadUserDataException(u'maxrows (-n) must be an integer')
         if not 0.0 <= samplefraction <= 1.0:
@@ -28,47 +43,262 @@ class SparkStoreCommand(Command):
         self.samplemethod = samplemethod
         self.maxrows = maxrows
         self.samplefraction = samplefraction
+        self.stratify = stratify
         self.output_var = output_var
         if spark_events is None:
             spark_events = SparkEvents()
         self._spark_events = spark_events
         self._coerce = coerce
+        self._compress = compress
+        self._arrow = arrow
+        self._schema = schema
+        self._page_size = page_size
+        self.source = source
+        self.refresh = refresh
+        if disk_cache is None:
+            disk_cache = get_disk_result_cache()
+        self._disk_cache = disk_cache
 
 
     def execute(self, session):
+        cached = self._get_cached(session)
+        if cached is not None:
+            return cached
         try:
+            if self._should_page(session.kind):
+                result = self._execute_paged(session)
+            else:
+                command = self.to_command(session.kind, self.output_var)
+                (success, records_text) = command.execute(session)
+                if not success:
+                    raise BadUserDataException(records_text)
+                result = records_to_dataframe(records_text, session.kind, self._coerce)
+        except Exception as e:
+            raise
+        else:
+            self._put_cached(session, result)
+            return result
+
+    @gen.coroutine
+    def execute_async(self, session):
+        cached = self._get_cached(session)
+        if cached is not None:
+            raise gen.Return(cached)
+        if self._should_page(session.kind):
+            result = yield self._execute_paged_async(session)
+        else:
             command = self.to_command(session.kind, self.output_var)
-            (success, records_text) = command.execute(session)
+            (success, records_text) = yield command.execute_async(session)
             if not success:
                 raise BadUserDataException(records_text)
             result = records_to_dataframe(records_text, session.kind, self._coerce)
-        except Exception as e:
-            raise
+        self._put_cached(session, result)
+        raise gen.Return(result)
+
+
+    def _disk_cache_key(self, session):
+        return DiskResultCache.key(session.endpoint.url, DiskResultCache.session_id(session), self.source,
+                                   self.output_var, self.samplemethod, self.maxrows, self.samplefraction,
+                                   self.stratify, self._coerce, self._arrow, self._schema)
+
+    def _get_cached(self, session):
+        """Results are only cached on disk, and only when the code that produced the DataFrame is known."""
+        if self.source is None or self.refresh or not self._disk_cache.enabled():
+            return None
+        return self._disk_cache.get(self._disk_cache_key(session))
+
+    def _put_cached(self, session, result):
+        if self.source is not None and self._disk_cache.enabled():
+            self._disk_cache.put(self._disk_cache_key(session), result, self.source, session.endpoint.url,
+                                 DiskResultCache.session_id(session))
+
+
+    def _should_page(self, kind):
+        """Paging only applies when every row is requested. SparkR and Arrow transfers always use a single
+        statement."""
+        return self._page_size > 0 and self.maxrows < 0 and not self._arrow and \
+            kind in (constants.SESSION_KIND_PYSPARK, constants.SESSION_KIND_PYSPARK3, constants.SESSION_KIND_SPARK)
+
+    def _execute_paged(self, session):
+        """Caches the rows on the remote side, one partition per page, and fetches them page_size rows per
+        statement, so no single statement output holds the whole DataFrame. Each page only reads its own
+        partition. Livy runs a session's statements one at a time, so the pages are fetched sequentially."""
+        try:
+            (schema, setup_output) = split_schema_line(self._run(self._page_setup_command(session.kind), session))
+            pages = [self._run(self._page_command(session.kind, page), session)
+                     for page in range(self._page_count(setup_output))]
+        finally:
+            self._page_cleanup_command(session.kind).execute(session)
+        return self._pages_to_dataframe(pages, session.kind, schema)
+
+    @gen.coroutine
+    def _execute_paged_async(self, session):
+        try:
+            setup_output = yield self._run_async(self._page_setup_command(session.kind), session)
+            (schema, setup_output) = split_schema_line(setup_output)
+            pages = []
+            for page in range(self._page_count(setup_output)):
+                output = yield self._run_async(self._page_command(session.kind, page), session)
+                pages.append(output)
+        finally:
+            yield self._page_cleanup_command(session.kind).execute_async(session)
+        raise gen.Return(self._pages_to_dataframe(pages, session.kind, schema))
+
+    def _page_count(self, setup_output):
+        """Reads the row count the setup statement printed. The Scala REPL echoes each val and expression of
+        the setup ahead of it, so only the last line with the row count prefix is used."""
+        counts = [line.strip()[len(constants.ROW_COUNT_PREFIX):] for line in setup_output.splitlines()
+                  if line.strip().startswith(constants.ROW_COUNT_PREFIX)]
+        try:
+            return -(-int(counts[-1]) // self._page_size)
+        except (IndexError, ValueError):
+            raise DataFrameParseException(u"Cannot find the row count in '{}'".format(setup_output))
+
+    @staticmethod
+    def _run(command, session):
+        (success, output) = command.execute(session)
+        if not success:
+            raise BadUserDataException(output)
+        return output
+
+    @staticmethod
+    @gen.coroutine
+    def _run_async(command, session):
+        (success, output) = yield command.execute_async(session)
+        if not success:
+            raise BadUserDataException(output)
+        raise gen.Return(output)
+
+    def _pages_to_dataframe(self, pages, kind, schema=None):
+        # Pages are compacted together at the end; categoricals from separate pages would not concatenate.
+        frames = [records_to_dataframe(page, kind, False, False) for page in pages]
+        frames = [frame for frame in frames if len(frame.columns) > 0]
+        if frames:
+            columns = []
+            for frame in frames:
+                columns.extend(column for column in frame.columns if column not in columns)
+            df = pd.concat(frames, ignore_index=True)[columns]
         else:
-            return result
+            df = records_to_dataframe(u'', kind, False, False)
+        coerce = self._coerce
+        if coerce is None:
+            coerce = conf.coerce_dataframe()
+        if schema is not None:
+            df = apply_spark_schema(df, schema, coerce)
+        elif coerce and frames:
+            df = coerced_pandas_df_to_numeric_datetime(df)
+        if conf.compact_dataframe():
+            df = compact_dataframe(df)
+        return df
+
+    def _pages_variable_name(self):
+        return u'{}_pages'.format(constants.LONG_RANDOM_VARIABLE_NAME)
+
+    def _page_setup_command(self, kind):
+        """Keys every row by its page and moves each page into its own partition, so that fetching a page
+        with lookup() only reads that partition. Rows keep their index to restore their order in the page."""
+        pages = self._pages_variable_name()
+        (setup, dataframe) = self._sampling(kind, self.output_var)
+        if kind == constants.SESSION_KIND_SPARK:
+            command = u'{}.toJSON.rdd'.format(dataframe)
+            if self.samplemethod == u'sample':
+                command = u'{}.sample(false, {})'.format(command, self.samplefraction)
+            # The sampling setup goes inside the rows expression, where the REPL does not echo its vals.
+            command = with_sampling_setup(kind, setup, u'{}.zipWithIndex.cache()'.format(command))
+            setup = u''
+            command = Command(u'val {0}_rows = {1}\n'
+                              u'val {0}_count = {0}_rows.count\n'
+                              u'val {0} = {0}_rows.map(r => (r._2 / {2}, r))'
+                              u'.partitionBy(new org.apache.spark.HashPartitioner('
+                              u'math.max(1L, ({0}_count + {2} - 1) / {2}).toInt)).cache()\n'
+                              u'{0}.count\n'
+                              u'{0}_rows.unpersist()\n'
+                              u'println("{3}" + {0}_count)'.format(pages, command, self._page_size,
+                                                                   constants.ROW_COUNT_PREFIX))
+        else:
+            command = u'{}.toJSON()'.format(dataframe)
+            if self.samplemethod == u'sample':
+                command = u'{}.sample(False, {})'.format(command, self.samplefraction)
+            command = Command(u'{0}_rows = {1}.zipWithIndex().cache()\n'
+                              u'{0}_count = {0}_rows.count()\n'
+                              u'{0} = {0}_rows.map(lambda r: (r[1] // {2}, (r[1], r[0])))'
+                              u'.partitionBy(max(1, -(-{0}_count // {2})), lambda page: page).cache()\n'
+                              u'{0}.count()\n'
+                              u'{0}_rows.unpersist()\n'
+                              u'print(u"{3}" + str({0}_count))'.format(pages, command, self._page_size,
+                                                                       constants.ROW_COUNT_PREFIX))
+        return self._with_schema(kind, self.output_var, self._with_setup(kind, setup, command))
+
+    def _page_command(self, kind, page):
+        pages = self._pages_variable_name()
+        if kind == constants.SESSION_KIND_SPARK:
+            return self._scala_print(u'{}.lookup({}).sortBy(_._2).map(_._1)'.format(pages, page))
+        return self._pyspark_print(u'[r[1] for r in sorted({}.lookup({}))]'.format(pages, page),
+                                   kind == constants.SESSION_KIND_PYSPARK)
+
+    def _page_cleanup_command(self, kind):
+        pages = self._pages_variable_name()
+        if kind == constants.SESSION_KIND_SPARK:
+            return Command(u'{0}_rows.unpersist()\n{0}.unpersist()'.format(pages))
+        return Command(u'{0}_rows.unpersist()\n{0}.unpersist()\ndel {0}_rows, {0}'.format(pages))
 
 
     def to_command(self, kind, spark_context_variable_name):
         if kind == constants.SESSION_KIND_PYSPARK:
-            return self._pyspark_command(spark_context_variable_name)
+            command = self._pyspark_command(spark_context_variable_name)
         elif kind == constants.SESSION_KIND_PYSPARK3:
-            return self._pyspark_command(spark_context_variable_name, False)
+            command = self._pyspark_command(spark_context_variable_name, False)
         elif kind == constants.SESSION_KIND_SPARK:
-            return self._scala_command(spark_context_variable_name)
+            command = self._scala_command(spark_context_variable_name)
         elif kind == constants.SESSION_KIND_SPARKR:
-            return self._r_command(spark_context_variable_name)
+            command = self._r_command(spark_context_variable_name)
         else:
             raise BadUserDataException(u"Kind '{}' is not supported.".format(kind))
+        (setup, _) = self._sampling(kind, spark_context_variable_name)
+        return self._with_schema(kind, spark_context_variable_name, self._with_setup(kind, setup, command))
+
+    def _sampling(self, kind, dataframe):
+        return sampling_code(kind, dataframe, self.samplemethod, self.maxrows, self.samplefraction, self.stratify)
+
+    @staticmethod
+    def _with_setup(kind, setup, command):
+        if not setup:
+            return command
+        return Command(with_sampling_setup(kind, setup, command.code))
+
+
+    def _with_schema(self, kind, spark_context_variable_name, command):
+        """Prints the DataFrame's schema ahead of the records when schema transfer is on. Arrow results carry
+        their own schema."""
+        if not self._schema or (self._arrow and kind in (constants.SESSION_KIND_PYSPARK,
+                                                         constants.SESSION_KIND_PYSPARK3)):
+            return command
+        if kind == constants.SESSION_KIND_SPARK:
+            schema_print = constants.SCALA_SCHEMA_PRINT.format(spark_context_variable_name)
+        elif kind == constants.SESSION_KIND_SPARKR:
+            schema_print = constants.R_SCHEMA_PRINT.format(spark_context_variable_name)
+        else:
+            schema_print = constants.PYSPARK_SCHEMA_PRINT.format(spark_context_variable_name)
+        return Command(u'{}\n{}'.format(schema_print, command.code))
 
 
     def _pyspark_command(self, spark_context_variable_name, encode_result=True):
-        command = u'{}.toJSON()'.format(spark_context_variable_name)
+        (_, dataframe) = self._sampling(constants.SESSION_KIND_PYSPARK, spark_context_variable_name)
+        if self._arrow:
+            return Command(pyspark_arrow_code(dataframe, self.samplemethod, self.maxrows, self.samplefraction))
+        command = u'{}.toJSON()'.format(dataframe)
         if self.samplemethod == u'sample':
             command = u'{}.sample(False, {})'.format(command, self.samplefraction)
         if self.maxrows >= 0:
             command = u'{}.take({})'.format(command, self.maxrows)
         else:
             command = u'{}.collect()'.format(command)
+        return self._pyspark_print(command, encode_result)
+
+
+    def _pyspark_print(self, command, encode_result):
+        if self._compress:
+            return Command(constants.PYSPARK_COMPRESSED_PRINT.format(command))
         # Unicode support has improved in Python 3 so we don't need to encode.
         if encode_result:
             print_command = '{}.encode("{}")'.format(constants.LONG_RANDOM_VARIABLE_NAME,
@@ -82,18 +312,25 @@ class SparkStoreCommand(Command):
 
 
     def _scala_command(self, spark_context_variable_name):
-        command = u'{}.toJSON'.format(spark_context_variable_name)
+        (_, dataframe) = self._sampling(constants.SESSION_KIND_SPARK, spark_context_variable_name)
+        command = u'{}.toJSON'.format(dataframe)
         if self.samplemethod == u'sample':
             command = u'{}.sample(false, {})'.format(command, self.samplefraction)
         if self.maxrows >= 0:
             command = u'{}.take({})'.format(command, self.maxrows)
         else:
             command = u'{}.collect'.format(command)
+        return self._scala_print(command)
+
+
+    def _scala_print(self, command):
+        if self._compress:
+            return Command(constants.SCALA_COMPRESSED_PRINT.format(command))
         return Command(u'{}.foreach(println)'.format(command))
 
 
     def _r_command(self, spark_context_variable_name):
-        command = spark_context_variable_name
+        (_, command) = self._sampling(constants.SESSION_KIND_SPARKR, spark_context_variable_name)
         if self.samplemethod == u'sample':
             command = u'sample({}, FALSE, {})'.format(command,
                                                       self.samplefraction)
@@ -102,6 +339,8 @@ class SparkStoreCommand(Command):
         else:
             command = u'collect({})'.format(command)
         command = u'jsonlite::toJSON({})'.format(command)
+        if self._compress:
+            return Command(constants.R_COMPRESSED_PRINT.format(command))
         command = u'for ({} in ({})) {{cat({})}}'.format(constants.LONG_RANDOM_VARIABLE_NAME,
                                                          command,
                                                          constants.LONG_RANDOM_VARIABLE_NAME)
@@ -115,8 +354,15 @@ class SparkStoreCommand(Command):
             self.samplemethod == other.samplemethod and \
             self.maxrows == other.maxrows and \
             self.samplefraction == other.samplefraction and \
+            self.stratify == other.stratify and \
             self.output_var == other.output_var and \
-            self._coerce == other._coerce
+            self._coerce == other._coerce and \
+            self._compress == other._compress and \
+            self._arrow == other._arrow and \
+            self._schema == other._schema and \
+            self._page_size == other._page_size and \
+            self.source == other.source and \
+            self.refresh == other.refresh
 
     def __ne__(self, other):
         return not (self == other)
\ No newline at end of file
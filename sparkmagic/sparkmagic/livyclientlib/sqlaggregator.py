@@ -0,0 +1,47 @@
+# Distributed under the terms of the Modified BSD License.
+from autovizwidget.widget.encoding import Encoding
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.utils.sparklogger import SparkLog
+from .sqlquery import SQLQuery
+
+
+class SQLAggregator(object):
+    """Computes autoviz chart aggregations with a GROUP BY over the full result of a SQL query, rather than over
+    the sample of it that was pulled into pandas. Returns None, so autoviz falls back to aggregating the sample,
+    for queries that cannot be used as a subquery (e.g. SHOW TABLES) or aggregations that fail remotely."""
+
+    _functions = {Encoding.y_agg_avg: u"AVG", Encoding.y_agg_min: u"MIN", Encoding.y_agg_max: u"MAX",
+                  Encoding.y_agg_sum: u"SUM", Encoding.y_agg_count: u"COUNT"}
+
+    def __init__(self, spark_controller, session_name, query, coerce=None):
+        self.logger = SparkLog(u"SQLAggregator")
+        self._spark_controller = spark_controller
+        self._session_name = session_name
+        self.query = query
+        self._coerce = coerce
+
+    def __call__(self, x_column, y_column, y_aggregation):
+        function = self._functions.get(y_aggregation)
+        if function is None:
+            return None
+        try:
+            df = self._spark_controller.run_sqlquery(self.to_sqlquery(x_column, y_column, function),
+                                                     self._session_name)
+            return (df[x_column].tolist(), df[y_column].tolist())
+        except Exception as e:
+            self.logger.error(u"Could not aggregate '{}' by '{}' remotely, using the local sample: {}"
+                              .format(y_column, x_column, e))
+            return None
+
+    def to_sqlquery(self, x_column, y_column, function):
+        """At most default_maxrows groups are fetched, ordered by X."""
+        x = _quote(x_column)
+        query = self.query.strip().rstrip(u";")
+        return SQLQuery(u"SELECT {x}, {function}({y}) AS {y} FROM ({query}) sparkmagic_autoviz GROUP BY {x} "
+                        u"ORDER BY {x}".format(x=x, y=_quote(y_column), function=function, query=query),
+                        u"take", conf.default_maxrows(), coerce=self._coerce)
+
+
+def _quote(identifier):
+    return u"`{}`".format(identifier.replace(u"`", u"``"))
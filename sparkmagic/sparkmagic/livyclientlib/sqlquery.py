@@ -1,15 +1,21 @@
 from hdijupyterutils.guid import ObjectWithGuid
+from tornado import gen
 
-from sparkmagic.utils.utils import coerce_pandas_df_to_numeric_datetime, records_to_dataframe
+from sparkmagic.utils.utils import coerce_pandas_df_to_numeric_datetime, records_to_dataframe, pyspark_arrow_code
 import sparkmagic.utils.configuration as conf
 import sparkmagic.utils.constants as constants
 from sparkmagic.utils.sparkevents import SparkEvents
 from .command import Command
+from .resultcache import get_result_cache
+from .diskresultcache import DiskResultCache, get_disk_result_cache
+from .sampling import sampling_code, validate_sampling, with_sampling_setup
 from .exceptions import DataFrameParseException, BadUserDataException
 
 
 class SQLQuery(ObjectWithGuid):
-    def __init__(self, query, samplemethod=None, maxrows=None, samplefraction=None, spark_events=None, coerce=None):
+    def __init__(self, query, samplemethod=None, maxrows=None, samplefraction=None, spark_events=None, coerce=None,
+                 compress=None, arrow=None, schema=None, refresh=False, result_cache=None,
+                 disk_cache=None, stratify=None):
         super(SQLQuery, self).__init__()
         
         if samplemethod is None:
@@ -18,9 +24,14 @@ class SQLQuery(ObjectWithGuid):
             maxrows = conf.default_maxrows()
         if samplefraction is None:
             samplefraction = conf.default_samplefraction()
+        if compress is None:
+            compress = conf.compress_dataframe_transfer()
+        if arrow is None:
+            arrow = conf.arrow_dataframe_transfer()
+        if schema is None:
+            schema = conf.dataframe_schema_transfer()
 
-        if samplemethod not in {u'take', u'sample'}:
-            raise BadUserDataException(u'samplemethod (-m) must be one of (take, sample)')
+        validate_sampling(samplemethod, stratify)
         if not isinstance(maxrows, int):
             raise BadUserDataException(u'maxrows (-n) must be an integer')
         if not 0.0 <= samplefraction <= 1.0:
@@ -30,24 +41,66 @@ class SQLQuery(ObjectWithGuid):
         self.samplemethod = samplemethod
         self.maxrows = maxrows
         self.samplefraction = samplefraction
+        self.stratify = stratify
         if spark_events is None:
             spark_events = SparkEvents()
         self._spark_events = spark_events
         self._coerce = coerce
+        self._compress = compress
+        self._arrow = arrow
+        self._schema = schema
+        self.refresh = refresh
+        if result_cache is None:
+            result_cache = get_result_cache()
+        self._result_cache = result_cache
+        if disk_cache is None:
+            disk_cache = get_disk_result_cache()
+        self._disk_cache = disk_cache
 
     def to_command(self, kind, sql_context_variable_name):
         if kind == constants.SESSION_KIND_PYSPARK:
-            return self._pyspark_command(sql_context_variable_name)
+            command = self._pyspark_command(sql_context_variable_name)
         elif kind == constants.SESSION_KIND_PYSPARK3:
-            return self._pyspark_command(sql_context_variable_name, False)
+            command = self._pyspark_command(sql_context_variable_name, False)
         elif kind == constants.SESSION_KIND_SPARK:
-            return self._scala_command(sql_context_variable_name)
+            command = self._scala_command(sql_context_variable_name)
         elif kind == constants.SESSION_KIND_SPARKR:
-            return self._r_command(sql_context_variable_name)
+            command = self._r_command(sql_context_variable_name)
         else:
             raise BadUserDataException(u"Kind '{}' is not supported.".format(kind))
+        (setup, _) = self._sampling(kind, self._dataframe(kind, sql_context_variable_name))
+        if setup:
+            command = Command(with_sampling_setup(kind, setup, command.code))
+        return self._with_schema(kind, sql_context_variable_name, command)
+
+    def _dataframe(self, kind, sql_context_variable_name):
+        if kind == constants.SESSION_KIND_SPARK:
+            return u'{}.sql("""{}""")'.format(sql_context_variable_name, self.query)
+        elif kind == constants.SESSION_KIND_SPARKR:
+            return self._r_dataframe(sql_context_variable_name)
+        return u'{}.sql(u"""{} """)'.format(sql_context_variable_name, self.query)
+
+    def _sampling(self, kind, dataframe):
+        return sampling_code(kind, dataframe, self.samplemethod, self.maxrows, self.samplefraction, self.stratify)
+
+    def _with_schema(self, kind, sql_context_variable_name, command):
+        """Prints the query's schema ahead of the records when schema transfer is on. Arrow results carry
+        their own schema."""
+        if not self._schema or (self._arrow and kind in (constants.SESSION_KIND_PYSPARK,
+                                                         constants.SESSION_KIND_PYSPARK3)):
+            return command
+        if kind == constants.SESSION_KIND_SPARK:
+            schema_print = constants.SCALA_SCHEMA_PRINT.format(self._dataframe(kind, sql_context_variable_name))
+        elif kind == constants.SESSION_KIND_SPARKR:
+            schema_print = constants.R_SCHEMA_PRINT.format(self._dataframe(kind, sql_context_variable_name))
+        else:
+            schema_print = constants.PYSPARK_SCHEMA_PRINT.format(self._dataframe(kind, sql_context_variable_name))
+        return Command(u'{}\n{}'.format(schema_print, command.code))
 
     def execute(self, session):
+        cached = self._get_cached(session)
+        if cached is not None:
+            return cached
         self._spark_events.emit_sql_execution_start_event(session.guid, session.kind, session.id, self.guid,
                                                           self.samplemethod, self.maxrows, self.samplefraction)
         command_guid = ''
@@ -66,17 +119,86 @@ class SQLQuery(ObjectWithGuid):
         else:
             self._spark_events.emit_sql_execution_end_event(session.guid, session.kind, session.id, self.guid,
                                                             command_guid, True, "", "")
+            self._put_cached(session, result)
             return result
 
+    @gen.coroutine
+    def execute_async(self, session):
+        """Non-blocking version of execute. Returns a future resolving to the dataframe."""
+        cached = self._get_cached(session)
+        if cached is not None:
+            raise gen.Return(cached)
+        self._spark_events.emit_sql_execution_start_event(session.guid, session.kind, session.id, self.guid,
+                                                          self.samplemethod, self.maxrows, self.samplefraction)
+        command_guid = ''
+        try:
+            command = self.to_command(session.kind, session.sql_context_variable_name)
+            command_guid = command.guid
+            (success, records_text) = yield command.execute_async(session)
+            if not success:
+                raise BadUserDataException(records_text)
+            result = records_to_dataframe(records_text, session.kind, self._coerce)
+        except Exception as e:
+            self._spark_events.emit_sql_execution_end_event(session.guid, session.kind, session.id, self.guid,
+                                                            command_guid, False, e.__class__.__name__, str(e))
+            raise
+
+        else:
+            self._spark_events.emit_sql_execution_end_event(session.guid, session.kind, session.id, self.guid,
+                                                            command_guid, True, "", "")
+            self._put_cached(session, result)
+            raise gen.Return(result)
+
+
+    def _cache_parameters(self):
+        return (self.query, self.samplemethod, self.maxrows, self.samplefraction, self.stratify, self._coerce,
+                self._arrow, self._schema)
+
+    def _cache_key(self, session):
+        return (session.endpoint.url, session.id) + self._cache_parameters()
+
+    def _disk_cache_key(self, session):
+        return DiskResultCache.key(session.endpoint.url, DiskResultCache.session_id(session),
+                                   *self._cache_parameters())
+
+    def _get_cached(self, session):
+        """Returns the cached result of this query on the session, from memory or else from disk, or None.
+        Refreshing queries skip the lookup but still store their result."""
+        if self.refresh:
+            return None
+        if self._result_cache.enabled():
+            result = self._result_cache.get(self._cache_key(session))
+            if result is not None:
+                return result
+        if self._disk_cache.enabled():
+            result = self._disk_cache.get(self._disk_cache_key(session))
+            if result is not None:
+                if self._result_cache.enabled():
+                    self._result_cache.put(self._cache_key(session), result)
+                return result
+        return None
+
+    def _put_cached(self, session, result):
+        if self._result_cache.enabled():
+            self._result_cache.put(self._cache_key(session), result)
+        if self._disk_cache.enabled():
+            self._disk_cache.put(self._disk_cache_key(session), result, self.query, session.endpoint.url,
+                                 DiskResultCache.session_id(session))
 
     def _pyspark_command(self, sql_context_variable_name, encode_result=True):
-        command = u'{}.sql(u"""{} """).toJSON()'.format(sql_context_variable_name, self.query)
+        (_, dataframe) = self._sampling(constants.SESSION_KIND_PYSPARK,
+                                        self._dataframe(constants.SESSION_KIND_PYSPARK, sql_context_variable_name))
+        if self._arrow:
+            return Command(pyspark_arrow_code(dataframe, self.samplemethod, self.maxrows, self.samplefraction))
+        command = u'{}.toJSON()'.format(dataframe)
         if self.samplemethod == u'sample':
             command = u'{}.sample(False, {})'.format(command, self.samplefraction)
         if self.maxrows >= 0:
             command = u'{}.take({})'.format(command, self.maxrows)
         else:
             command = u'{}.collect()'.format(command)
+        if self._compress:
+            return Command(constants.PYSPARK_COMPRESSED_PRINT.format(command))
         # Unicode support has improved in Python 3 so we don't need to encode.
         if encode_result:
             print_command = '{}.encode("{}")'.format(constants.LONG_RANDOM_VARIABLE_NAME,
@@ -89,20 +211,21 @@ class SQLQuery(ObjectWithGuid):
         return Command(command)
 
     def _scala_command(self, sql_context_variable_name):
-        command = u'{}.sql("""{}""").toJSON'.format(sql_context_variable_name, self.query)
+        (_, dataframe) = self._sampling(constants.SESSION_KIND_SPARK,
+                                        self._dataframe(constants.SESSION_KIND_SPARK, sql_context_variable_name))
+        command = u'{}.toJSON'.format(dataframe)
         if self.samplemethod == u'sample':
             command = u'{}.sample(false, {})'.format(command, self.samplefraction)
         if self.maxrows >= 0:
             command = u'{}.take({})'.format(command, self.maxrows)
         else:
             command = u'{}.collect'.format(command)
+        if self._compress:
+            return Command(constants.SCALA_COMPRESSED_PRINT.format(command))
         return Command(u'{}.foreach(println)'.format(command))
 
     def _r_command(self, sql_context_variable_name):
-        if sql_context_variable_name == 'spark':
-            command = u'sql("{}")'.format(self.query)
-        else:
-            command = u'sql({}, "{}")'.format(sql_context_variable_name, self.query)
+        (_, command) = self._sampling(constants.SESSION_KIND_SPARKR, self._r_dataframe(sql_context_variable_name))
         if self.samplemethod == u'sample':
             command = u'sample({}, FALSE, {})'.format(command, self.samplefraction)
         if self.maxrows >= 0:
@@ -110,16 +233,29 @@ class SQLQuery(ObjectWithGuid):
         else:
             command = u'collect({})'.format(command)
         command = u'jsonlite:::toJSON({})'.format(command)
+        if self._compress:
+            return Command(constants.R_COMPRESSED_PRINT.format(command))
         command = u'for ({} in ({})) {{cat({})}}'.format(constants.LONG_RANDOM_VARIABLE_NAME, command, constants.LONG_RANDOM_VARIABLE_NAME)
         return Command(command)
 
+    def _r_dataframe(self, sql_context_variable_name):
+        if sql_context_variable_name == 'spark':
+            return u'sql("{}")'.format(self.query)
+        else:
+            return u'sql({}, "{}")'.format(sql_context_variable_name, self.query)
+
     # Used only for unit testing
     def __eq__(self, other):
         return self.query == other.query and \
             self.samplemethod == other.samplemethod and \
             self.maxrows == other.maxrows and \
             self.samplefraction == other.samplefraction and \
-            self._coerce == other._coerce
+            self.stratify == other.stratify and \
+            self._coerce == other._coerce and \
+            self._compress == other._compress and \
+            self._arrow == other._arrow and \
+            self._schema == other._schema and \
+            self.refresh == other.refresh
 
     def __ne__(self, other):
         return not (self == other)
@@ -47,10 +47,12 @@ class RemoteSparkMagics(SparkMagicBase):
                                                              "queries will be stored in this variable.")
     @argument("-q", "--quiet", type=bool, default=False, nargs="?", const=True, help="Do not display visualizations"
                                                                                      " on SQL queries")
-    @argument("-m", "--samplemethod", type=str, default=None, help="Sample method for SQL queries: either take or sample")
+    @argument("-m", "--samplemethod", type=str, default=None, help="Sample method for SQL queries: one of take, "
+                                                                    "sample, stratified, reservoir or partition")
     @argument("-n", "--maxrows", type=int, default=None, help="Maximum number of rows that will be pulled back "
                                                                         "from the server for SQL queries")
     @argument("-r", "--samplefraction", type=float, default=None, help="Sample fraction for sampling from SQL queries")
+    @argument("--stratify", type=str, default=None, help="Column to stratify by, with -m stratified")
     @argument("-u", "--url", type=str, default=None, help="URL for Livy endpoint")
     @argument("-a", "--user", type=str, default="", help="Username for HTTP access to Livy endpoint")
     @argument("-p", "--password", type=str, default="", help="Password for HTTP access to Livy endpoint")
@@ -62,6 +64,11 @@ class RemoteSparkMagics(SparkMagicBase):
     @argument("-i", "--id", type=int, default=None, help="Session ID")
     @argument("-e", "--coerce", type=str, default=None, help="Whether to automatically coerce the types (default, pass True if being explicit) "
                                                                         "of the dataframe or not (pass False)")
+    @argument("--refresh", type=bool, default=False, nargs="?", const=True, help="Run the SQL query, or pull the -o "
+                                                                                  "dataframe, even if it is cached")
+    @argument("--lazy", type=bool, default=False, nargs="?", const=True, help="With -c spark, store a handle to the "
+                                                                               "remote dataframe in the -o variable "
+                                                                               "instead of pulling its rows")
     @needs_local_scope
     @line_cell_magic
     @handle_expected_exceptions
@@ -96,6 +103,11 @@ class RemoteSparkMagics(SparkMagicBase):
                e.g. `%%spark -s testsession -c sql -o my_var` will execute the SQL code against the testsession
                         previously created and store the pandas dataframe created in the my_var variable in the
                         Python environment.
+               e.g. `%%spark -s testsession -c sql --refresh` will run the SQL code even if its result is cached.
+               e.g. `%%spark -s testsession -c sql -m stratified --stratify country -n 1000` will pull about 1000
+                        rows of the result, split evenly between the values of the country column.
+               e.g. `%%spark -s testsession -o df --lazy` will store a handle to the remote dataframe df, whose rows
+                        are only pulled by df.to_pandas().
            logs
                Returns the logs for a given session.
                e.g. `%spark logs -s testsession` will return the logs for the testsession previously created
@@ -170,10 +182,12 @@ class RemoteSparkMagics(SparkMagicBase):
             coerce = get_coerce_value(args.coerce)
             if args.context == CONTEXT_NAME_SPARK:
                 return self.execute_spark(cell, args.output, args.samplemethod,
-                                          args.maxrows, args.samplefraction, args.session, coerce)
+                                          args.maxrows, args.samplefraction, args.session, coerce, args.refresh,
+                                          args.lazy, args.stratify)
             elif args.context == CONTEXT_NAME_SQL:
                 return self.execute_sqlquery(cell, args.samplemethod, args.maxrows, args.samplefraction,
-                                             args.session, args.output, args.quiet, coerce)
+                                             args.session, args.output, args.quiet, coerce, args.refresh,
+                                             args.stratify)
             else:
                 self.ipython_display.send_error("Context '{}' not found".format(args.context))
         # error
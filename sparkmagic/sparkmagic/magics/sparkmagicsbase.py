@@ -9,6 +9,7 @@ Provides the %spark magic."""
 from __future__ import print_function
 from IPython.core.magic import Magics, magics_class
 from hdijupyterutils.ipythondisplay import IpythonDisplay
+from autovizwidget.widget.utils import set_aggregator
 
 import sparkmagic.utils.configuration as conf
 from sparkmagic.utils.sparklogger import SparkLog
@@ -17,8 +18,10 @@ from sparkmagic.utils.utils import get_sessions_info_html
 from sparkmagic.utils.constants import MAGICS_LOGGER_NAME
 from sparkmagic.livyclientlib.sparkcontroller import SparkController
 from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.livyclientlib.sqlaggregator import SQLAggregator
 from sparkmagic.livyclientlib.command import Command
 from sparkmagic.livyclientlib.sparkstorecommand import SparkStoreCommand
+from sparkmagic.livyclientlib.remotedataframe import RemoteDataFrame
 
 
 @magics_class
@@ -37,25 +40,35 @@ class SparkMagicBase(Magics):
             spark_events = SparkEvents()
         spark_events.emit_library_loaded_event()
 
-    def execute_spark(self, cell, output_var, samplemethod, maxrows, samplefraction, session_name, coerce):
+    def execute_spark(self, cell, output_var, samplemethod, maxrows, samplefraction, session_name, coerce,
+                      refresh=False, lazy=False, stratify=None):
         (success, out) = self.spark_controller.run_command(Command(cell), session_name)
         if not success:
             self.ipython_display.send_error(out)
         else:
             self.ipython_display.write(out)
-            if output_var is not None:
-                spark_store_command = self._spark_store_command(output_var, samplemethod, maxrows, samplefraction, coerce)
+            if output_var is not None and lazy:
+                self.shell.user_ns[output_var] = RemoteDataFrame(self.spark_controller, session_name, output_var,
+                                                                 samplemethod, maxrows, samplefraction, coerce,
+                                                                 stratify)
+            elif output_var is not None:
+                spark_store_command = self._spark_store_command(output_var, samplemethod, maxrows, samplefraction,
+                                                                coerce, cell, refresh, stratify)
                 df = self.spark_controller.run_command(spark_store_command, session_name)
                 self.shell.user_ns[output_var] = df
 
     @staticmethod
-    def _spark_store_command(output_var, samplemethod, maxrows, samplefraction, coerce):
-        return SparkStoreCommand(output_var, samplemethod, maxrows, samplefraction, coerce=coerce)
+    def _spark_store_command(output_var, samplemethod, maxrows, samplefraction, coerce, source=None, refresh=False,
+                             stratify=None):
+        return SparkStoreCommand(output_var, samplemethod, maxrows, samplefraction, coerce=coerce, source=source,
+                                 refresh=refresh, stratify=stratify)
 
     def execute_sqlquery(self, cell, samplemethod, maxrows, samplefraction,
-                         session, output_var, quiet, coerce):
-        sqlquery = self._sqlquery(cell, samplemethod, maxrows, samplefraction, coerce)
+                         session, output_var, quiet, coerce, refresh=False, stratify=None):
+        sqlquery = self._sqlquery(cell, samplemethod, maxrows, samplefraction, coerce, refresh, stratify)
         df = self.spark_controller.run_sqlquery(sqlquery, session)
+        if conf.autoviz_aggregation_pushdown():
+            set_aggregator(df, SQLAggregator(self.spark_controller, session, cell, coerce))
         if output_var is not None:
             self.shell.user_ns[output_var] = df
         if quiet:
@@ -64,8 +77,9 @@ class SparkMagicBase(Magics):
             return df
 
     @staticmethod
-    def _sqlquery(cell, samplemethod, maxrows, samplefraction, coerce):
-        return SQLQuery(cell, samplemethod, maxrows, samplefraction, coerce=coerce)
+    def _sqlquery(cell, samplemethod, maxrows, samplefraction, coerce, refresh=False, stratify=None):
+        return SQLQuery(cell, samplemethod, maxrows, samplefraction, coerce=coerce, refresh=refresh,
+                        stratify=stratify)
 
     def _print_endpoint_info(self, info_sessions, current_session_id):
         if info_sessions:
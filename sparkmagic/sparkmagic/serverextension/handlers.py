@@ -7,6 +7,8 @@ from tornado.web import MissingArgumentError
 from tornado.escape import json_decode
 
 from sparkmagic.kernels.kernelmagics import KernelMagics
+from sparkmagic.livyclientlib.endpoint import Endpoint
+from sparkmagic.livyclientlib.sessionpool import get_session_pool
 import sparkmagic.utils.configuration as conf
 from sparkmagic.utils import constants
 from sparkmagic.utils.sparkevents import SparkEvents
@@ -150,10 +152,27 @@ class ReconnectHandler(IPythonHandler):
         return spark_events
 
 
+def _session_pool_targets():
+    """The kernel endpoint and session properties of each language in session_pool_languages that has a
+    kernel endpoint configured."""
+    targets = []
+    for language in conf.session_pool_languages():
+        credentials = getattr(conf, 'base64_kernel_' + language + '_credentials')()
+        if credentials['url']:
+            endpoint = Endpoint(credentials['url'], credentials['auth'], credentials['username'],
+                                credentials['password'])
+            targets.append((endpoint, conf.get_session_properties(language)))
+    return targets
+
+
 def load_jupyter_server_extension(nb_app):
     nb_app.log.info("sparkmagic extension enabled!")
     web_app = nb_app.web_app
 
+    if conf.session_pool_size() > 0:
+        nb_app.log.info("sparkmagic session pool enabled.")
+        get_session_pool().start(_session_pool_targets())
+
     base_url = web_app.settings['base_url']
     host_pattern = '.*$'
 
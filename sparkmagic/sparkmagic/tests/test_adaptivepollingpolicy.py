@@ -0,0 +1,67 @@
+from nose.tools import assert_equals
+
+from sparkmagic.livyclientlib.adaptivepollingpolicy import AdaptivePollingPolicy
+
+
+def test_first_poll_is_fast():
+    policy = AdaptivePollingPolicy(0.05, 10)
+    policy.record_completion(60)
+
+    assert_equals(0.05, policy.seconds_to_sleep(1, 0, None))
+
+
+def test_backoff_grows_and_is_capped():
+    policy = AdaptivePollingPolicy(0.1, 1, backoff_factor=2)
+
+    assert_equals(0.2, policy.seconds_to_sleep(2, 0.1))
+    assert_equals(0.4, policy.seconds_to_sleep(3, 0.3))
+    assert_equals(0.8, policy.seconds_to_sleep(4, 0.7))
+    assert_equals(1, policy.seconds_to_sleep(5, 1.5))
+    assert_equals(1, policy.seconds_to_sleep(100, 100))
+
+
+def test_progress_predicts_next_poll():
+    policy = AdaptivePollingPolicy(0.05, 100)
+
+    # A quarter done after 10 seconds: 30 seconds to go, so poll again in 15.
+    assert_equals(15, policy.seconds_to_sleep(5, 10, 0.25))
+
+
+def test_progress_prediction_is_clamped():
+    policy = AdaptivePollingPolicy(0.05, 10)
+
+    assert_equals(10, policy.seconds_to_sleep(5, 100, 0.01))
+    assert_equals(0.05, policy.seconds_to_sleep(5, 0.01, 0.99))
+
+
+def test_unknown_progress_falls_back():
+    policy = AdaptivePollingPolicy(0.1, 1, backoff_factor=2)
+
+    assert_equals(0.2, policy.seconds_to_sleep(2, 0.1, 0))
+    assert_equals(0.2, policy.seconds_to_sleep(2, 0.1, 1))
+
+
+def test_typical_completion_time_is_used():
+    policy = AdaptivePollingPolicy(0.05, 10)
+    for elapsed in [2, 3, 4]:
+        policy.record_completion(elapsed)
+
+    assert_equals(3, policy.typical_completion_seconds())
+    assert_equals(2.5, policy.seconds_to_sleep(20, 0.5))
+
+
+def test_slow_history_does_not_slow_down_quick_statements():
+    policy = AdaptivePollingPolicy(0.05, 10)
+    for elapsed in [60, 60, 60]:
+        policy.record_completion(elapsed)
+
+    waits = [policy.seconds_to_sleep(retries, 0.05 * retries) for retries in range(1, 4)]
+
+    assert_equals([0.05, 0.075, 0.1125], [round(wait, 6) for wait in waits])
+
+
+def test_typical_completion_time_passed_uses_backoff():
+    policy = AdaptivePollingPolicy(0.1, 10, backoff_factor=2)
+    policy.record_completion(1)
+
+    assert_equals(0.2, policy.seconds_to_sleep(2, 5))
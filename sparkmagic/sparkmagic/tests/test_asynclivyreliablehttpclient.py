@@ -0,0 +1,202 @@
+import json
+from mock import MagicMock
+from nose.tools import assert_equals, assert_true
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+import sparkmagic.utils.configuration as conf
+import sparkmagic.utils.constants as constants
+from sparkmagic.livyclientlib.asynclivyreliablehttpclient import AsyncLivyReliableHttpClient
+from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.endpoint import Endpoint
+from sparkmagic.livyclientlib.exceptions import HttpClientException, BadUserConfigurationException
+from sparkmagic.livyclientlib.livysession import LivySession
+from sparkmagic.livyclientlib.sqlquery import SQLQuery
+
+
+class FakeLivy(object):
+    """In-memory stand-in for the parts of the Livy REST API used by the client. Sessions report 'starting'
+    on their first GET and 'idle' afterwards; statements report 'running' on their first GET and then
+    'available', echoing the code they were given as their output."""
+    def __init__(self):
+        self.sessions = {}
+        self.statements = {}
+
+    def create_session(self, kind):
+        session_id = len(self.sessions)
+        self.sessions[session_id] = {u"id": session_id, u"state": u"starting", u"kind": kind, u"log": []}
+        self.statements[session_id] = []
+        return dict(self.sessions[session_id])
+
+    def get_session(self, session_id):
+        session = dict(self.sessions[session_id])
+        self.sessions[session_id][u"state"] = u"idle"
+        return session
+
+    def create_statement(self, session_id, code):
+        statements = self.statements[session_id]
+        statement = {u"id": len(statements), u"state": u"running", u"output": None, u"code": code}
+        statements.append(statement)
+        return {u"id": statement[u"id"], u"state": u"waiting", u"output": None}
+
+    def get_statement(self, session_id, statement_id):
+        statement = self.statements[session_id][statement_id]
+        response = {u"id": statement_id, u"state": statement[u"state"], u"output": statement[u"output"]}
+        statement[u"state"] = u"available"
+        statement[u"output"] = {u"status": u"ok", u"execution_count": statement_id,
+                                u"data": {u"text/plain": statement[u"code"]}}
+        return response
+
+
+class _LivyHandler(RequestHandler):
+    def initialize(self, livy):
+        self.livy = livy
+
+    def write_json(self, status, obj):
+        self.set_status(status)
+        self.finish(json.dumps(obj))
+
+    def get_session_id(self, session_id):
+        session_id = int(session_id)
+        if session_id not in self.livy.sessions:
+            self.write_json(404, {u"msg": u"Session '{}' not found.".format(session_id)})
+            return None
+        return session_id
+
+
+class SessionsHandler(_LivyHandler):
+    def get(self):
+        sessions = list(self.livy.sessions.values())
+        self.write_json(200, {u"from": 0, u"total": len(sessions), u"sessions": sessions})
+
+    def post(self):
+        properties = json.loads(self.request.body.decode("utf-8"))
+        self.write_json(201, self.livy.create_session(properties[u"kind"]))
+
+
+class SessionHandler(_LivyHandler):
+    def get(self, session_id):
+        session_id = self.get_session_id(session_id)
+        if session_id is not None:
+            self.write_json(200, self.livy.get_session(session_id))
+
+    def delete(self, session_id):
+        session_id = self.get_session_id(session_id)
+        if session_id is not None:
+            del self.livy.sessions[session_id]
+            self.write_json(200, {u"msg": u"deleted"})
+
+
+class StatementsHandler(_LivyHandler):
+    def post(self, session_id):
+        session_id = self.get_session_id(session_id)
+        if session_id is not None:
+            code = json.loads(self.request.body.decode("utf-8"))[u"code"]
+            self.write_json(201, self.livy.create_statement(session_id, code))
+
+
+class StatementHandler(_LivyHandler):
+    def get(self, session_id, statement_id):
+        session_id = self.get_session_id(session_id)
+        if session_id is not None:
+            self.write_json(200, self.livy.get_statement(session_id, int(statement_id)))
+
+
+class TestAsyncLivyReliableHttpClient(AsyncHTTPTestCase):
+    def setUp(self):
+        conf.override_all({})
+        self.livy = FakeLivy()
+        super(TestAsyncLivyReliableHttpClient, self).setUp()
+        self.endpoint = Endpoint(self.get_url(u""), constants.NO_AUTH)
+
+    def tearDown(self):
+        super(TestAsyncLivyReliableHttpClient, self).tearDown()
+        conf.override_all({})
+
+    def get_app(self):
+        args = dict(livy=self.livy)
+        return Application([
+            (r"/sessions", SessionsHandler, args),
+            (r"/sessions/(\d+)", SessionHandler, args),
+            (r"/sessions/(\d+)/statements", StatementsHandler, args),
+            (r"/sessions/(\d+)/statements/(\d+)", StatementHandler, args),
+        ])
+
+    def _create_session(self, session_id):
+        http_client = MagicMock()
+        http_client.endpoint = self.endpoint
+        session = LivySession(http_client, {u"kind": constants.SESSION_KIND_PYSPARK}, MagicMock(), session_id,
+                              MagicMock())
+        session.sql_context_variable_name = u"spark"
+        return session
+
+    @gen_test
+    def test_session_lifecycle(self):
+        client = AsyncLivyReliableHttpClient.from_endpoint(self.endpoint)
+
+        created = yield client.post_session({u"kind": constants.SESSION_KIND_SPARK})
+        session = yield client.get_session(created[u"id"])
+        sessions = yield client.get_sessions()
+        yield client.delete_session(created[u"id"])
+
+        assert_equals(u"starting", created[u"state"])
+        assert_equals(created[u"id"], session[u"id"])
+        assert_equals(1, sessions[u"total"])
+        assert_equals({}, self.livy.sessions)
+
+    @gen_test
+    def test_statements(self):
+        client = AsyncLivyReliableHttpClient.from_endpoint(self.endpoint)
+        created = yield client.post_session({u"kind": constants.SESSION_KIND_SPARK})
+
+        statement = yield client.post_statement(created[u"id"], {u"code": u"1 + 1"})
+        running = yield client.get_statement(created[u"id"], statement[u"id"])
+        available = yield client.get_statement(created[u"id"], statement[u"id"])
+
+        assert_equals(u"running", running[u"state"])
+        assert_equals(u"1 + 1", available[u"output"][u"data"][u"text/plain"])
+
+    @gen_test
+    def test_invalid_status_code_raises(self):
+        conf.override_all({conf.retry_policy.__name__: constants.LINEAR_RETRY})
+        client = AsyncLivyReliableHttpClient.from_endpoint(self.endpoint)
+
+        try:
+            yield client.get_session(42)
+            assert False
+        except HttpClientException:
+            pass
+
+    def test_kerberos_is_not_supported(self):
+        endpoint = Endpoint(self.get_url(u""), constants.AUTH_KERBEROS)
+        try:
+            AsyncLivyReliableHttpClient.from_endpoint(endpoint)
+            assert False
+        except BadUserConfigurationException:
+            pass
+
+    @gen_test
+    def test_commands_run_concurrently_on_many_sessions(self):
+        sessions = []
+        for _ in range(3):
+            created = self.livy.create_session(constants.SESSION_KIND_PYSPARK)
+            sessions.append(self._create_session(created[u"id"]))
+
+        results = yield [Command(u"print({})".format(s.id)).execute_async(s) for s in sessions]
+
+        assert_equals([(True, u"print({})".format(s.id)) for s in sessions], results)
+        assert_true(all(s.status == constants.IDLE_SESSION_STATUS for s in sessions))
+
+    @gen_test
+    def test_sqlquery_execute_async(self):
+        created = self.livy.create_session(constants.SESSION_KIND_PYSPARK)
+        session = self._create_session(created[u"id"])
+        self.livy.sessions[created[u"id"]][u"state"] = u"idle"
+        sqlquery = SQLQuery(u"SELECT 1", coerce=False)
+        # The stand-in echoes the code back, so make the generated code valid newline-delimited JSON.
+        sqlquery.to_command = MagicMock(return_value=Command(u'{"a": 1}\n{"a": 2}'))
+
+        df = yield sqlquery.execute_async(session)
+
+        assert_equals([1, 2], list(df[u"a"]))
@@ -0,0 +1,82 @@
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is_none
+
+from sparkmagic.livyclientlib.cachedtokenkerberosauth import CachedTokenKerberosAuth
+
+
+def _response(status_code, authorization=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.request.headers = {}
+    if authorization is not None:
+        response.request.headers['Authorization'] = authorization
+    return response
+
+
+def _negotiating_kerberos_auth(token):
+    kerberos_auth = MagicMock()
+
+    def handle_response(response, **kwargs):
+        if response.status_code == 401:
+            negotiated = _response(200, token)
+            return negotiated
+        return response
+
+    kerberos_auth.handle_response.side_effect = handle_response
+    return kerberos_auth
+
+
+def test_no_token_is_sent_before_negotiation():
+    auth = CachedTokenKerberosAuth(MagicMock(), 60)
+    request = MagicMock()
+    request.headers = {}
+
+    auth(request)
+
+    assert 'Authorization' not in request.headers
+    request.register_hook.assert_called_once_with('response', auth.handle_response)
+
+
+def test_negotiated_token_is_cached_and_sent_preemptively():
+    auth = CachedTokenKerberosAuth(_negotiating_kerberos_auth(u"Negotiate abc"), 60)
+
+    auth.handle_response(_response(401))
+    request = MagicMock()
+    request.headers = {}
+    auth(request)
+
+    assert_equals(u"Negotiate abc", auth.get_cached_token())
+    assert_equals(u"Negotiate abc", request.headers['Authorization'])
+
+
+def test_rejected_token_is_renegotiated():
+    kerberos_auth = _negotiating_kerberos_auth(u"Negotiate new")
+    auth = CachedTokenKerberosAuth(kerberos_auth, 60)
+    auth._token = u"Negotiate old"
+    auth._token_expiration = float("inf")
+
+    response = auth.handle_response(_response(401, u"Negotiate old"))
+
+    assert_equals(200, response.status_code)
+    assert_equals(u"Negotiate new", auth.get_cached_token())
+
+
+def test_failed_negotiation_is_not_cached():
+    kerberos_auth = MagicMock()
+    kerberos_auth.handle_response.side_effect = lambda response, **kwargs: response
+    auth = CachedTokenKerberosAuth(kerberos_auth, 60)
+    auth._token = u"Negotiate old"
+    auth._token_expiration = float("inf")
+
+    auth.handle_response(_response(401, u"Negotiate old"))
+
+    assert_is_none(auth.get_cached_token())
+
+
+def test_token_expires():
+    auth = CachedTokenKerberosAuth(_negotiating_kerberos_auth(u"Negotiate abc"), 60)
+
+    with patch('sparkmagic.livyclientlib.cachedtokenkerberosauth.time', return_value=1000):
+        auth.handle_response(_response(401))
+    with patch('sparkmagic.livyclientlib.cachedtokenkerberosauth.time', return_value=1061):
+        assert_is_none(auth.get_cached_token())
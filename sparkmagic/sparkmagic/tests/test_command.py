@@ -57,7 +57,7 @@ def test_execute_waiting():
     http_client.post_session.return_value = tls.TestLivySession.session_create_json
     http_client.post_statement.return_value = tls.TestLivySession.post_statement_json
     http_client.get_session.return_value = tls.TestLivySession.ready_sessions_json
-    http_client.get_statement.side_effect = [tls.TestLivySession.waiting_statement_json, tls.TestLivySession.waiting_statement_json, tls.TestLivySession.ready_statement_json, tls.TestLivySession.ready_statement_json]
+    http_client.get_statement.side_effect = [tls.TestLivySession.waiting_statement_json, tls.TestLivySession.waiting_statement_json, tls.TestLivySession.probe_statement_json, tls.TestLivySession.ready_statement_json]
     session = _create_session(kind=kind, http_client=http_client)
     session.start()
     command = Command("command", spark_events=spark_events)
@@ -178,3 +178,21 @@ def test_execute_failure_get_statement_output_emits_event():
                                                                                    -1, False, "AttributeError",
                                                                                    "OHHHH")
         assert_equals(e, command._get_statement_output.side_effect)
+
+
+@with_setup(_setup)
+def test_get_statement_output_polls_with_progress():
+    session = MagicMock()
+    session.http_client.get_statement.side_effect = [
+        {u"id": 0, u"state": u"running", u"output": None, u"progress": 0.5},
+        tls.TestLivySession.ready_statement_json]
+    command = Command("command")
+
+    result = command._get_statement_output(session, 0)
+
+    assert_equals((True, tls.TestLivySession.pi_result), result)
+    assert_equals(1, session.sleep.call_count)
+    (retries, elapsed, progress) = session.sleep.call_args[0]
+    assert_equals(1, retries)
+    assert_equals(0.5, progress)
+    assert_equals(1, session.record_statement_completion.call_count)
@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+from time import time
+
+from mock import patch
+from nose.tools import assert_equals, assert_is_none, with_setup
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from sparkmagic.livyclientlib.diskresultcache import DiskResultCache
+
+
+path = None
+
+
+def _setup():
+    global path
+    path = tempfile.mkdtemp()
+
+
+def _teardown():
+    shutil.rmtree(path)
+
+
+def _df(rows=10):
+    return pd.DataFrame({u'a': list(range(rows)), u'b': [u'text {}'.format(i) for i in range(rows)]})
+
+
+@with_setup(_setup, _teardown)
+def test_round_trip_parquet():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    df = _df()
+    df[u'c'] = pd.to_datetime([u'2020-01-{:02d}'.format(i + 1) for i in range(10)], utc=True)
+    df[u'd'] = df[u'b'].astype(u'category')
+    key = DiskResultCache.key(u'http://livy', u'SELECT 1')
+
+    cache.put(key, df, u'SELECT 1')
+
+    assert os.path.isfile(os.path.join(path, key + u'.parquet'))
+    assert_frame_equal(df, cache.get(key))
+    assert_equals(1, cache.hits)
+
+
+@with_setup(_setup, _teardown)
+def test_round_trip_pickle_for_nested_values():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    df = pd.DataFrame({u'a': [[1, 2], [3]], u'b': [{u'x': 1}, None]})
+
+    cache.put(u'nested', df)
+
+    assert os.path.isfile(os.path.join(path, u'nested.pkl'))
+    result = cache.get(u'nested')
+    assert_frame_equal(df, result)
+    assert_equals([1, 2], result[u'a'][0])
+
+
+@with_setup(_setup, _teardown)
+def test_round_trip_pickle_without_pyarrow():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    with patch('sparkmagic.livyclientlib.diskresultcache._parquet_safe', return_value=False):
+        cache.put(u'key', _df())
+    assert os.path.isfile(os.path.join(path, u'key.pkl'))
+    assert_frame_equal(_df(), cache.get(u'key'))
+
+
+@with_setup(_setup, _teardown)
+def test_miss_and_expiry():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    assert_is_none(cache.get(u'key'))
+
+    cache.put(u'key', _df())
+    old = time() - 120
+    os.utime(os.path.join(path, u'key.parquet'), (old, old))
+
+    assert_is_none(cache.get(u'key'))
+    assert_equals(2, cache.misses)
+    assert_equals([], cache.entries())
+
+
+@with_setup(_setup, _teardown)
+def test_evicts_least_recently_read():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    cache.put(u'a', _df(1000))
+    size = cache.entries()[0][u'bytes']
+    cache = DiskResultCache(path, 2 * size, 60)
+    cache.put(u'b', _df(1000))
+    for (key, age) in ((u'a', 30), (u'b', 20)):
+        accessed = time() - age
+        os.utime(os.path.join(path, key + u'.json'), (accessed, accessed))
+    cache.get(u'a')
+
+    cache.put(u'c', _df(1000))
+
+    assert_equals([u'c', u'a'], [entry[u'key'] for entry in cache.entries()])
+    assert_is_none(cache.get(u'b'))
+
+
+@with_setup(_setup, _teardown)
+def test_entries_stats_and_clear():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    cache.put(u'a', _df(), u'SELECT a')
+    cache.get(u'a')
+    cache.get(u'b')
+
+    entries = cache.entries()
+    assert_equals(1, len(entries))
+    assert_equals(u'SELECT a', entries[0][u'description'])
+    assert_equals(10, entries[0][u'rows'])
+    assert_equals(2, entries[0][u'columns'])
+    assert_equals(u'parquet', entries[0][u'format'])
+
+    stats = cache.stats()
+    assert_equals(1, stats[u'entries'])
+    assert_equals(entries[0][u'bytes'], stats[u'bytes'])
+    assert_equals(1, stats[u'hits'])
+    assert_equals(1, stats[u'misses'])
+
+    cache.clear()
+    assert_equals([], cache.entries())
+    assert_equals([], os.listdir(path))
+
+
+@with_setup(_setup, _teardown)
+def test_failed_write_is_not_raised():
+    cache = DiskResultCache(os.path.join(path, u'file'), 10 ** 7, 60)
+    open(os.path.join(path, u'file'), u'w').close()
+    cache.put(u'a', _df())
+    assert_is_none(cache.get(u'a'))
+
+
+@with_setup(_setup, _teardown)
+def test_invalidate_session():
+    cache = DiskResultCache(path, 10 ** 7, 60)
+    cache.put(u'a', _df(), u'SELECT 1', u'http://livy', 3)
+    cache.put(u'b', _df(), u'SELECT 1', u'http://livy', 4)
+    cache.put(u'c', _df(), u'SELECT 1', u'http://other', 3)
+
+    cache.invalidate(u'http://livy', 3)
+    assert_is_none(cache.get(u'a'))
+    assert cache.get(u'b') is not None
+
+    cache.invalidate(u'http://livy')
+    assert_is_none(cache.get(u'b'))
+    assert cache.get(u'c') is not None
+
+
+def test_key_depends_on_every_part():
+    assert_equals(DiskResultCache.key(u'url', u'q', 10, 0.1), DiskResultCache.key(u'url', u'q', 10, 0.1))
+    assert DiskResultCache.key(u'url', u'q', 10, 0.1) != DiskResultCache.key(u'url', u'q', 11, 0.1)
+    assert DiskResultCache.key(u'url', u'q', None) != DiskResultCache.key(u'other', u'q', None)
+
+
+def test_disabled():
+    assert not DiskResultCache(u'unused', 0, 60).enabled()
@@ -6,7 +6,7 @@ from tornado.testing import gen_test
 from tornado.testing import AsyncTestCase
 import json
 
-from sparkmagic.serverextension.handlers import ReconnectHandler
+from sparkmagic.serverextension.handlers import ReconnectHandler, _session_pool_targets
 from sparkmagic.kernels.kernelmagics import KernelMagics
 import sparkmagic.utils.configuration as conf
 from sparkmagic.utils import constants
@@ -222,3 +222,18 @@ class TestSparkMagicHandler(AsyncTestCase):
         self.kernel_manager.get_kernel.assert_not_called()
         _get_kernel_manager_new_session.assert_called_once_with(self.path, different_kernel)
         self.session_manager.delete_session.assert_called_once_with(self.session_id)
+
+
+def test_session_pool_targets():
+    conf.override_all({"session_pool_languages": ["python", "scala"],
+                       "kernel_python_credentials": {"username": "", "password": "", "url": "http://livy:8998",
+                                                     "auth": constants.NO_AUTH},
+                       "kernel_scala_credentials": {"username": "", "password": "", "url": "",
+                                                    "auth": constants.NO_AUTH}})
+    targets = _session_pool_targets()
+    conf.override_all({})
+
+    assert_equals(len(targets), 1)
+    (endpoint, properties) = targets[0]
+    assert_equals(endpoint.url, "http://livy:8998")
+    assert_equals(properties, {"kind": constants.SESSION_KIND_PYSPARK})
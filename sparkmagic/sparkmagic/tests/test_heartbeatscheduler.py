@@ -0,0 +1,163 @@
+from mock import MagicMock
+from nose.tools import assert_equals, with_setup
+from time import sleep, time
+
+import sparkmagic.utils.configuration as conf
+from sparkmagic.livyclientlib.heartbeatscheduler import HeartbeatScheduler, get_heartbeat_scheduler
+
+
+def _setup():
+    conf.override_all({
+        "heartbeat_refresh_seconds": 10,
+        "heartbeat_retry_seconds": 1,
+        "heartbeat_jitter_seconds": 0
+    })
+
+
+def _teardown():
+    conf.override_all({})
+
+
+def _session(endpoint=u"endpoint", session_id=0):
+    session = MagicMock()
+    session.endpoint = endpoint
+    session.id = session_id
+    return session
+
+
+def _scheduler():
+    scheduler = HeartbeatScheduler()
+    scheduler._start_thread = MagicMock()
+    return scheduler
+
+
+@with_setup(_setup, _teardown)
+def test_add_and_remove():
+    scheduler = _scheduler()
+    session = _session()
+
+    scheduler.add(session)
+    scheduler.add(session)
+    assert_equals([session], scheduler.sessions())
+
+    scheduler.remove(session)
+    assert_equals([], scheduler.sessions())
+
+
+@with_setup(_setup, _teardown)
+def test_run_pending_waits_for_refresh_seconds():
+    scheduler = _scheduler()
+    session = _session()
+    scheduler.add(session)
+
+    assert_equals(0, scheduler.run_pending())
+    assert_equals(1, scheduler.run_pending(time() + 10))
+
+    session.refresh_status_and_info.assert_called_once_with()
+
+
+@with_setup(_setup, _teardown)
+def test_sessions_on_one_endpoint_share_a_heartbeat():
+    scheduler = _scheduler()
+    sessions = [_session(session_id=i) for i in range(3)]
+    other = _session(endpoint=u"other")
+    for session in sessions + [other]:
+        scheduler.add(session)
+
+    assert_equals(2, len(scheduler._heap))
+    assert_equals(2, scheduler.run_pending(time() + 10))
+    for session in sessions + [other]:
+        session.refresh_status_and_info.assert_called_once_with()
+
+
+@with_setup(_setup, _teardown)
+def test_failure_schedules_retry():
+    scheduler = _scheduler()
+    session = _session()
+    session.refresh_status_and_info.side_effect = ValueError
+    scheduler.add(session)
+
+    scheduler.run_pending(time() + 10)
+
+    assert_equals(1, len(scheduler._heap))
+    assert scheduler._heap[0][0] <= time() + 1
+
+
+@with_setup(_setup, _teardown)
+def test_removed_endpoint_is_not_refreshed():
+    scheduler = _scheduler()
+    session = _session()
+    scheduler.add(session)
+    scheduler.remove(session)
+
+    assert_equals(0, scheduler.run_pending(time() + 10))
+    assert_equals(0, session.refresh_status_and_info.call_count)
+    assert_equals([], scheduler._heap)
+
+
+@with_setup(_setup, _teardown)
+def test_readded_endpoint_keeps_one_heartbeat():
+    scheduler = _scheduler()
+    session = _session()
+    scheduler.add(session)
+    scheduler.remove(session)
+    scheduler.add(session)
+
+    assert_equals(1, len(scheduler._heap))
+    assert_equals(1, scheduler.run_pending(time() + 10))
+    assert_equals(1, len(scheduler._heap))
+    assert_equals(1, scheduler.run_pending(time() + 20))
+    assert_equals(2, session.refresh_status_and_info.call_count)
+
+
+@with_setup(_setup, _teardown)
+def test_endpoint_readded_during_refresh_keeps_one_heartbeat():
+    scheduler = _scheduler()
+    session = _session()
+
+    def readd():
+        scheduler.remove(session)
+        scheduler.add(session)
+    session.refresh_status_and_info.side_effect = readd
+    scheduler.add(session)
+
+    scheduler.run_pending(time() + 10)
+
+    assert_equals(1, len(scheduler._heap))
+
+
+def test_jitter_spreads_due_times():
+    conf.override_all({
+        "heartbeat_refresh_seconds": 10,
+        "heartbeat_jitter_seconds": 5
+    })
+    scheduler = _scheduler()
+    start = time()
+    for i in range(20):
+        scheduler.add(_session(endpoint=i))
+    conf.override_all({})
+
+    due_times = [due for (due, _, _) in scheduler._heap]
+    assert all(start + 10 <= due <= time() + 15 for due in due_times)
+    assert len(set(due_times)) > 1
+
+
+def test_thread_sends_heartbeats():
+    conf.override_all({
+        "heartbeat_refresh_seconds": 0.01,
+        "heartbeat_jitter_seconds": 0
+    })
+    scheduler = HeartbeatScheduler()
+    session = _session()
+
+    scheduler.add(session)
+    sleep(0.2)
+    scheduler.remove(session)
+    conf.override_all({})
+
+    assert session.refresh_status_and_info.call_count > 1
+    assert scheduler._thread.daemon
+
+
+def test_get_heartbeat_scheduler_is_shared():
+    assert get_heartbeat_scheduler() is get_heartbeat_scheduler()
@@ -1,4 +1,6 @@
-from mock import MagicMock
+import threading
+
+from mock import MagicMock, patch
 from nose.tools import with_setup, raises, assert_equals, assert_is
 from IPython.core.magic import magics_class
 
@@ -10,6 +12,7 @@ from sparkmagic.livyclientlib.exceptions import LivyClientTimeoutException, BadU
     HttpClientException, DataFrameParseException, SqlContextNotFoundException
 from sparkmagic.livyclientlib.endpoint import Endpoint
 from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.sessionstore import SessionStore
 from sparkmagic.utils.constants import NO_AUTH, AUTH_BASIC
 
 magic = None
@@ -73,6 +76,229 @@ def test_start_session():
     assert spark_controller.add_session.call_count == 1
 
 
+@with_setup(_setup, _teardown)
+def test_start_session_from_pool():
+    conf.override_all({"session_pool_size": 1})
+    spark_controller.add_pooled_session.return_value = True
+
+    ret = magic._do_not_call_start_session("")
+
+    assert ret
+    spark_controller.add_pooled_session.assert_called_once_with(magic.session_name, magic.endpoint,
+                                                                {"kind": constants.SESSION_KIND_PYSPARK})
+    assert_equals(spark_controller.add_session.call_count, 0)
+
+    magic.session_started = False
+    spark_controller.add_pooled_session.return_value = False
+    magic._do_not_call_start_session("")
+    spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
+                                                         {"kind": constants.SESSION_KIND_PYSPARK})
+    conf.override_all({})
+
+
+@with_setup(_setup, _teardown)
+@patch.dict("os.environ", {"JPY_SESSION_NAME": "notebook.ipynb"})
+def test_start_session_reattaches_after_restart():
+    conf.override_all({"persist_kernel_sessions": True})
+    magic._session_store = store = MagicMock()
+    store.get.return_value = (magic.endpoint.url, 4,
+                              SessionStore.properties_key({"kind": constants.SESSION_KIND_PYSPARK}))
+    spark_controller.reattach_session.return_value = True
+
+    assert magic._do_not_call_start_session("")
+
+    spark_controller.reattach_session.assert_called_once_with(magic.session_name, magic.endpoint,
+                                                              {"kind": constants.SESSION_KIND_PYSPARK}, 4)
+    assert_equals(spark_controller.add_session.call_count, 0)
+
+    # A restart keeps the session; deleting it, as %%configure -f does, forgets it.
+    magic._do_not_call_release_session("")
+    assert not magic.session_started
+    assert_equals(spark_controller.delete_session_by_name.call_count, 0)
+
+    magic._do_not_call_start_session("")
+    magic._do_not_call_delete_session("")
+    store.remove.assert_called_once_with("notebook.ipynb")
+    spark_controller.delete_session_by_name.assert_called_once_with(magic.session_name)
+    conf.override_all({})
+
+
+@with_setup(_setup, _teardown)
+@patch.dict("os.environ", {"JPY_SESSION_NAME": "notebook.ipynb"})
+def test_start_session_stores_new_session():
+    conf.override_all({"persist_kernel_sessions": True})
+    magic._session_store = store = MagicMock()
+    store.get.return_value = ("other_url", 4, SessionStore.properties_key({"kind": constants.SESSION_KIND_PYSPARK}))
+    spark_controller.get_session_id_for_client.return_value = 7
+
+    assert magic._do_not_call_start_session("")
+
+    assert_equals(spark_controller.reattach_session.call_count, 0)
+    spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
+                                                         {"kind": constants.SESSION_KIND_PYSPARK})
+    store.set.assert_called_once_with("notebook.ipynb", magic.endpoint.url, 7,
+                                      {"kind": constants.SESSION_KIND_PYSPARK})
+    conf.override_all({})
+
+
+@with_setup(_setup, _teardown)
+@patch.dict("os.environ", {"JPY_SESSION_NAME": "notebook.ipynb"})
+def test_start_session_does_not_reattach_after_configure_changed():
+    conf.override_all({"persist_kernel_sessions": True})
+    magic._session_store = store = MagicMock()
+    store.get.return_value = (magic.endpoint.url, 4,
+                              SessionStore.properties_key({"kind": constants.SESSION_KIND_PYSPARK}))
+    spark_controller.get_session_id_for_client.return_value = 7
+    magic._override_session_settings({"executorMemory": "8g"})
+    properties = {"kind": constants.SESSION_KIND_PYSPARK, "executorMemory": "8g"}
+
+    assert magic._do_not_call_start_session("")
+
+    assert_equals(spark_controller.reattach_session.call_count, 0)
+    spark_controller.delete_session_by_id.assert_called_once_with(magic.endpoint, 4)
+    spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False, properties)
+    store.set.assert_called_once_with("notebook.ipynb", magic.endpoint.url, 7, properties)
+    conf.override_all({})
+
+
+@with_setup(_setup, _teardown)
+@patch.dict("os.environ", {"JPY_SESSION_NAME": "notebook.ipynb"})
+def test_start_session_forgets_session_that_cannot_be_reattached():
+    conf.override_all({"persist_kernel_sessions": True})
+    magic._session_store = store = MagicMock()
+    store.get.return_value = (magic.endpoint.url, 4,
+                              SessionStore.properties_key({"kind": constants.SESSION_KIND_PYSPARK}))
+    spark_controller.reattach_session.return_value = False
+    spark_controller.add_session.side_effect = ValueError("no capacity")
+
+    assert not magic._do_not_call_start_session("")
+
+    store.remove.assert_called_once_with("notebook.ipynb")
+    assert_equals(store.set.call_count, 0)
+    conf.override_all({})
+
+
+@with_setup(_setup, _teardown)
+def test_release_session_deletes_when_not_persisted():
+    magic._session_store = store = MagicMock()
+    magic.session_started = True
+
+    magic._do_not_call_release_session("")
+
+    spark_controller.delete_session_by_name.assert_called_once_with(magic.session_name)
+    assert_equals(store.method_calls, [])
+
+
+@with_setup(_setup, _teardown)
+def test_start_session_in_background():
+    conf.override_all({"start_session_in_background": True})
+    magic._do_not_call_change_language("-l python")
+    conf.override_all({})
+
+    assert magic.session_started
+    ret = magic._do_not_call_start_session("")
+
+    assert ret
+    spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
+                                                         {"kind": constants.SESSION_KIND_PYSPARK})
+    assert magic._background_start is None
+    assert magic._do_not_call_start_session("")
+    assert_equals(spark_controller.add_session.call_count, 1)
+
+
+@with_setup(_setup, _teardown)
+def test_background_session_output_is_shown_by_first_cell():
+    display = spark_controller.ipython_display
+    spark_controller.add_session.side_effect = \
+        lambda *args: spark_controller.ipython_display.writeln(u"Starting Spark application")
+    magic._start_session_in_background()
+    magic._background_start.wait()
+
+    assert_equals(display.writeln.call_count, 0)
+    assert magic._do_not_call_start_session("")
+    display.writeln.assert_called_once_with(u"Starting Spark application")
+
+    spark_controller.ipython_display.writeln(u"from the cell")
+    display.writeln.assert_called_with(u"from the cell")
+
+
+@with_setup(_setup, _teardown)
+def test_start_session_in_background_fails_on_first_cell():
+    spark_controller.add_session = MagicMock(side_effect=LivyClientTimeoutException)
+    magic._start_session_in_background()
+    magic._background_start.wait()
+    assert_equals(ipython_display.send_error.call_count, 0)
+
+    ret = magic._do_not_call_start_session("")
+
+    assert not ret
+    assert magic.fatal_error
+    assert_equals(ipython_display.send_error.call_count, 1)
+
+
+@with_setup(_setup, _teardown)
+def test_configure_restarts_background_session():
+    magic.info = MagicMock()
+    magic._start_session_in_background()
+
+    magic.configure('', '{"extra": "yes"}')
+    assert magic._do_not_call_start_session("")
+    conf.override_all({})
+
+    spark_controller.abandon_session.assert_called_with(magic.session_name)
+    assert_equals(spark_controller.delete_session_by_name.call_count, 0)
+    spark_controller.add_session.assert_called_with(magic.session_name, magic.endpoint, False,
+                                                    {"kind": constants.SESSION_KIND_PYSPARK, "extra": "yes"})
+    assert_equals(spark_controller.add_session.call_count, 2)
+    assert_equals(ipython_display.send_error.call_count, 0)
+
+
+@with_setup(_setup, _teardown)
+def test_configure_does_not_wait_for_background_session():
+    magic.info = MagicMock()
+    display = spark_controller.ipython_display
+    started = threading.Event()
+    release = threading.Event()
+
+    def add_session(name, endpoint, skip_if_exists, properties):
+        if "extra" not in properties:
+            # The first session is still waiting for YARN.
+            spark_controller.ipython_display.writeln(u"Starting Spark application")
+            started.set()
+            release.wait(5)
+            raise HttpClientException(u"session deleted")
+    spark_controller.add_session.side_effect = add_session
+    spark_controller.abandon_session.return_value = True
+    magic._start_session_in_background()
+    first_start = magic._background_start
+    started.wait(5)
+
+    magic.configure('', '{"extra": "yes"}')
+
+    # configure returned while the first session was still starting.
+    assert not first_start.done()
+    spark_controller.abandon_session.assert_called_with(magic.session_name)
+    release.set()
+    assert magic._do_not_call_start_session("")
+    conf.override_all({})
+    spark_controller.add_session.assert_called_with(magic.session_name, magic.endpoint, False,
+                                                    {"kind": constants.SESSION_KIND_PYSPARK, "extra": "yes"})
+    assert_equals(display.writeln.call_count, 0)
+    assert_equals(ipython_display.send_error.call_count, 0)
+
+
+@with_setup(_setup, _teardown)
+def test_change_endpoint_restarts_background_session():
+    magic._start_session_in_background()
+
+    magic._do_not_call_change_endpoint("-s server -u user -p password -t {}".format(AUTH_BASIC))
+    assert magic._do_not_call_start_session("")
+
+    spark_controller.abandon_session.assert_called_with(magic.session_name)
+    assert_equals(spark_controller.add_session.call_count, 2)
+    assert_equals(Endpoint("server", AUTH_BASIC, "user", "password"), magic.endpoint)
+
+
 @with_setup(_setup, _teardown)
 def test_start_session_times_out():
     line = ""
@@ -542,7 +768,7 @@ def test_spark_sample_options():
     magic.execute_spark = MagicMock()
     ret = magic.spark(line, cell)
 
-    magic.execute_spark.assert_called_once_with(cell, "var_name", "sample", 142, 0.3, None, True)
+    magic.execute_spark.assert_called_once_with(cell, "var_name", "sample", 142, 0.3, None, True, False, False, None)
 
 
 @with_setup(_setup, _teardown)
@@ -552,7 +778,17 @@ def test_spark_false_coerce():
     magic.execute_spark = MagicMock()
     ret = magic.spark(line, cell)
 
-    magic.execute_spark.assert_called_once_with(cell, "var_name", "sample", 142, 0.3, None, False)
+    magic.execute_spark.assert_called_once_with(cell, "var_name", "sample", 142, 0.3, None, False, False, False, None)
+
+
+@with_setup(_setup, _teardown)
+def test_spark_lazy_and_refresh():
+    line = "-o var_name --lazy --refresh"
+    cell = ""
+    magic.execute_spark = MagicMock()
+    ret = magic.spark(line, cell)
+
+    magic.execute_spark.assert_called_once_with(cell, "var_name", None, None, None, None, None, True, True, None)
 
 
 @with_setup(_setup, _teardown)
@@ -565,7 +801,7 @@ def test_sql_without_output():
 
     spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
                                                          {"kind": constants.SESSION_KIND_PYSPARK})
-    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, None, False, None)
+    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, None, False, None, False, None)
 
 
 @with_setup(_setup, _teardown)
@@ -578,7 +814,7 @@ def test_sql_with_output():
 
     spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
                                                          {"kind": constants.SESSION_KIND_PYSPARK})
-    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None)
+    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None, False, None)
 
 
 @with_setup(_setup, _teardown)
@@ -588,7 +824,7 @@ def test_sql_exception():
     magic.execute_sqlquery = MagicMock(side_effect=ValueError('HAHAHAHAH'))
 
     magic.sql(line, cell)
-    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None)
+    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None, False, None)
     ipython_display.send_error.assert_called_once_with(constants.INTERNAL_ERROR_MSG
                                                        .format(magic.execute_sqlquery.side_effect))
 
@@ -600,7 +836,7 @@ def test_sql_expected_exception():
     magic.execute_sqlquery = MagicMock(side_effect=HttpClientException('HAHAHAHAH'))
 
     magic.sql(line, cell)
-    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None)
+    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None, False, None)
     ipython_display.send_error.assert_called_once_with(constants.EXPECTED_ERROR_MSG
                                                        .format(magic.execute_sqlquery.side_effect))
 
@@ -628,7 +864,7 @@ def test_sql_quiet():
 
     spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
                                                          {"kind": constants.SESSION_KIND_PYSPARK})
-    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "Output", True, None)
+    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "Output", True, None, False, None)
 
 
 @with_setup(_setup, _teardown)
@@ -641,7 +877,30 @@ def test_sql_sample_options():
 
     spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
                                                          {"kind": constants.SESSION_KIND_PYSPARK})
-    magic.execute_sqlquery.assert_called_once_with(cell, "sample", 142, 0.3, None, None, True, True)
+    magic.execute_sqlquery.assert_called_once_with(cell, "sample", 142, 0.3, None, None, True, True, False, None)
+
+
+@with_setup(_setup, _teardown)
+def test_sql_stratify():
+    line = "-m stratified --stratify country -n 100"
+    cell = ""
+    magic.execute_sqlquery = MagicMock()
+
+    magic.sql(line, cell)
+
+    magic.execute_sqlquery.assert_called_once_with(cell, "stratified", 100, None, None, None, False, None, False,
+                                                   "country")
+
+
+@with_setup(_setup, _teardown)
+def test_sql_refresh():
+    line = "-o my_var --refresh"
+    cell = "some spark code"
+    magic.execute_sqlquery = MagicMock()
+
+    magic.sql(line, cell)
+
+    magic.execute_sqlquery.assert_called_once_with(cell, None, None, None, None, "my_var", False, None, True, None)
 
 
 @with_setup(_setup, _teardown)
@@ -654,7 +913,7 @@ def test_sql_false_coerce():
 
     spark_controller.add_session.assert_called_once_with(magic.session_name, magic.endpoint, False,
                                                          {"kind": constants.SESSION_KIND_PYSPARK})
-    magic.execute_sqlquery.assert_called_once_with(cell, "sample", 142, 0.3, None, None, True, False)
+    magic.execute_sqlquery.assert_called_once_with(cell, "sample", 142, 0.3, None, None, True, False, False, None)
 
 
 @with_setup(_setup, _teardown)
@@ -896,3 +1155,52 @@ def _assert_magic_failure_event_emitted_once(name, error):
     spark_events.emit_magic_execution_end_event.assert_called_once_with(name, constants.SESSION_KIND_PYSPARK,
                                                                         magic._generate_uuid.return_value, False,
                                                                         error.__class__.__name__, str(error))
+
+
+@with_setup(_setup, _teardown)
+def test_cache_list():
+    entries = [{u"key": u"k", u"description": u"SELECT <1>", u"rows": 5, u"columns": 2, u"bytes": 100,
+                u"format": u"parquet", u"created": 0, u"accessed": 0}]
+    with patch('sparkmagic.kernels.kernelmagics.get_disk_result_cache') as get_disk_result_cache:
+        get_disk_result_cache.return_value.entries.return_value = entries
+        magic.cache("list", "")
+
+    html = ipython_display.html.call_args[0][0]
+    assert u"SELECT &lt;1&gt;" in html
+    assert u"parquet" in html
+
+
+@with_setup(_setup, _teardown)
+def test_cache_list_empty():
+    with patch('sparkmagic.kernels.kernelmagics.get_disk_result_cache') as get_disk_result_cache:
+        get_disk_result_cache.return_value.entries.return_value = []
+        magic.cache("", "")
+
+    ipython_display.write.assert_called_once_with(u"No cached results.")
+
+
+@with_setup(_setup, _teardown)
+def test_cache_stats():
+    with patch('sparkmagic.kernels.kernelmagics.get_disk_result_cache') as get_disk_result_cache:
+        get_disk_result_cache.return_value.stats.return_value = {u"path": u"/cache", u"entries": 2, u"bytes": 10,
+                                                                 u"max_bytes": 100, u"hits": 3, u"misses": 4,
+                                                                 u"ttl_seconds": 60}
+        magic.cache("stats", "")
+
+    assert u"/cache: 2 results, 10 of 100 bytes, 3 hits, 4 misses" in ipython_display.write.call_args[0][0]
+
+
+@with_setup(_setup, _teardown)
+def test_cache_clear():
+    with patch('sparkmagic.kernels.kernelmagics.get_disk_result_cache') as get_disk_result_cache, \
+            patch('sparkmagic.kernels.kernelmagics.get_result_cache') as get_result_cache:
+        magic.cache("clear", "")
+
+    get_disk_result_cache.return_value.clear.assert_called_once_with()
+    get_result_cache.return_value.clear.assert_called_once_with()
+
+
+@with_setup(_setup, _teardown)
+def test_cache_unknown_command():
+    magic.cache("drop", "")
+    assert_equals(1, ipython_display.send_error.call_count)
@@ -74,8 +74,9 @@ def test_custom_headers():
     endpoint = Endpoint("http://url.com", constants.NO_AUTH)
     client = LivyReliableHttpClient.from_endpoint(endpoint)
     headers = client.get_headers()
-    assert_equals(len(headers), 2)
+    assert_equals(len(headers), 3)
     assert_equals("Content-Type" in headers, True)
+    assert_equals(headers["Accept-Encoding"], "gzip")
     assert_equals("header1" in headers, True)
 
 
@@ -107,3 +108,10 @@ def test_retry_policy():
 def _override_policy(policy):
     overrides = { conf.retry_policy.__name__: policy }
     conf.override_all(overrides)
+
+
+def test_close():
+    http_client = MagicMock()
+    livy_client = LivyReliableHttpClient(http_client, None)
+    livy_client.close()
+    http_client.close.assert_called_once_with()
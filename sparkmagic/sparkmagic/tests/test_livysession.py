@@ -1,5 +1,5 @@
 ﻿import json
-from mock import MagicMock, call
+from mock import MagicMock, call, patch
 from nose.tools import raises, assert_equals
 
 import sparkmagic.utils.constants as constants
@@ -38,6 +38,9 @@ class TestLivySession(object):
     running_statement_json = json.loads('{"id":0,"state":"running","output":null}')
     ready_statement_json = json.loads('{"id":0,"state":"available","output":{"status":"ok",'
                                       '"execution_count":0,"data":{"text/plain":"Pi is roughly 3.14336"}}}')
+    probe_statement_json = json.loads('{"id":0,"state":"available","output":{"status":"ok","execution_count":0,'
+                                      '"data":{"text/plain":"{\\"spark\\": true, \\"sqlContext\\": false, '
+                                      '\\"hive\\": false, \\"version\\": \\"2.4.0\\"}"}}}')
     ready_statement_null_output_json = json.loads('{"id":0,"state":"available","output":null}')
     ready_statement_failed_json = json.loads('{"id":0,"state":"available","output":{"status":"error",'
                                              '"evalue":"error","traceback":"error"}}')
@@ -55,7 +58,7 @@ class TestLivySession(object):
     def setup(self):
         self.http_client = MagicMock()
         self.spark_events = MagicMock()
-        self.heartbeat_thread = MagicMock()
+        self.heartbeat_scheduler = MagicMock()
 
     def _next_statement_response_get(self, *args):
         val = self.get_statement_responses[0]
@@ -86,12 +89,12 @@ class TestLivySession(object):
                               session_id,
                               self.spark_events,
                               heartbeat_timeout,
-                              self.heartbeat_thread)
+                              self.heartbeat_scheduler)
         return session
 
     def _create_session_with_fixed_get_response(self, get_session_json):
         self.http_client.get_session.return_value = get_session_json
-        self.http_client.get_statement.return_value = self.ready_statement_json
+        self.http_client.get_statement.return_value = self.probe_statement_json
         session = self._create_session()
         session.start()
         return session
@@ -107,7 +110,8 @@ class TestLivySession(object):
         session = self._create_session(session_id=session_id, heartbeat_timeout=0)
 
         assert session.id == session_id
-        assert session._heartbeat_thread is None
+        assert not session._heartbeating
+        assert_equals(0, self.heartbeat_scheduler.add.call_count)
         assert constants.LIVY_HEARTBEAT_TIMEOUT_PARAM not in list(session.properties.keys())
         
     def test_constructor_starts_heartbeat_with_existing_session(self):
@@ -119,9 +123,8 @@ class TestLivySession(object):
         conf.override_all({})
         
         assert session.id == session_id
-        assert self.heartbeat_thread.daemon
-        self.heartbeat_thread.start.assert_called_once_with()
-        assert not session._heartbeat_thread is None
+        self.heartbeat_scheduler.add.assert_called_once_with(session)
+        assert session._heartbeating
         assert session.properties[constants.LIVY_HEARTBEAT_TIMEOUT_PARAM ] > 0
         
     def test_start_with_heartbeat(self):
@@ -132,9 +135,8 @@ class TestLivySession(object):
         session = self._create_session()
         session.start()
         
-        assert self.heartbeat_thread.daemon
-        self.heartbeat_thread.start.assert_called_once_with()
-        assert not session._heartbeat_thread is None
+        self.heartbeat_scheduler.add.assert_called_once_with(session)
+        assert session._heartbeating
         assert session.properties[constants.LIVY_HEARTBEAT_TIMEOUT_PARAM ] > 0
         
     def test_start_with_heartbeat_calls_only_once(self):
@@ -147,9 +149,8 @@ class TestLivySession(object):
         session.start()
         session.start()
 
-        assert self.heartbeat_thread.daemon
-        self.heartbeat_thread.start.assert_called_once_with()
-        assert not session._heartbeat_thread is None
+        self.heartbeat_scheduler.add.assert_called_once_with(session)
+        assert session._heartbeating
         
     def test_delete_with_heartbeat(self):
         self.http_client.post_session.return_value = self.session_create_json
@@ -158,12 +159,11 @@ class TestLivySession(object):
 
         session = self._create_session()
         session.start()
-        heartbeat_thread = session._heartbeat_thread
-        
+
         session.delete()
         
-        self.heartbeat_thread.stop.assert_called_once_with()
-        assert session._heartbeat_thread is None
+        self.heartbeat_scheduler.remove.assert_called_once_with(session)
+        assert not session._heartbeating
 
     def test_constructor_starts_with_no_session(self):
         session = self._create_session()
@@ -222,6 +222,20 @@ class TestLivySession(object):
         assert_equals(0, session.id)
         self.http_client.post_session.assert_called_with({"kind": "pyspark", "heartbeatTimeoutInSecond": 60})
 
+    def test_attach_takes_over_existing_session(self):
+        self.http_client.get_session.return_value = self.ready_sessions_json
+        self.http_client.get_statement.return_value = self.ready_statement_json
+
+        session = self._create_session(kind=constants.SESSION_KIND_PYSPARK)
+        session.attach(0)
+
+        assert_equals(0, self.http_client.post_session.call_count)
+        self.http_client.get_session.assert_any_call(0)
+        assert_equals("idle", session.status)
+        assert_equals(0, session.id)
+        assert_equals("spark", session.sql_context_variable_name)
+        self.heartbeat_scheduler.add.assert_called_once_with(session)
+
     def test_start_passes_in_all_properties(self):
         self.http_client.post_session.return_value = self.session_create_json
         self.http_client.get_session.return_value = self.ready_sessions_json
@@ -269,7 +283,7 @@ class TestLivySession(object):
                                       self.busy_sessions_json,
                                       self.ready_sessions_json]
         self.http_client.get_session.side_effect = self._next_session_response_get
-        self.http_client.get_statement.return_value = self.ready_statement_json
+        self.http_client.get_statement.return_value = self.probe_statement_json
 
         session = self._create_session()
         session.get_row_html = MagicMock()
@@ -289,7 +303,7 @@ class TestLivySession(object):
                                       self.ready_sessions_json,
                                       self.ready_sessions_json]
         self.http_client.get_session.side_effect = self._next_session_response_get
-        self.http_client.get_statement.return_value = self.ready_statement_json
+        self.http_client.get_statement.return_value = self.probe_statement_json
         self.http_client.get_all_session_logs.return_value = self.log_json
 
         session = self._create_session()
@@ -328,7 +342,7 @@ class TestLivySession(object):
                                       self.busy_sessions_json,
                                       self.ready_sessions_json]
         self.http_client.get_session.side_effect = self._next_session_response_get
-        self.http_client.get_statement.return_value = self.ready_statement_json
+        self.http_client.get_statement.return_value = self.probe_statement_json
 
         session = self._create_session()
         session.get_row_html = MagicMock()
@@ -345,9 +359,28 @@ class TestLivySession(object):
         session = self._create_session()
         session.start()
 
-        session.delete()
+        with patch('sparkmagic.livyclientlib.livysession.get_result_cache') as get_result_cache, \
+                patch('sparkmagic.livyclientlib.livysession.get_disk_result_cache') as get_disk_result_cache:
+            session.delete()
 
         assert_equals("dead", session.status)
+        get_result_cache.return_value.invalidate.assert_called_once_with(session.endpoint.url, 0)
+        # Results cached on disk outlive the session unless they are kept per session.
+        assert_equals(0, get_disk_result_cache.return_value.invalidate.call_count)
+
+    def test_delete_session_invalidates_disk_cache_per_session(self):
+        conf.override_all({"disk_result_cache_per_session": True})
+        self.http_client.post_session.return_value = self.session_create_json
+        self.http_client.get_session.return_value = self.ready_sessions_json
+        self.http_client.get_statement.return_value = self.ready_statement_json
+        session = self._create_session()
+        session.start()
+
+        with patch('sparkmagic.livyclientlib.livysession.get_disk_result_cache') as get_disk_result_cache:
+            session.delete()
+        conf.override_all({})
+
+        get_disk_result_cache.return_value.invalidate.assert_called_once_with(session.endpoint.url, 0)
 
     def test_delete_session_when_not_started(self):
         self.http_client.post_session.return_value = self.session_create_json
@@ -476,13 +509,13 @@ class TestLivySession(object):
             session.guid, session.kind, end_id, constants.DEAD_SESSION_STATUS, True, "", "")
 
     def test_get_empty_app_id(self):
-        self._verify_get_app_id("null", None, 6)
+        self._verify_get_app_id("null", None, 2)
 
     def test_get_missing_app_id(self):
-        self._verify_get_app_id(None, None, 6)
+        self._verify_get_app_id(None, None, 2)
 
     def test_get_normal_app_id(self):
-        self._verify_get_app_id("\"app_id_123\"", "app_id_123", 5)
+        self._verify_get_app_id("\"app_id_123\"", "app_id_123", 2)
 
     def test_get_empty_driver_log_url(self):
         self._verify_get_driver_log_url("null", None)
@@ -514,7 +547,7 @@ class TestLivySession(object):
         driver_log_url = session.get_driver_log_url()
 
         assert_equals(expected_url, driver_log_url)
-        assert_equals(6, self.http_client.get_session.call_count)
+        assert_equals(2, self.http_client.get_session.call_count)
 
     def test_get_empty_spark_ui_url(self):
         self._verify_get_spark_ui_url("null", None)
@@ -536,7 +569,35 @@ class TestLivySession(object):
         spark_ui_url = session.get_spark_ui_url()
 
         assert_equals(expected_url, spark_ui_url)
-        assert_equals(6, self.http_client.get_session.call_count)
+        assert_equals(2, self.http_client.get_session.call_count)
+
+    def test_session_json_serves_accessors(self):
+        session_json = json.loads('{"id":0,"state":"idle","kind":"spark","log":[""],"appId":"app_id_123",'
+                                  '"appInfo":{"driverLogUrl":"http://driver","sparkUiUrl":"http://ui"}}')
+        session = self._create_session(session_id=0)
+
+        session.update_status_and_info(session_json)
+        session.get_row_html(0)
+        str(session)
+
+        assert_equals("app_id_123", session.get_app_id())
+        assert_equals("http://driver", session.get_driver_log_url())
+        assert_equals("http://ui", session.get_spark_ui_url())
+        assert_equals(0, self.http_client.get_session.call_count)
+
+    def test_stale_session_json_is_fetched_again(self):
+        self.http_client.get_session.return_value = json.loads(
+            '{"id":0,"state":"idle","log":[""],"appInfo":{"sparkUiUrl":"http://new"}}')
+        session = self._create_session(session_id=0)
+        session.update_status_and_info(json.loads('{"id":0,"state":"idle","log":[""],"appInfo":{}}'))
+
+        conf.override_all({"session_info_max_age_seconds": 0})
+        try:
+            assert_equals("http://new", session.get_spark_ui_url())
+        finally:
+            conf.override_all({})
+
+        self.http_client.get_session.assert_called_once_with(0)
 
     def test_get_row_html(self):
         session_id1 = 1
@@ -587,6 +648,7 @@ class TestLivySession(object):
         self.http_client.post_session.return_value = self.session_create_json
         self.http_client.get_session.return_value = self.ready_sessions_json
         self.get_statement_responses = [self.ready_statement_failed_json,
+                                        self.ready_statement_failed_json,
                                         self.ready_statement_json]
         self.http_client.get_statement.side_effect = self._next_statement_response_get
         session = self._create_session()
@@ -600,3 +662,89 @@ class TestLivySession(object):
         self.http_client.get_statement.return_value = self.ready_statement_failed_json
         session = self._create_session()
         session.start()
+
+    def test_start_probes_session_with_one_statement(self):
+        probe_output = json.dumps({"spark": False, "sqlContext": True, "hive": True, "version": "1.6.3",
+                                   "appId": "application_1", "uiUrl": "http://driver:4040"})
+        self.http_client.post_session.return_value = self.session_create_json
+        self.http_client.get_session.return_value = self.ready_sessions_json
+        self.http_client.get_statement.return_value = {"id": 0, "state": "available", "output": {
+            "status": "ok", "execution_count": 0, "data": {"text/plain": probe_output}}}
+        session = self._create_session(kind=constants.SESSION_KIND_PYSPARK)
+
+        session.start()
+
+        self.http_client.post_statement.assert_called_once_with(0, {"code": constants.PYSPARK_SESSION_PROBE})
+        assert_equals(session.sql_context_variable_name, "sqlContext")
+        assert_equals(session.spark_info["version"], "1.6.3")
+        session.ipython_display.writeln.assert_any_call(u"HiveContext available as 'sqlContext'.")
+        get_session_calls = self.http_client.get_session.call_count
+        assert_equals(session.get_app_id(), "application_1")
+        assert_equals(get_session_calls, self.http_client.get_session.call_count)
+        assert_equals(session.get_spark_ui_url(), "http://driver:4040")
+
+    def test_pyspark_session_probe(self):
+        class Conf(object):
+            def get(self, key, default):
+                return {"spark.sql.catalogImplementation": "hive"}.get(key, default)
+        sc = MagicMock(version="2.4.0", applicationId="application_1", uiWebUrl="http://driver:4040")
+        spark = MagicMock(conf=Conf())
+        printed = []
+        scope = {"sc": sc, "spark": spark, "print": printed.append}
+
+        exec(constants.PYSPARK_SESSION_PROBE, scope)
+
+        assert_equals(json.loads(printed[0]), {"spark": True, "sqlContext": False, "hive": True,
+                                               "version": "2.4.0", "appId": "application_1",
+                                               "uiUrl": "http://driver:4040"})
+        assert constants.LONG_RANDOM_VARIABLE_NAME not in scope
+
+    def test_status_poller_is_used_for_refresh(self):
+        status_poller = MagicMock()
+        status_poller.get_session.return_value = self.busy_sessions_json
+        self.http_client.post_session.return_value = self.session_create_json
+        session = LivySession(self.http_client, {"kind": constants.SESSION_KIND_SPARK}, MagicMock(),
+                              spark_events=self.spark_events, status_poller=status_poller)
+        session.id = 0
+        session.status = constants.IDLE_SESSION_STATUS
+
+        session.refresh_status_and_info()
+
+        status_poller.get_session.assert_called_once_with(0)
+        assert_equals(0, self.http_client.get_session.call_count)
+        assert_equals(constants.BUSY_SESSION_STATUS, session.status)
+
+    def test_detach_after_failed_attach(self):
+        status_poller = MagicMock()
+        status_poller.get_session.return_value = self.error_sessions_json
+        self.http_client.get_session.return_value = self.error_sessions_json
+        self.http_client.get_all_session_logs.return_value = self.log_json
+        session = LivySession(self.http_client, {"kind": constants.SESSION_KIND_SPARK}, MagicMock(),
+                              spark_events=self.spark_events, heartbeat_timeout=60,
+                              heartbeat_scheduler=self.heartbeat_scheduler, status_poller=status_poller)
+
+        try:
+            session.attach(0)
+            assert False
+        except LivyUnexpectedStatusException:
+            pass
+        session.detach()
+
+        status_poller.unregister.assert_called_once_with(session)
+        self.heartbeat_scheduler.remove.assert_called_once_with(session)
+        assert not session._heartbeating
+        assert_equals(0, self.http_client.delete_session.call_count)
+
+    def test_start_and_delete_register_with_status_poller(self):
+        status_poller = MagicMock()
+        status_poller.get_session.return_value = self.ready_sessions_json
+        self.http_client.post_session.return_value = self.session_create_json
+        self.http_client.get_statement.return_value = self.ready_statement_json
+        session = LivySession(self.http_client, {"kind": constants.SESSION_KIND_SPARK}, MagicMock(),
+                              spark_events=self.spark_events, status_poller=status_poller)
+
+        session.start()
+        status_poller.register.assert_called_once_with(session)
+
+        session.delete()
+        status_poller.unregister.assert_called_once_with(session)
@@ -1,7 +1,12 @@
+from mock import patch
+from nose.tools import assert_equals
 from pandas.util.testing import assert_frame_equal
+import numpy as np
 import pandas as pd
 
-from sparkmagic.utils.utils import coerce_pandas_df_to_numeric_datetime
+import sparkmagic.utils.utils as utils
+from sparkmagic.utils.utils import coerce_pandas_df_to_numeric_datetime, coerced_pandas_df_to_numeric_datetime, \
+    compact_dataframe
 
 
 def test_no_coercing():
@@ -140,3 +145,76 @@ def test_all_null_columns():
     df = pd.DataFrame(records)
     coerce_pandas_df_to_numeric_datetime(df)
     assert_frame_equal(desired_df, df)
+
+
+def test_wide_frame_coercing():
+    records = [dict([(u'date{}'.format(i), u'6/{}/13'.format(r % 28 + 1)) for i in range(10)] +
+                    [(u'num{}'.format(i), u'{}'.format(r)) for i in range(10)] +
+                    [(u'text{}'.format(i), u'text {}'.format(r)) for i in range(10)]) for r in range(200)]
+    desired_df = pd.DataFrame(records)
+    for i in range(10):
+        desired_df[u'date{}'.format(i)] = pd.to_datetime(desired_df[u'date{}'.format(i)])
+        desired_df[u'num{}'.format(i)] = pd.to_numeric(desired_df[u'num{}'.format(i)])
+
+    df = pd.DataFrame(records)
+    with patch('sparkmagic.utils.utils.cpu_count', return_value=4):
+        coerce_pandas_df_to_numeric_datetime(df)
+    assert_frame_equal(desired_df, df)
+
+    df = coerced_pandas_df_to_numeric_datetime(pd.DataFrame(records))
+    assert_frame_equal(desired_df, df)
+
+
+def test_failing_sample_skips_full_conversion():
+    records = [{u'text': u'word {}'.format(i)} for i in range(1000)]
+    df = pd.DataFrame(records)
+
+    with patch('sparkmagic.utils.utils._to_datetime', side_effect=utils._to_datetime) as to_datetime:
+        coerce_pandas_df_to_numeric_datetime(df)
+
+    assert_equals(1, to_datetime.call_count)
+    assert len(to_datetime.call_args[0][0]) <= 2 * utils._COERCE_SAMPLE_SIZE
+    assert_frame_equal(pd.DataFrame(records), df)
+
+
+def test_late_failure_is_not_coerced():
+    records = [{u'num': u'{}'.format(i)} for i in range(999)] + [{u'num': u'nope'}]
+    df = pd.DataFrame(records)
+    coerce_pandas_df_to_numeric_datetime(df)
+    assert_frame_equal(pd.DataFrame(records), df)
+
+
+def test_compact_low_cardinality_strings():
+    df = pd.DataFrame({u'status': [u'ok', u'failed', None, u'ok'] * 25,
+                       u'id': [u'id {}'.format(i) for i in range(100)],
+                       u'nested': [[i] for i in range(100)]})
+
+    compacted = compact_dataframe(df, 0.5)
+
+    assert_equals(u'category', compacted[u'status'].dtype.name)
+    assert_equals([u'failed', u'ok'], sorted(compacted[u'status'].cat.categories))
+    assert compacted[u'status'].isnull().sum() == 25
+    assert_equals(np.dtype('object'), compacted[u'id'].dtype)
+    assert_equals(np.dtype('object'), compacted[u'nested'].dtype)
+    assert_frame_equal(df, compacted.astype({u'status': object}))
+
+
+def test_compact_downcasts_numbers():
+    df = pd.DataFrame({u'small': [1, 2, 3], u'large': [1, 2, 2 ** 40], u'unsigned': np.array([1, 2, 300], np.uint64),
+                       u'half': [0.5, None, 1.25], u'precise': [0.1, 0.2, 0.3], u'flag': [True, False, True]})
+
+    compacted = compact_dataframe(df, 0.5)
+
+    assert_equals(np.dtype('int8'), compacted[u'small'].dtype)
+    assert_equals(np.dtype('int64'), compacted[u'large'].dtype)
+    assert_equals(np.dtype('uint16'), compacted[u'unsigned'].dtype)
+    assert_equals(np.dtype('float32'), compacted[u'half'].dtype)
+    assert_equals(np.dtype('float64'), compacted[u'precise'].dtype)
+    assert_equals(np.dtype('bool'), compacted[u'flag'].dtype)
+    assert_equals(list(df.columns), list(compacted.columns))
+    assert_frame_equal(df, compacted, check_dtype=False)
+
+
+def test_compact_unchanged_frame_is_returned_as_is():
+    df = pd.DataFrame({u'id': [u'a', u'b']})
+    assert compact_dataframe(df, 0.5) is df
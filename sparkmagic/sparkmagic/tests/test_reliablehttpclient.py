@@ -11,6 +11,8 @@ from sparkmagic.livyclientlib.exceptions import HttpClientException
 from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
 from sparkmagic.livyclientlib.linearretrypolicy import LinearRetryPolicy
 from sparkmagic.livyclientlib.reliablehttpclient import ReliableHttpClient
+from sparkmagic.livyclientlib.cachedtokenkerberosauth import CachedTokenKerberosAuth
+import sparkmagic.utils.configuration as conf
 import sparkmagic.utils.constants as constants
 
 retry_policy = None
@@ -56,7 +58,7 @@ def test_compose_url():
 
 @with_setup(_setup, _teardown)
 def test_get():
-    with patch('requests.get') as patched_get:
+    with patch('requests.Session.get') as patched_get:
         type(patched_get.return_value).status_code = 200
 
         client = ReliableHttpClient(endpoint, {}, retry_policy)
@@ -69,7 +71,7 @@ def test_get():
 @raises(HttpClientException)
 @with_setup(_setup, _teardown)
 def test_get_throws():
-    with patch('requests.get') as patched_get:
+    with patch('requests.Session.get') as patched_get:
         type(patched_get.return_value).status_code = 500
 
         client = ReliableHttpClient(endpoint, {}, retry_policy)
@@ -84,7 +86,7 @@ def test_get_will_retry():
     retry_policy.should_retry.return_value = True
     retry_policy.seconds_to_sleep.return_value = 0.01
 
-    with patch('requests.get') as patched_get:
+    with patch('requests.Session.get') as patched_get:
         # When we call assert_equals in this unit test, the side_effect is executed.
         # So, the last status_code should be repeated.
         sequential_values = [500, 200, 200]
@@ -102,7 +104,7 @@ def test_get_will_retry():
 
 @with_setup(_setup, _teardown)
 def test_post():
-    with patch('requests.post') as patched_post:
+    with patch('requests.Session.post') as patched_post:
         type(patched_post.return_value).status_code = 200
 
         client = ReliableHttpClient(endpoint, {}, retry_policy)
@@ -115,7 +117,7 @@ def test_post():
 @raises(HttpClientException)
 @with_setup(_setup, _teardown)
 def test_post_throws():
-    with patch('requests.post') as patched_post:
+    with patch('requests.Session.post') as patched_post:
         type(patched_post.return_value).status_code = 500
 
         client = ReliableHttpClient(endpoint, {}, retry_policy)
@@ -130,7 +132,7 @@ def test_post_will_retry():
     retry_policy.should_retry.return_value = True
     retry_policy.seconds_to_sleep.return_value = 0.01
 
-    with patch('requests.post') as patched_post:
+    with patch('requests.Session.post') as patched_post:
         # When we call assert_equals in this unit test, the side_effect is executed.
         # So, the last status_code should be repeated.
         sequential_values = [500, 200, 200]
@@ -148,7 +150,7 @@ def test_post_will_retry():
 
 @with_setup(_setup, _teardown)
 def test_delete():
-    with patch('requests.delete') as patched_delete:
+    with patch('requests.Session.delete') as patched_delete:
         type(patched_delete.return_value).status_code = 200
 
         client = ReliableHttpClient(endpoint, {}, retry_policy)
@@ -161,7 +163,7 @@ def test_delete():
 @raises(HttpClientException)
 @with_setup(_setup, _teardown)
 def test_delete_throws():
-    with patch('requests.delete') as patched_delete:
+    with patch('requests.Session.delete') as patched_delete:
         type(patched_delete.return_value).status_code = 500
 
         client = ReliableHttpClient(endpoint, {}, retry_policy)
@@ -176,7 +178,7 @@ def test_delete_will_retry():
     retry_policy.should_retry.return_value = True
     retry_policy.seconds_to_sleep.return_value = 0.01
 
-    with patch('requests.delete') as patched_delete:
+    with patch('requests.Session.delete') as patched_delete:
         # When we call assert_equals in this unit test, the side_effect is executed.
         # So, the last status_code should be repeated.
         sequential_values = [500, 200, 200]
@@ -199,7 +201,7 @@ def test_will_retry_error_no():
     retry_policy.should_retry.return_value = False
     retry_policy.seconds_to_sleep.return_value = 0.01
 
-    with patch('requests.get') as patched_get:
+    with patch('requests.Session.get') as patched_get:
         patched_get.side_effect = requests.exceptions.ConnectionError()
         client = ReliableHttpClient(endpoint, {}, retry_policy)
 
@@ -232,3 +234,49 @@ def test_kerberos_auth_check_auth():
     client = ReliableHttpClient(endpoint, {}, retry_policy)
     assert_is_not_none(client._auth)
     assert isinstance(client._auth, HTTPKerberosAuth)
+
+
+@with_setup(_setup, _teardown)
+def test_requests_reuse_pooled_session():
+    with patch('requests.Session.get') as patched_get:
+        type(patched_get.return_value).status_code = 200
+
+        client = ReliableHttpClient(endpoint, {}, retry_policy)
+        session = client._session
+
+        client.get("r", [200])
+        client.get("r", [200])
+
+        assert_equals(2, patched_get.call_count)
+        assert session is client._session
+
+
+@with_setup(_setup, _teardown)
+def test_pool_size_is_configurable():
+    conf.override_all({"http_pool_maxsize": 3})
+    client = ReliableHttpClient(endpoint, {}, retry_policy)
+    conf.override_all({})
+
+    adapter = client._session.get_adapter("http://url.com")
+    assert_equals(3, adapter._pool_maxsize)
+
+
+@with_setup(_setup, _teardown)
+def test_close():
+    client = ReliableHttpClient(endpoint, {}, retry_policy)
+    client._session = MagicMock()
+
+    client.close()
+
+    client._session.close.assert_called_once_with()
+
+
+@with_setup(_setup, _teardown)
+def test_kerberos_auth_with_token_cache():
+    conf.override_all({"kerberos_token_cache_seconds": 300})
+    endpoint = Endpoint("http://url.com", constants.AUTH_KERBEROS, "username", "password")
+    client = ReliableHttpClient(endpoint, {}, retry_policy)
+    conf.override_all({})
+
+    assert isinstance(client._auth, CachedTokenKerberosAuth)
+    assert isinstance(client._auth._kerberos_auth, HTTPKerberosAuth)
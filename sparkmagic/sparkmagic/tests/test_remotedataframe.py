@@ -0,0 +1,108 @@
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_raises, with_setup
+
+from sparkmagic.utils.constants import SCHEMA_PREFIX, SESSION_KIND_PYSPARK, SESSION_KIND_SPARK, SESSION_KIND_SPARKR
+from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.exceptions import BadUserDataException
+from sparkmagic.livyclientlib.remotedataframe import RemoteDataFrame
+from sparkmagic.livyclientlib.sparkstorecommand import SparkStoreCommand
+
+
+def _setup():
+    global spark_controller
+    spark_controller = MagicMock()
+    spark_controller.get_session_by_name_or_default.return_value.kind = SESSION_KIND_PYSPARK
+
+
+def _teardown():
+    pass
+
+
+def _remote(dataframe=u'df'):
+    return RemoteDataFrame(spark_controller, u'session', dataframe, u'take', 100, 0.1, True)
+
+
+@with_setup(_setup, _teardown)
+def test_len():
+    spark_controller.run_command.return_value = (True, u'42\n')
+    assert_equals(42, len(_remote()))
+    spark_controller.run_command.assert_called_once_with(Command(u'print(df.count())'), u'session')
+
+    spark_controller.get_session_by_name_or_default.return_value.kind = SESSION_KIND_SPARK
+    len(_remote())
+    spark_controller.run_command.assert_called_with(Command(u'println(df.count())'), u'session')
+
+    spark_controller.get_session_by_name_or_default.return_value.kind = SESSION_KIND_SPARKR
+    len(_remote())
+    spark_controller.run_command.assert_called_with(Command(u'cat(count(df))'), u'session')
+
+
+@with_setup(_setup, _teardown)
+def test_columns_are_fetched_once():
+    spark_controller.run_command.return_value = (True, SCHEMA_PREFIX + u'{"type":"struct","fields":['
+                                                 u'{"name":"a","type":"long","nullable":true,"metadata":{}},'
+                                                 u'{"name":"b","type":"string","nullable":true,"metadata":{}}]}\n')
+    remote = _remote()
+
+    assert_equals([u'a', u'b'], remote.columns)
+    assert_equals([u'a', u'b'], remote.columns)
+    assert_equals(1, spark_controller.run_command.call_count)
+    assert_equals(u'print(u"{}" + df.schema.json())'.format(SCHEMA_PREFIX),
+                  spark_controller.run_command.call_args[0][0].code)
+
+    spark_controller.run_command.return_value = (True, u'7')
+    assert_equals((7, 2), remote.shape)
+
+
+@with_setup(_setup, _teardown)
+def test_refresh_fetches_columns_again():
+    spark_controller.run_command.return_value = (True, SCHEMA_PREFIX + u'[["a","int"]]\n')
+    remote = _remote()
+    assert_equals([u'a'], remote.columns)
+
+    spark_controller.run_command.return_value = (True, SCHEMA_PREFIX + u'[["a","int"],["b","string"]]\n')
+    assert_equals([u'a'], remote.columns)
+    remote.refresh()
+    assert_equals([u'a', u'b'], remote.columns)
+    assert_equals(2, spark_controller.run_command.call_count)
+
+
+@with_setup(_setup, _teardown)
+def test_failed_statement_raises():
+    spark_controller.run_command.return_value = (False, u'NameError')
+    assert_raises(BadUserDataException, len, _remote())
+
+
+@with_setup(_setup, _teardown)
+def test_select():
+    remote = _remote()[[u'a', u'b']]
+    assert_equals(u'df.select("a", "b")', remote.dataframe)
+    assert_equals(u'df.select("a")', _remote()[u'a'].dataframe)
+    assert_equals(100, remote.maxrows)
+
+    spark_controller.get_session_by_name_or_default.return_value.kind = SESSION_KIND_SPARKR
+    assert_equals(u'select(df, "a")', _remote()[u'a'].dataframe)
+
+
+@with_setup(_setup, _teardown)
+def test_head_describe_and_to_pandas_store_the_rows():
+    remote = _remote()
+
+    remote.head(3)
+    spark_controller.run_command.assert_called_with(SparkStoreCommand(u'df', u'take', 3, coerce=True), u'session')
+
+    remote.describe()
+    spark_controller.run_command.assert_called_with(SparkStoreCommand(u'df.describe()', u'take', -1, coerce=True),
+                                                    u'session')
+
+    result = remote.to_pandas()
+    spark_controller.run_command.assert_called_with(SparkStoreCommand(u'df', u'take', 100, 0.1, coerce=True),
+                                                    u'session')
+    assert_equals(spark_controller.run_command.return_value, result)
+
+
+@with_setup(_setup, _teardown)
+def test_display_pulls_the_rows():
+    with patch('sparkmagic.livyclientlib.remotedataframe.display') as display:
+        _remote()._ipython_display_()
+    display.assert_called_once_with(spark_controller.run_command.return_value)
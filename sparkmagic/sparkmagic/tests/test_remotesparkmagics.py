@@ -284,7 +284,8 @@ def test_run_spark_command_parses():
     result = magic.spark(line, cell)
 
     magic.execute_spark.assert_called_once_with("cell code",
-                                                None, "sample", None, None, "sessions_name", None)
+                                                None, "sample", None, None, "sessions_name", None, False, False,
+                                                None)
 
 
 @with_setup(_setup, _teardown)
@@ -305,7 +306,8 @@ def test_run_spark_command_parses_with_coerce():
     result = magic.spark(line, cell)
 
     magic.execute_spark.assert_called_once_with("cell code",
-                                                None, "sample", None, None, "sessions_name", True)
+                                                None, "sample", None, None, "sessions_name", True, False, False,
+                                                None)
 
 
 @with_setup(_setup, _teardown)
@@ -326,7 +328,8 @@ def test_run_spark_command_parses_with_coerce_false():
     result = magic.spark(line, cell)
 
     magic.execute_spark.assert_called_once_with("cell code",
-                                                None, "sample", None, None, "sessions_name", False)
+                                                None, "sample", None, None, "sessions_name", False, False, False,
+                                                None)
 
 
 @with_setup(_setup, _teardown)
@@ -347,7 +350,8 @@ def test_run_sql_command_parses_with_coerce_false():
     result = magic.spark(line, cell)
 
     magic.execute_sqlquery.assert_called_once_with("cell code",
-                                                "sample", None, None, "sessions_name", None, False, False)
+                                                "sample", None, None, "sessions_name", None, False, False, False,
+                                                None)
 
 
 @with_setup(_setup, _teardown)
@@ -367,7 +371,8 @@ def test_run_spark_with_store_command_parses():
 
     result = magic.spark(line, cell)
     magic.execute_spark.assert_called_once_with("cell code",
-                                                "var_name", "sample", None, None, "sessions_name", None)
+                                                "var_name", "sample", None, None, "sessions_name", None, False, False,
+                                                None)
     
 
 @with_setup(_setup, _teardown)
@@ -392,7 +397,7 @@ def test_run_spark_with_store_correct_calls():
     result = magic.spark(line, cell)
 
     run_cell_method.assert_any_call(Command(cell), name)
-    run_cell_method.assert_any_call(SparkStoreCommand(output_var, samplemethod=method_name, coerce=True), name)
+    run_cell_method.assert_any_call(SparkStoreCommand(output_var, samplemethod=method_name, coerce=True, source=cell), name)
 
 
 @with_setup(_setup, _teardown)
@@ -439,7 +444,7 @@ def test_run_spark_command_exception_while_storing():
     result = magic.spark(line, cell)
 
     run_cell_method.assert_any_call(Command(cell), name)
-    run_cell_method.assert_any_call(SparkStoreCommand(output_var, samplemethod=method_name), name)
+    run_cell_method.assert_any_call(SparkStoreCommand(output_var, samplemethod=method_name, source=cell), name)
     ipython_display.write.assert_called_once_with("")
     ipython_display.send_error.assert_called_once_with(EXPECTED_ERROR_MSG
                                                        .format(exception))
@@ -0,0 +1,86 @@
+from nose.tools import assert_equals, assert_is_none
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from sparkmagic.livyclientlib.resultcache import ResultCache
+
+
+def _df(rows):
+    return pd.DataFrame({u'a': list(range(rows))})
+
+
+def _size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def test_get_returns_copy():
+    cache = ResultCache(10 ** 6)
+    df = _df(10)
+    cache.put((u'url', 1, u'q'), df)
+
+    cached = cache.get((u'url', 1, u'q'))
+    assert_frame_equal(df, cached)
+    cached[u'a'] = 0
+    assert_frame_equal(df, cache.get((u'url', 1, u'q')))
+    df[u'a'] = 1
+    assert_frame_equal(_df(10), cache.get((u'url', 1, u'q')))
+
+
+def test_miss():
+    cache = ResultCache(10 ** 6)
+    assert_is_none(cache.get((u'url', 1, u'q')))
+
+
+def test_evicts_least_recently_used():
+    size = _size(_df(100))
+    cache = ResultCache(2 * size)
+    cache.put((u'url', 1, u'a'), _df(100))
+    cache.put((u'url', 1, u'b'), _df(100))
+    cache.get((u'url', 1, u'a'))
+    cache.put((u'url', 1, u'c'), _df(100))
+
+    assert_equals(2, len(cache))
+    assert_equals(2 * size, cache.size())
+    assert_is_none(cache.get((u'url', 1, u'b')))
+    assert cache.get((u'url', 1, u'a')) is not None
+    assert cache.get((u'url', 1, u'c')) is not None
+
+
+def test_replacing_entry_updates_size():
+    cache = ResultCache(10 ** 6)
+    cache.put((u'url', 1, u'a'), _df(100))
+    cache.put((u'url', 1, u'a'), _df(10))
+    assert_equals(1, len(cache))
+    assert_equals(_size(_df(10)), cache.size())
+
+
+def test_result_larger_than_cache_is_not_stored():
+    cache = ResultCache(_size(_df(10)))
+    cache.put((u'url', 1, u'a'), _df(10))
+    cache.put((u'url', 1, u'b'), _df(1000))
+    assert_equals(1, len(cache))
+    assert_is_none(cache.get((u'url', 1, u'b')))
+
+
+def test_invalidate():
+    cache = ResultCache(10 ** 6)
+    cache.put((u'url', 1, u'a'), _df(10))
+    cache.put((u'url', 2, u'a'), _df(10))
+    cache.put((u'other', 1, u'a'), _df(10))
+
+    cache.invalidate(u'url', 1)
+    assert_equals(2, len(cache))
+    assert_is_none(cache.get((u'url', 1, u'a')))
+
+    cache.invalidate(u'url')
+    assert_equals(1, len(cache))
+    assert_equals(_size(_df(10)), cache.size())
+
+    cache.clear()
+    assert_equals(0, len(cache))
+    assert_equals(0, cache.size())
+
+
+def test_disabled():
+    assert not ResultCache(0).enabled()
+    assert ResultCache(1).enabled()
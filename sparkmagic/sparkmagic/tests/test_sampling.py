@@ -0,0 +1,88 @@
+from nose.tools import assert_equals, assert_raises
+
+import sparkmagic.utils.constants as constants
+from sparkmagic.utils.constants import LONG_RANDOM_VARIABLE_NAME
+from sparkmagic.livyclientlib.sampling import sampling_code, validate_sampling, with_sampling_setup
+from sparkmagic.livyclientlib.exceptions import BadUserDataException
+
+
+def test_validate_sampling():
+    for method in constants.SAMPLE_METHODS:
+        validate_sampling(method, u"country")
+    validate_sampling(u"take", None)
+    assert_raises(BadUserDataException, validate_sampling, u"top", None)
+    assert_raises(BadUserDataException, validate_sampling, u"stratified", None)
+
+
+def test_take_and_sample_are_unchanged():
+    for kind in (constants.SESSION_KIND_PYSPARK, constants.SESSION_KIND_SPARK, constants.SESSION_KIND_SPARKR):
+        for method in (u"take", u"sample"):
+            assert_equals(sampling_code(kind, u"df", method, 10, 0.1), (u"", u"df"))
+
+
+def test_reservoir_and_partition_without_maxrows_are_unchanged():
+    for method in (u"reservoir", u"partition"):
+        assert_equals(sampling_code(constants.SESSION_KIND_PYSPARK, u"df", method, -1, 0.1), (u"", u"df"))
+
+
+def test_stratified_pyspark():
+    (setup, dataframe) = sampling_code(constants.SESSION_KIND_PYSPARK, u"df", u"stratified", 100, 0.1, u"country")
+    assert setup.startswith(u"{}_df = df\n".format(LONG_RANDOM_VARIABLE_NAME))
+    assert u'groupBy("country").count()' in setup
+    assert u"100 //" in setup
+    assert_equals(dataframe, u'{0}_df.sampleBy("country", {0}_fractions)'.format(LONG_RANDOM_VARIABLE_NAME))
+    compile(setup, u"<setup>", u"exec")
+    compile(dataframe, u"<dataframe>", u"eval")
+
+    (setup, _) = sampling_code(constants.SESSION_KIND_PYSPARK3, u"df", u"stratified", -1, 0.1, u"country")
+    assert u'select("country").distinct()' in setup
+    assert u"(r[0], 0.1)" in setup
+    compile(setup, u"<setup>", u"exec")
+
+
+def test_stratified_scala_and_r():
+    (setup, dataframe) = sampling_code(constants.SESSION_KIND_SPARK, u"df", u"stratified", 100, 0.1, u"country")
+    assert setup.startswith(u"val {}_df = df\n".format(LONG_RANDOM_VARIABLE_NAME))
+    assert_equals(dataframe, u'{0}_df.stat.sampleBy("country", {0}_fractions, scala.util.Random.nextLong)'
+                  .format(LONG_RANDOM_VARIABLE_NAME))
+
+    (setup, dataframe) = sampling_code(constants.SESSION_KIND_SPARKR, u"df", u"stratified", 100, 0.1, u"country")
+    assert setup.startswith(u"{}_df <- df\n".format(LONG_RANDOM_VARIABLE_NAME))
+    assert u'groupBy({}_df, "country")'.format(LONG_RANDOM_VARIABLE_NAME) in setup
+    assert dataframe.startswith(u'sampleBy({0}_df, "country", {0}_fractions, '.format(LONG_RANDOM_VARIABLE_NAME))
+
+
+def test_reservoir():
+    (setup, dataframe) = sampling_code(constants.SESSION_KIND_PYSPARK, u"df", u"reservoir", 50, 0.1)
+    assert_equals(dataframe, u"{0}_df.orderBy({0}_rand()).limit(50)".format(LONG_RANDOM_VARIABLE_NAME))
+    compile(setup, u"<setup>", u"exec")
+
+    (setup, dataframe) = sampling_code(constants.SESSION_KIND_SPARK, u"df", u"reservoir", 50, 0.1)
+    assert_equals(setup, u"val {}_df = df".format(LONG_RANDOM_VARIABLE_NAME))
+    assert_equals(dataframe, u"{}_df.orderBy(org.apache.spark.sql.functions.rand()).limit(50)"
+                  .format(LONG_RANDOM_VARIABLE_NAME))
+
+    (_, dataframe) = sampling_code(constants.SESSION_KIND_SPARKR, u"df", u"reservoir", 50, 0.1)
+    assert_equals(dataframe, u"limit(orderBy({}_df, rand()), 50)".format(LONG_RANDOM_VARIABLE_NAME))
+
+
+def test_partition():
+    (setup, dataframe) = sampling_code(constants.SESSION_KIND_PYSPARK, u"df", u"partition", 50, 0.1)
+    assert u"-(-50 // max(1, {}_df.rdd.getNumPartitions()))".format(LONG_RANDOM_VARIABLE_NAME) in setup
+    assert u"mapPartitions(" in dataframe
+    compile(setup, u"<setup>", u"exec")
+    compile(dataframe, u"<dataframe>", u"eval")
+
+    (_, dataframe) = sampling_code(constants.SESSION_KIND_SPARK, u"df", u"partition", 50, 0.1)
+    assert u"mapPartitions(_.take({}_per_partition))".format(LONG_RANDOM_VARIABLE_NAME) in dataframe
+
+    (_, dataframe) = sampling_code(constants.SESSION_KIND_SPARKR, u"df", u"partition", 50, 0.1)
+    assert dataframe.startswith(u"dapply(")
+
+
+def test_with_sampling_setup():
+    assert_equals(with_sampling_setup(constants.SESSION_KIND_SPARK, u"", u"df.show()"), u"df.show()")
+    assert_equals(with_sampling_setup(constants.SESSION_KIND_PYSPARK, u"x = 1", u"print(x)"), u"x = 1\nprint(x)")
+    # The Scala REPL would echo top-level vals into the output, so they go in a block with the statement.
+    assert_equals(with_sampling_setup(constants.SESSION_KIND_SPARK, u"val x = 1", u"println(x)"),
+                  u"{ val x = 1\nprintln(x) }")
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is_none, with_setup
+
+from sparkmagic.livyclientlib.endpoint import Endpoint
+from sparkmagic.livyclientlib.sessionpool import SessionPool
+from sparkmagic.utils.constants import NO_AUTH
+
+
+path = None
+endpoint = Endpoint(u"http://livy:8998", NO_AUTH)
+properties = {u"kind": u"pyspark", u"executorCores": 2}
+
+
+def _setup():
+    global path
+    path = tempfile.mkdtemp()
+
+
+def _teardown():
+    shutil.rmtree(path)
+
+
+def _pool(http_client, size=2):
+    pool = SessionPool(path, size)
+    pool._http_client = MagicMock(return_value=http_client)
+    return pool
+
+
+def _http_client(sessions):
+    http_client = MagicMock()
+    http_client.get_sessions.return_value = {u"sessions": sessions}
+    http_client.post_session.side_effect = [{u"id": session_id} for session_id in range(10, 20)]
+    return http_client
+
+
+def test_key_depends_on_endpoint_and_properties():
+    assert_equals(SessionPool.key(endpoint, properties), SessionPool.key(endpoint, dict(properties)))
+    assert SessionPool.key(endpoint, properties) != SessionPool.key(endpoint, {u"kind": u"pyspark"})
+    assert SessionPool.key(endpoint, properties) != SessionPool.key(Endpoint(u"http://other", NO_AUTH), properties)
+
+
+@with_setup(_setup, _teardown)
+def test_claim_from_empty_pool():
+    assert_is_none(SessionPool(path, 2).claim(endpoint, properties))
+    assert_is_none(SessionPool(os.path.join(path, u"missing"), 2).claim(endpoint, properties))
+
+
+@with_setup(_setup, _teardown)
+def test_replenish_and_claim():
+    http_client = _http_client([])
+    pool = _pool(http_client)
+
+    pool.replenish([(endpoint, properties)])
+
+    assert_equals(http_client.post_session.call_count, 2)
+    assert_equals(pool.claim(endpoint, properties), 10)
+    assert_equals(pool.claim(endpoint, properties), 11)
+    assert_is_none(pool.claim(endpoint, properties))
+    assert_is_none(pool.claim(endpoint, {u"kind": u"spark"}))
+    assert_equals(os.listdir(path), [])
+
+
+@with_setup(_setup, _teardown)
+def test_replenish_drops_dead_sessions():
+    http_client = _http_client([])
+    pool = _pool(http_client)
+    pool.replenish([(endpoint, properties)])
+
+    http_client.get_sessions.return_value = {u"sessions": [{u"id": 10, u"state": u"idle"},
+                                                           {u"id": 11, u"state": u"dead"}]}
+    pool.replenish([(endpoint, properties)])
+
+    assert_equals(http_client.post_session.call_count, 3)
+    assert_equals(pool.claim(endpoint, properties), 10)
+    assert_equals(pool.claim(endpoint, properties), 12)
+
+
+@with_setup(_setup, _teardown)
+def test_replenish_adds_heartbeat_timeout():
+    http_client = _http_client([])
+    pool = _pool(http_client, 1)
+
+    with patch(u"sparkmagic.utils.configuration.livy_server_heartbeat_timeout_seconds", return_value=60):
+        pool.replenish([(endpoint, properties)])
+        http_client.get_sessions.return_value = {u"sessions": [{u"id": 10, u"state": u"starting"}]}
+        pool.replenish([(endpoint, properties)])
+
+    http_client.post_session.assert_called_once_with(dict(properties, heartbeatTimeoutInSecond=60))
+    http_client.get_session.assert_called_once_with(10)
+    assert_equals(properties, {u"kind": u"pyspark", u"executorCores": 2})
+
+
+@with_setup(_setup, _teardown)
+def test_replenish_logs_failures():
+    http_client = _http_client([])
+    http_client.get_sessions.side_effect = ValueError(u"unreachable")
+    pool = _pool(http_client)
+
+    pool.replenish([(endpoint, properties)])
+
+    assert_equals(http_client.post_session.call_count, 0)
+
+
+@with_setup(_setup, _teardown)
+def test_claimed_session_is_not_claimed_again():
+    pool = _pool(_http_client([]), 1)
+    pool.replenish([(endpoint, properties)])
+
+    with patch(u"os.rename", side_effect=OSError(u"gone")):
+        assert_is_none(pool.claim(endpoint, properties))
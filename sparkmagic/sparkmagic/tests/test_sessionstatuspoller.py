@@ -0,0 +1,99 @@
+from mock import MagicMock, patch
+from nose.tools import assert_equals
+
+from sparkmagic.livyclientlib.sessionstatuspoller import SessionStatusPoller
+
+
+def _session(session_id):
+    session = MagicMock()
+    session.id = session_id
+    return session
+
+
+def _sessions_json(*states):
+    return {u"from": 0, u"total": len(states),
+            u"sessions": [{u"id": i, u"state": state, u"log": []} for (i, state) in enumerate(states)]}
+
+
+def test_single_session_is_polled_directly():
+    http_client = MagicMock()
+    poller = SessionStatusPoller(http_client, 1)
+    poller.register(_session(0))
+
+    response = poller.get_session(0)
+
+    assert_equals(http_client.get_session.return_value, response)
+    http_client.get_session.assert_called_once_with(0)
+    assert_equals(0, http_client.get_sessions.call_count)
+
+
+def test_many_sessions_share_one_request():
+    http_client = MagicMock()
+    http_client.get_sessions.return_value = _sessions_json(u"idle", u"busy", u"idle")
+    poller = SessionStatusPoller(http_client, 60)
+    sessions = [_session(i) for i in range(3)]
+    for session in sessions:
+        poller.register(session)
+
+    responses = [poller.get_session(session.id) for session in sessions]
+
+    assert_equals([u"idle", u"busy", u"idle"], [r[u"state"] for r in responses])
+    assert_equals(1, http_client.get_sessions.call_count)
+    assert_equals(0, http_client.get_session.call_count)
+
+
+def test_fetch_is_fanned_out_to_registered_sessions():
+    http_client = MagicMock()
+    sessions_json = _sessions_json(u"idle", u"busy")
+    http_client.get_sessions.return_value = sessions_json
+    poller = SessionStatusPoller(http_client, 60)
+    sessions = [_session(0), _session(1)]
+    for session in sessions:
+        poller.register(session)
+
+    poller.get_session(0)
+
+    sessions[0].update_status_and_info.assert_called_once_with(sessions_json[u"sessions"][0])
+    sessions[1].update_status_and_info.assert_called_once_with(sessions_json[u"sessions"][1])
+
+
+def test_stale_listing_is_fetched_again():
+    http_client = MagicMock()
+    http_client.get_sessions.return_value = _sessions_json(u"idle", u"idle")
+    poller = SessionStatusPoller(http_client, 1)
+    poller.register(_session(0))
+    poller.register(_session(1))
+
+    with patch('sparkmagic.livyclientlib.sessionstatuspoller.time', return_value=100):
+        poller.get_session(0)
+        poller.get_session(1)
+    with patch('sparkmagic.livyclientlib.sessionstatuspoller.time', return_value=101.5):
+        poller.get_session(0)
+
+    assert_equals(2, http_client.get_sessions.call_count)
+
+
+def test_session_missing_from_listing_is_polled_directly():
+    http_client = MagicMock()
+    http_client.get_sessions.return_value = _sessions_json(u"idle", u"idle")
+    poller = SessionStatusPoller(http_client, 60)
+    for i in range(3):
+        poller.register(_session(i))
+
+    response = poller.get_session(2)
+
+    assert_equals(http_client.get_session.return_value, response)
+    http_client.get_session.assert_called_once_with(2)
+
+
+def test_unregister():
+    http_client = MagicMock()
+    poller = SessionStatusPoller(http_client, 60)
+    session = _session(0)
+    poller.register(session)
+    poller.register(_session(1))
+
+    poller.unregister(session)
+    poller.get_session(1)
+
+    assert_equals(0, http_client.get_sessions.call_count)
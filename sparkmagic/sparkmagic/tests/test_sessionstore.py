@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from nose.tools import assert_equals, assert_is_none, with_setup
+
+from sparkmagic.livyclientlib.sessionstore import SessionStore
+
+
+path = None
+
+
+def _setup():
+    global path
+    path = tempfile.mkdtemp()
+
+
+def _teardown():
+    shutil.rmtree(path)
+
+
+@with_setup(_setup, _teardown)
+def test_set_get_and_remove():
+    store = SessionStore(os.path.join(path, u"state", u"kernel_sessions.json"))
+    assert_is_none(store.get(u"notebook.ipynb"))
+
+    store.set(u"notebook.ipynb", u"http://livy:8998", 4, {u"kind": u"pyspark"})
+    store.set(u"other.ipynb", u"http://livy:8998", 5, {u"kind": u"spark"})
+
+    assert_equals(SessionStore(store.path).get(u"notebook.ipynb"),
+                  (u"http://livy:8998", 4, SessionStore.properties_key({u"kind": u"pyspark"})))
+    store.remove(u"notebook.ipynb")
+    assert_is_none(store.get(u"notebook.ipynb"))
+    assert_equals(store.get(u"other.ipynb"), (u"http://livy:8998", 5, SessionStore.properties_key({u"kind": u"spark"})))
+
+
+@with_setup(_setup, _teardown)
+def test_unreadable_file_is_empty():
+    store = SessionStore(os.path.join(path, u"kernel_sessions.json"))
+    with open(store.path, u"w") as f:
+        f.write(u"{not json")
+
+    assert_is_none(store.get(u"notebook.ipynb"))
+    store.set(u"notebook.ipynb", u"http://livy:8998", 4, {u"kind": u"pyspark"})
+    assert_equals(store.get(u"notebook.ipynb"),
+                  (u"http://livy:8998", 4, SessionStore.properties_key({u"kind": u"pyspark"})))
+
+
+@with_setup(_setup, _teardown)
+def test_write_without_os_replace():
+    store = SessionStore(os.path.join(path, u"kernel_sessions.json"))
+    store.set(u"notebook.ipynb", u"http://livy:8998", 4, {u"kind": u"pyspark"})
+
+    with patch(u"sparkmagic.livyclientlib.sessionstore.os", wraps=os) as fake_os:
+        del fake_os.replace
+        store.set(u"notebook.ipynb", u"http://livy:8998", 5, {u"kind": u"pyspark"})
+
+    assert_equals(store.get(u"notebook.ipynb"),
+                  (u"http://livy:8998", 5, SessionStore.properties_key({u"kind": u"pyspark"})))
+
+
+@with_setup(_setup, _teardown)
+def test_failed_write_is_not_fatal():
+    store = SessionStore(os.path.join(path, u"kernel_sessions.json"))
+
+    with patch(u"sparkmagic.livyclientlib.sessionstore._replace", side_effect=AttributeError(u"replace")):
+        store.set(u"notebook.ipynb", u"http://livy:8998", 4, {u"kind": u"pyspark"})
+
+    assert_is_none(store.get(u"notebook.ipynb"))
+
+
+def test_properties_key():
+    properties = {u"kind": u"pyspark", u"conf": {u"a": u"1", u"b": u"2"}}
+    assert_equals(SessionStore.properties_key(properties),
+                  SessionStore.properties_key({u"conf": {u"b": u"2", u"a": u"1"}, u"kind": u"pyspark"}))
+    assert SessionStore.properties_key(properties) != \
+        SessionStore.properties_key(dict(properties, executorMemory=u"8g"))
+
+
+@with_setup(_setup, _teardown)
+def test_entry_without_properties_is_ignored():
+    store = SessionStore(os.path.join(path, u"kernel_sessions.json"))
+    with open(store.path, u"w") as f:
+        f.write(u'{"notebook.ipynb": {"url": "http://livy:8998", "id": 4, "kind": "pyspark"}}')
+
+    assert_is_none(store.get(u"notebook.ipynb"))
@@ -6,7 +6,7 @@ from sparkmagic.livyclientlib.sparkcontroller import SparkController
 from sparkmagic.livyclientlib.endpoint import Endpoint
 from sparkmagic.livyclientlib.exceptions import SessionManagementException, HttpClientException
 import sparkmagic.utils.configuration as conf
-from sparkmagic.utils.constants import NO_AUTH
+from sparkmagic.utils.constants import NO_AUTH, NOT_STARTED_SESSION_STATUS
 
 
 client_manager = None
@@ -57,6 +57,74 @@ def test_add_session():
     session.start.assert_called_once()
 
 
+@with_setup(_setup, _teardown)
+@patch('sparkmagic.livyclientlib.sparkcontroller.get_session_pool')
+def test_add_pooled_session(get_session_pool):
+    name = "name"
+    properties = {"kind": "pyspark"}
+    endpoint = Endpoint("http://location:port", NO_AUTH)
+    broken_session = MagicMock()
+    broken_session.attach.side_effect = HttpClientException("gone")
+    session = MagicMock()
+    get_session_pool.return_value.claim.side_effect = [4, 5, None]
+    controller._livy_session = MagicMock(side_effect=[broken_session, session])
+    controller._http_client = MagicMock(return_value=MagicMock())
+
+    assert controller.add_pooled_session(name, endpoint, properties)
+
+    broken_session.attach.assert_called_once_with(4)
+    controller._http_client.return_value.delete_session.assert_called_once_with(4)
+    # The broken session is no longer heartbeated or polled.
+    broken_session.detach.assert_called_once_with()
+    session.attach.assert_called_once_with(5)
+    session.detach.assert_not_called()
+    session.start.assert_not_called()
+    controller.session_manager.add_session.assert_called_once_with(name, session)
+
+    assert not controller.add_pooled_session(name, endpoint, properties)
+    assert_equals(controller.session_manager.add_session.call_count, 1)
+
+
+@with_setup(_setup, _teardown)
+def test_reattach_session():
+    name = "name"
+    properties = {"kind": "pyspark"}
+    endpoint = Endpoint("http://location:port", NO_AUTH)
+    session = MagicMock()
+    controller._livy_session = MagicMock(return_value=session)
+    controller._http_client = MagicMock(return_value=MagicMock())
+
+    assert controller.reattach_session(name, endpoint, properties, 4)
+
+    session.attach.assert_called_once_with(4)
+    session.start.assert_not_called()
+    controller.session_manager.add_session.assert_called_once_with(name, session)
+
+    session.attach.side_effect = HttpClientException("gone")
+    assert not controller.reattach_session(name, endpoint, properties, 4)
+    assert_equals(controller.session_manager.add_session.call_count, 1)
+    # The session is no longer heartbeated or polled.
+    session.detach.assert_called_once_with()
+
+
+@with_setup(_setup, _teardown)
+def test_abandon_session():
+    session = MagicMock()
+    session.status = NOT_STARTED_SESSION_STATUS
+    client_manager.sessions = {"name": session}
+
+    # Livy has not created the session yet, so there is nothing to delete.
+    assert not controller.abandon_session("name")
+    assert_equals(session.delete.call_count, 0)
+
+    session.status = "starting"
+    assert controller.abandon_session("name")
+    session.delete.assert_called_once_with()
+    assert_equals({}, client_manager.sessions)
+
+    assert controller.abandon_session("name")
+
+
 @with_setup(_setup, _teardown)
 def test_add_session_skip():
     name = "name"
@@ -143,6 +211,25 @@ def test_get_all_sessions():
     assert len(sessions) == 2
 
 
+@with_setup(_setup, _teardown)
+def test_get_all_sessions_uses_listing_for_status():
+    http_client = MagicMock()
+    sessions_json = json.loads('{"from":0,"total":2,"sessions":[{"id":0,"state":"idle","kind":'
+                               '"spark","log":[""]}, {"id":1,"state":"busy","kind":"spark","log"'
+                               ':[""]}]}')
+    http_client.get_sessions.return_value = sessions_json
+    controller._http_client = MagicMock(return_value=http_client)
+    session = MagicMock()
+    controller._livy_session = MagicMock(return_value=session)
+
+    controller.get_all_sessions_endpoint("conn_str")
+
+    assert_equals(0, http_client.get_session.call_count)
+    assert_equals(0, session.refresh_status_and_info.call_count)
+    session.update_status_and_info.assert_any_call(sessions_json[u"sessions"][0])
+    session.update_status_and_info.assert_any_call(sessions_json[u"sessions"][1])
+
+
 @with_setup(_setup, _teardown)
 def test_cleanup_endpoint():
     s0 = MagicMock()
@@ -259,3 +346,30 @@ def test_add_session_throws_when_session_start_fails():
     except ValueError as ex:
         assert str(ex) == str(e)
         session.start.assert_called_once()
+
+
+@with_setup(_setup, _teardown)
+@patch('sparkmagic.livyclientlib.sparkcontroller.LivyReliableHttpClient')
+def test_http_client_is_reused_per_endpoint(livy_client_class):
+    livy_client_class.from_endpoint.side_effect = lambda endpoint: MagicMock()
+    endpoint = Endpoint("http://location:port", NO_AUTH)
+    same_endpoint = Endpoint("http://location:port", NO_AUTH)
+    other_endpoint = Endpoint("http://other:port", NO_AUTH)
+
+    client = controller._http_client(endpoint)
+
+    assert client is controller._http_client(same_endpoint)
+    assert client is not controller._http_client(other_endpoint)
+    assert_equals(2, livy_client_class.from_endpoint.call_count)
+
+
+@with_setup(_setup, _teardown)
+@patch('sparkmagic.livyclientlib.sparkcontroller.LivyReliableHttpClient')
+def test_cleanup_closes_http_clients(livy_client_class):
+    endpoint = Endpoint("http://location:port", NO_AUTH)
+    client = controller._http_client(endpoint)
+
+    controller.cleanup()
+
+    client.close.assert_called_once_with()
+    assert_equals({}, controller._http_clients)
@@ -1,6 +1,7 @@
 from mock import MagicMock, call
 from nose.tools import with_setup
 
+import sparkmagic.utils.configuration as conf
 from sparkmagic.utils.constants import LANG_PYTHON
 from sparkmagic.kernels.wrapperkernel.sparkkernelbase import SparkKernelBase
 
@@ -114,6 +115,23 @@ def test_shutdown_cleans_up():
     dsi_m.assert_called_once_with(True)
 
 
+@with_setup(_setup, _teardown)
+def test_shutdown_keeps_persisted_session_on_restart():
+    conf.override_all({"persist_kernel_sessions": True})
+    kernel._execute_cell_for_user = ecfu_m = MagicMock()
+
+    kernel.do_shutdown(True)
+
+    ecfu_m.assert_called_once_with("%%_do_not_call_release_session\n ", True, False)
+
+    kernel._execute_cell_for_user = ecfu_m = MagicMock()
+
+    kernel.do_shutdown(False)
+
+    ecfu_m.assert_called_once_with("%%_do_not_call_delete_session\n ", True, False)
+    conf.override_all({})
+
+
 @with_setup(_setup, _teardown)
 def test_register_auto_viz():
     kernel._register_auto_viz()
@@ -1,14 +1,17 @@
 # -*- coding: UTF-8 -*-
-from mock import MagicMock
+from mock import MagicMock, patch
 from nose.tools import with_setup, assert_equals, assert_raises
 
+import sparkmagic.utils.configuration as conf
 from sparkmagic.utils.configuration import get_livy_kind
 from sparkmagic.utils.constants import LANGS_SUPPORTED, SESSION_KIND_PYSPARK, SESSION_KIND_SPARK, \
     IDLE_SESSION_STATUS, BUSY_SESSION_STATUS
 from sparkmagic.magics.sparkmagicsbase import SparkMagicBase
 from sparkmagic.livyclientlib.exceptions import DataFrameParseException, BadUserDataException
 from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.livyclientlib.command import Command
 from sparkmagic.livyclientlib.sparkstorecommand import SparkStoreCommand
+from sparkmagic.livyclientlib.remotedataframe import RemoteDataFrame
 
 def _setup():
     global magic, session, shell, ipython_display
@@ -159,7 +162,7 @@ def test_spark_execution_with_output_var():
     magic.spark_controller.run_command.side_effect = [(True,'out'), df]
     magic.execute_spark("", output_var, None, None, None, session, True)
     magic.ipython_display.write.assert_called_once_with('out')
-    magic._spark_store_command.assert_called_once_with(output_var, None, None, None, True)
+    magic._spark_store_command.assert_called_once_with(output_var, None, None, None, True, "", False, None)
     assert shell.user_ns[output_var] == df
 
     magic.spark_controller.run_command.side_effect = None
@@ -168,6 +171,44 @@ def test_spark_execution_with_output_var():
     magic.ipython_display.send_error.assert_called_once_with('out')
 
 
+@with_setup(_setup, _teardown)
+def test_sql_df_execution_with_aggregation_pushdown():
+    df = MagicMock()
+    magic.spark_controller.run_sqlquery = MagicMock(return_value=df)
+
+    with patch('sparkmagic.magics.sparkmagicsbase.set_aggregator') as set_aggregator:
+        magic.execute_sqlquery("SELECT 1", None, None, None, session, None, False, None)
+        assert not set_aggregator.called
+
+        conf.override(conf.autoviz_aggregation_pushdown.__name__, True)
+        try:
+            magic.execute_sqlquery("SELECT 1", None, None, None, session, None, False, False)
+        finally:
+            conf.override(conf.autoviz_aggregation_pushdown.__name__, False)
+
+    (aggregated_df, aggregator) = set_aggregator.call_args[0]
+    assert aggregated_df is df
+    assert_equals("SELECT 1", aggregator.query)
+    assert aggregator._spark_controller is magic.spark_controller
+    assert_equals(session, aggregator._session_name)
+
+
+@with_setup(_setup, _teardown)
+def test_spark_execution_with_lazy_output_var():
+    magic._spark_store_command = MagicMock()
+    output_var = "var_name"
+
+    magic.spark_controller.run_command.return_value = (True, 'out')
+    magic.execute_spark("", output_var, "sample", 10, 0.5, session, True, lazy=True)
+
+    assert not magic._spark_store_command.called
+    magic.spark_controller.run_command.assert_called_once_with(Command(""), session)
+    remote = shell.user_ns[output_var]
+    assert isinstance(remote, RemoteDataFrame)
+    assert_equals(output_var, remote.dataframe)
+    assert_equals(("sample", 10, 0.5), (remote.samplemethod, remote.maxrows, remote.samplefraction))
+
+
 @with_setup(_setup, _teardown)
 def test_spark_exception_with_output_var():
     mockSparkCommand = MagicMock()
@@ -179,5 +220,5 @@ def test_spark_exception_with_output_var():
     magic.spark_controller.run_command.side_effect = [(True,'out'), exception]
     assert_raises(BadUserDataException, magic.execute_spark,"", output_var, None, None, None, session, True)
     magic.ipython_display.write.assert_called_once_with('out')
-    magic._spark_store_command.assert_called_once_with(output_var, None, None, None, True)
+    magic._spark_store_command.assert_called_once_with(output_var, None, None, None, True, "", False, None)
     assert shell.user_ns == {}
@@ -1,14 +1,17 @@
 # coding=utf-8
-from mock import MagicMock, call
+from mock import MagicMock, call, patch
 from nose.tools import with_setup, assert_equals, assert_false, assert_raises
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
+from tornado import gen
+from tornado.ioloop import IOLoop
 
 import sparkmagic.utils.configuration as conf
-from sparkmagic.utils.constants import LONG_RANDOM_VARIABLE_NAME
+from sparkmagic.utils.constants import LONG_RANDOM_VARIABLE_NAME, PYSPARK_COMPRESSED_PRINT, SCALA_COMPRESSED_PRINT, \
+    R_COMPRESSED_PRINT, PYSPARK_SCHEMA_PRINT, ROW_COUNT_PREFIX, SCHEMA_PREFIX
 from sparkmagic.livyclientlib.sparkstorecommand import SparkStoreCommand
 from sparkmagic.livyclientlib.command import Command
-from sparkmagic.livyclientlib.exceptions import BadUserDataException
+from sparkmagic.livyclientlib.exceptions import BadUserDataException, DataFrameParseException
 
 
 backup_conf_defaults = None
@@ -193,6 +196,19 @@ def test_r_livy_sampling_options():
                           .format(LONG_RANDOM_VARIABLE_NAME, variable_name, 
                                   LONG_RANDOM_VARIABLE_NAME)))
 
+@with_setup(_setup, _teardown)
+def test_compressed_commands():
+    variable_name = "abc"
+    sparkcommand = SparkStoreCommand(variable_name, samplemethod='take', maxrows=100, compress=True)
+
+    assert_equals(sparkcommand._pyspark_command(variable_name),
+                  Command(PYSPARK_COMPRESSED_PRINT.format(u'abc.toJSON().take(100)')))
+    assert_equals(sparkcommand._scala_command(variable_name),
+                  Command(SCALA_COMPRESSED_PRINT.format(u'abc.toJSON.take(100)')))
+    assert_equals(sparkcommand._r_command(variable_name),
+                  Command(R_COMPRESSED_PRINT.format(u'jsonlite::toJSON(take(abc,100))')))
+
+
 @with_setup(_setup, _teardown)
 def test_execute_code():
     spark_events = MagicMock()
@@ -211,6 +227,287 @@ def test_execute_code():
     sparkcommand.to_command.return_value.execute.assert_called_once_with(session)
 
 
+@with_setup(_setup, _teardown)
+def test_execute_code_uses_disk_cache():
+    disk_cache = MagicMock()
+    disk_cache.get.return_value = None
+    session = MagicMock()
+    session.kind = "pyspark"
+    session.endpoint.url = "http://livy"
+    session.id = 3
+
+    def sparkcommand(**kwargs):
+        command = SparkStoreCommand("abc", "take", 100, 0.2, spark_events=MagicMock(), coerce=False,
+                                    disk_cache=disk_cache, **kwargs)
+        command.to_command = MagicMock()
+        command.to_command.return_value.execute.return_value = (True, """{"z":100, "y":50}""")
+        return command
+
+    # Without the code that defined the variable, the result cannot be matched to a cache entry.
+    sparkcommand().execute(session)
+    assert_equals(0, disk_cache.get.call_count)
+    assert_equals(0, disk_cache.put.call_count)
+
+    command = sparkcommand(source="abc = spark.range(5)")
+    result = command.execute(session)
+    assert_equals(1, disk_cache.get.call_count)
+    disk_cache.put.assert_called_once_with(command._disk_cache_key(session), result, "abc = spark.range(5)",
+                                           "http://livy", None)
+
+    disk_cache.get.return_value = result
+    command = sparkcommand(source="abc = spark.range(5)")
+    assert_frame_equal(result, command.execute(session))
+    assert_equals(0, command.to_command.call_count)
+
+    command = sparkcommand(source="abc = spark.range(5)", refresh=True)
+    command.execute(session)
+    assert_equals(1, command.to_command.call_count)
+    assert_equals(2, disk_cache.get.call_count)
+    assert_equals(2, disk_cache.put.call_count)
+
+
+@with_setup(_setup, _teardown)
+def test_execute_async_code():
+    variable_name = "abc"
+
+    sparkcommand = SparkStoreCommand(variable_name, "take", 100, 0.2, spark_events=MagicMock(), coerce=False)
+    sparkcommand.to_command = MagicMock(return_value=MagicMock())
+
+    @gen.coroutine
+    def execute_async(session):
+        raise gen.Return((True, """{"z":100, "y":50}
+{"z":25, "y":10}"""))
+
+    sparkcommand.to_command.return_value.execute_async = MagicMock(side_effect=execute_async)
+    session = MagicMock()
+    session.kind = "pyspark"
+
+    io_loop = IOLoop()
+    try:
+        result = io_loop.run_sync(lambda: sparkcommand.execute_async(session))
+    finally:
+        io_loop.close()
+
+    sparkcommand.to_command.assert_called_once_with(session.kind, variable_name)
+    sparkcommand.to_command.return_value.execute_async.assert_called_once_with(session)
+    assert_frame_equal(pd.DataFrame([{"z": 100, "y": 50}, {"z": 25, "y": 10}], columns=["z", "y"]), result)
+
+
+@with_setup(_setup, _teardown)
+def test_paged_commands():
+    sparkcommand = SparkStoreCommand("df", samplemethod='sample', samplefraction=0.5, maxrows=-1, page_size=10)
+    pages = u'{}_pages'.format(LONG_RANDOM_VARIABLE_NAME)
+
+    assert_equals(sparkcommand._page_setup_command("pyspark3"),
+                  Command(u'{0}_rows = df.toJSON().sample(False, 0.5).zipWithIndex().cache()\n'
+                          u'{0}_count = {0}_rows.count()\n'
+                          u'{0} = {0}_rows.map(lambda r: (r[1] // 10, (r[1], r[0])))'
+                          u'.partitionBy(max(1, -(-{0}_count // 10)), lambda page: page).cache()\n'
+                          u'{0}.count()\n'
+                          u'{0}_rows.unpersist()\n'
+                          u'print(u"{1}" + str({0}_count))'.format(pages, ROW_COUNT_PREFIX)))
+    assert_equals(sparkcommand._page_command("pyspark3", 1),
+                  Command(u'for {0} in [r[1] for r in sorted({1}.lookup(1))]: print({0})'
+                          .format(LONG_RANDOM_VARIABLE_NAME, pages)))
+    assert_equals(sparkcommand._page_setup_command("spark"),
+                  Command(u'val {0}_rows = df.toJSON.rdd.sample(false, 0.5).zipWithIndex.cache()\n'
+                          u'val {0}_count = {0}_rows.count\n'
+                          u'val {0} = {0}_rows.map(r => (r._2 / 10, r))'
+                          u'.partitionBy(new org.apache.spark.HashPartitioner(math.max(1L, ({0}_count + 10 - 1) / 10)'
+                          u'.toInt)).cache()\n'
+                          u'{0}.count\n'
+                          u'{0}_rows.unpersist()\n'
+                          u'println("{1}" + {0}_count)'.format(pages, ROW_COUNT_PREFIX)))
+    assert_equals(sparkcommand._page_command("spark", 1),
+                  Command(u'{}.lookup(1).sortBy(_._2).map(_._1).foreach(println)'.format(pages)))
+    assert_equals(sparkcommand._page_cleanup_command("spark"),
+                  Command(u'{0}_rows.unpersist()\n{0}.unpersist()'.format(pages)))
+
+    assert sparkcommand._should_page("pyspark")
+    assert_false(sparkcommand._should_page("sparkr"))
+    assert_false(SparkStoreCommand("df", maxrows=100, page_size=10)._should_page("pyspark"))
+    assert_false(SparkStoreCommand("df", maxrows=-1, page_size=0)._should_page("pyspark"))
+
+
+@with_setup(_setup, _teardown)
+def test_cluster_sampling_commands():
+    sparkcommand = SparkStoreCommand("df", samplemethod='reservoir', maxrows=10, compress=False, arrow=False,
+                                     schema=False)
+    assert_equals(sparkcommand.to_command("pyspark3", "df"),
+                  Command(u'{0}_df = df\nfrom pyspark.sql.functions import rand as {0}_rand\n'
+                          u'for {0} in {0}_df.orderBy({0}_rand()).limit(10).toJSON().take(10): print({0})'
+                          .format(LONG_RANDOM_VARIABLE_NAME)))
+
+    sparkcommand = SparkStoreCommand("df", samplemethod='stratified', maxrows=10, stratify='c', compress=False,
+                                     arrow=False, schema=False)
+    command = sparkcommand.to_command("spark", "df").code
+    # One block, so the Scala REPL does not echo the setup's vals into the records.
+    assert command.startswith(u'{{ val {}_df = df\n'.format(LONG_RANDOM_VARIABLE_NAME))
+    assert command.endswith(u'{0}_df.stat.sampleBy("c", {0}_fractions, scala.util.Random.nextLong).toJSON'
+                            u'.take(10).foreach(println) }}'.format(LONG_RANDOM_VARIABLE_NAME))
+
+    sparkcommand = SparkStoreCommand("df", samplemethod='stratified', samplefraction=0.5, maxrows=-1,
+                                     stratify='c', page_size=10, schema=False)
+    command = sparkcommand._page_setup_command("spark").code
+    assert command.startswith(u'val {0}_pages_rows = {{ val {0}_df = df\nval {0}_fractions = '
+                              .format(LONG_RANDOM_VARIABLE_NAME))
+    assert u'.toJSON.rdd.zipWithIndex.cache() }}\nval {}_pages_count'.format(LONG_RANDOM_VARIABLE_NAME) in command
+
+    sparkcommand = SparkStoreCommand("df", samplemethod='stratified', samplefraction=0.5, maxrows=-1,
+                                     stratify='c', page_size=10, schema=False)
+    command = sparkcommand._page_setup_command("pyspark").code
+    assert command.startswith(u'{}_df = df\n'.format(LONG_RANDOM_VARIABLE_NAME))
+    assert u'{0}_pages_rows = {0}_df.sampleBy("c", {0}_fractions).toJSON().zipWithIndex()'\
+        .format(LONG_RANDOM_VARIABLE_NAME) in command
+
+    assert_raises(BadUserDataException, SparkStoreCommand, "df", samplemethod='stratified')
+
+
+@with_setup(_setup, _teardown)
+def test_execute_paged():
+    sparkcommand = SparkStoreCommand("df", samplemethod='take', maxrows=-1, coerce=False, page_size=2)
+    outputs = [(True, ROW_COUNT_PREFIX + u"3\n"), (True, u'{"z":1,"y":"a"}\n{"z":2}'), (True, u'{"z":3,"y":"c"}'), (True, u"")]
+    session = MagicMock()
+    session.kind = "pyspark3"
+
+    with patch.object(Command, "execute", autospec=True, side_effect=lambda c, s: outputs.pop(0)) as execute:
+        result = sparkcommand.execute(session)
+
+    assert_equals([sparkcommand._page_setup_command("pyspark3"), sparkcommand._page_command("pyspark3", 0),
+                   sparkcommand._page_command("pyspark3", 1), sparkcommand._page_cleanup_command("pyspark3")],
+                  [args[0] for (args, _) in execute.call_args_list])
+    expected = pd.DataFrame([{"z": 1, "y": "a"}, {"z": 2, "y": None}, {"z": 3, "y": "c"}], columns=["z", "y"])
+    assert_frame_equal(expected, result)
+
+
+class _FakeRDD(object):
+    """Just enough of a PySpark RDD to run the paging code. Partitions are lists, and lookup() records which
+    partitions it read."""
+    reads = []
+
+    def __init__(self, partitions, partitioner=None):
+        self.partitions = partitions
+        self.partitioner = partitioner
+
+    def _rows(self):
+        return [row for partition in self.partitions for row in partition]
+
+    def toJSON(self):
+        return self
+
+    def zipWithIndex(self):
+        return _FakeRDD([[(row, i) for (i, row) in enumerate(self._rows())]])
+
+    def map(self, f):
+        return _FakeRDD([[f(row) for row in partition] for partition in self.partitions])
+
+    def partitionBy(self, count, partition_func):
+        partitions = [[] for _ in range(count)]
+        # A shuffle does not keep the order of rows.
+        for row in reversed(self._rows()):
+            partitions[partition_func(row[0]) % count].append(row)
+        return _FakeRDD(partitions, partition_func)
+
+    def lookup(self, key):
+        index = self.partitioner(key) % len(self.partitions)
+        _FakeRDD.reads.append(index)
+        return [value for (k, value) in self.partitions[index] if k == key]
+
+    def count(self):
+        return len(self._rows())
+
+    def cache(self):
+        return self
+
+    def unpersist(self):
+        return self
+
+
+@with_setup(_setup, _teardown)
+def test_paged_code_reads_one_partition_per_page():
+    sparkcommand = SparkStoreCommand("df", samplemethod='take', maxrows=-1, page_size=2, schema=False)
+    printed = []
+    namespace = {"df": _FakeRDD([[u'a', u'b', u'c'], [u'd', u'e']]), "print": printed.append}
+    _FakeRDD.reads = []
+
+    exec(sparkcommand._page_setup_command("pyspark3").code, namespace)
+    assert_equals([ROW_COUNT_PREFIX + u"5"], printed)
+    pages = []
+    for page in range(sparkcommand._page_count(printed[0])):
+        del printed[:]
+        exec(sparkcommand._page_command("pyspark3", page).code, namespace)
+        pages.append(list(printed))
+    exec(sparkcommand._page_cleanup_command("pyspark3").code, namespace)
+
+    assert_equals([[u'a', u'b'], [u'c', u'd'], [u'e']], pages)
+    assert_equals([0, 1, 2], _FakeRDD.reads)
+    assert u'{}_pages'.format(LONG_RANDOM_VARIABLE_NAME) not in namespace
+
+
+@with_setup(_setup, _teardown)
+def test_execute_paged_with_schema():
+    sparkcommand = SparkStoreCommand("df", samplemethod='take', maxrows=-1, coerce=True, page_size=2, schema=True)
+    outputs = [(True, SCHEMA_PREFIX + u'[["z","bigint"],["y","string"]]\n' + ROW_COUNT_PREFIX + u'1\n'), (True, u'{"z":"1","y":"10"}'),
+               (True, u"")]
+    session = MagicMock()
+    session.kind = "pyspark3"
+
+    with patch.object(Command, "execute", autospec=True, side_effect=lambda c, s: outputs.pop(0)) as execute:
+        result = sparkcommand.execute(session)
+
+    setup_code = execute.call_args_list[0][0][0].code
+    assert setup_code.startswith(PYSPARK_SCHEMA_PRINT.format("df") + u"\n")
+    assert_frame_equal(pd.DataFrame([{"z": 1, "y": "10"}], columns=["z", "y"]), result)
+
+
+@with_setup(_setup, _teardown)
+def test_execute_paged_scala_ignores_repl_echo():
+    sparkcommand = SparkStoreCommand("df", samplemethod='take', maxrows=-1, coerce=True, page_size=2, schema=True)
+    pages = u'{}_pages'.format(LONG_RANDOM_VARIABLE_NAME)
+    setup_output = (SCHEMA_PREFIX + u'{{"type":"struct","fields":[{{"name":"z","type":"long","nullable":true,'
+                    u'"metadata":{{}}}}]}}\n'
+                    u'{0}_rows: org.apache.spark.rdd.RDD[(String, Long)] = ZippedWithIndexRDD[12] at rdd\n'
+                    u'{0}_count: Long = 3\n'
+                    u'{0}: org.apache.spark.rdd.RDD[(Long, (String, Long))] = ShuffledRDD[14] at partitionBy\n'
+                    u'res3: Long = 3\n'
+                    u'res4: {0}_rows.type = ZippedWithIndexRDD[12] at rdd\n'
+                    u'{1}3\n').format(pages, ROW_COUNT_PREFIX)
+    outputs = [(True, setup_output), (True, u'{"z":1}\n{"z":2}'), (True, u'{"z":3}'),
+               (True, u'res5: {0}.type = ShuffledRDD[14] at partitionBy'.format(pages))]
+    session = MagicMock()
+    session.kind = "spark"
+
+    with patch.object(Command, "execute", autospec=True, side_effect=lambda c, s: outputs.pop(0)) as execute:
+        result = sparkcommand.execute(session)
+
+    assert_equals(4, execute.call_count)
+    assert_frame_equal(pd.DataFrame({"z": [1, 2, 3]}), result)
+
+
+@with_setup(_setup, _teardown)
+def test_execute_paged_without_row_count():
+    sparkcommand = SparkStoreCommand("df", samplemethod='take', maxrows=-1, page_size=2, schema=False)
+    outputs = [(True, u'res3: Long = 3'), (True, u'')]
+    session = MagicMock()
+    session.kind = "spark"
+
+    with patch.object(Command, "execute", autospec=True, side_effect=lambda c, s: outputs.pop(0)):
+        assert_raises(DataFrameParseException, sparkcommand.execute, session)
+
+
+@with_setup(_setup, _teardown)
+def test_execute_paged_cleans_up_on_failure():
+    sparkcommand = SparkStoreCommand("df", samplemethod='take', maxrows=-1, page_size=2)
+    outputs = [(False, u"NameError: name 'df' is not defined"), (False, u"NameError")]
+    session = MagicMock()
+    session.kind = "pyspark"
+
+    with patch.object(Command, "execute", autospec=True, side_effect=lambda c, s: outputs.pop(0)) as execute:
+        assert_raises(BadUserDataException, sparkcommand.execute, session)
+
+    assert_equals(sparkcommand._page_cleanup_command("pyspark"), execute.call_args_list[-1][0][0])
+
+
 @with_setup(_setup, _teardown)
 def test_unicode():
     variable_name = u"collect 'è'"
@@ -0,0 +1,46 @@
+from mock import MagicMock
+from nose.tools import assert_equals, assert_is_none
+import pandas as pd
+
+from autovizwidget.widget.encoding import Encoding
+
+from sparkmagic.livyclientlib.sqlaggregator import SQLAggregator
+from sparkmagic.livyclientlib.sqlquery import SQLQuery
+
+
+def test_aggregates_remotely():
+    spark_controller = MagicMock()
+    spark_controller.run_sqlquery.return_value = pd.DataFrame({u'date': [u'a', u'b'], u'temp': [1.5, 2.0]})
+    aggregator = SQLAggregator(spark_controller, u'session', u'SELECT * FROM t;\n', False)
+
+    assert_equals(([u'a', u'b'], [1.5, 2.0]), aggregator(u'date', u'temp', Encoding.y_agg_avg))
+
+    (sqlquery, session_name) = spark_controller.run_sqlquery.call_args[0]
+    assert_equals(u'session', session_name)
+    assert_equals(u'SELECT `date`, AVG(`temp`) AS `temp` FROM (SELECT * FROM t) sparkmagic_autoviz GROUP BY `date` '
+                  u'ORDER BY `date`', sqlquery.query)
+    assert_equals(u'take', sqlquery.samplemethod)
+    assert_equals(False, sqlquery._coerce)
+
+
+def test_aggregation_functions():
+    aggregator = SQLAggregator(MagicMock(), None, u'SELECT 1')
+    for (y_aggregation, function) in [(Encoding.y_agg_min, u'MIN'), (Encoding.y_agg_max, u'MAX'),
+                                      (Encoding.y_agg_sum, u'SUM'), (Encoding.y_agg_count, u'COUNT')]:
+        aggregator(u'x', u'y', y_aggregation)
+        assert u'{}(`y`)'.format(function) in aggregator._spark_controller.run_sqlquery.call_args[0][0].query
+
+
+def test_quotes_identifiers():
+    sqlquery = SQLAggregator(MagicMock(), None, u'SELECT 1').to_sqlquery(u'we`ird', u'y', u'SUM')
+    assert sqlquery.query.startswith(u'SELECT `we``ird`, SUM(`y`) AS `y`')
+
+
+def test_falls_back_to_local_aggregation():
+    spark_controller = MagicMock()
+    spark_controller.run_sqlquery.side_effect = ValueError(u'cannot parse SHOW TABLES as a subquery')
+    aggregator = SQLAggregator(spark_controller, None, u'SHOW TABLES')
+
+    assert_is_none(aggregator(u'x', u'y', Encoding.y_agg_sum))
+    assert_is_none(aggregator(u'x', u'y', Encoding.y_agg_none))
+    assert_equals(1, spark_controller.run_sqlquery.call_count)
@@ -1,12 +1,19 @@
 ﻿# coding=utf-8
-from mock import MagicMock, call
+import shutil
+import tempfile
+
+from mock import MagicMock, call, patch
 from nose.tools import with_setup, assert_equals, assert_false, raises
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
 
 import sparkmagic.utils.configuration as conf
-from sparkmagic.utils.constants import LONG_RANDOM_VARIABLE_NAME
+from sparkmagic.utils.constants import LONG_RANDOM_VARIABLE_NAME, PYSPARK_COMPRESSED_PRINT, SCALA_COMPRESSED_PRINT, \
+    R_COMPRESSED_PRINT, PYSPARK_ARROW_PRINT, PYSPARK_SCHEMA_PRINT, SCALA_SCHEMA_PRINT, R_SCHEMA_PRINT
+from sparkmagic.utils.utils import records_to_dataframe
 from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.livyclientlib.resultcache import ResultCache
+from sparkmagic.livyclientlib.diskresultcache import DiskResultCache
 from sparkmagic.livyclientlib.command import Command
 from sparkmagic.livyclientlib.exceptions import BadUserDataException
 
@@ -110,6 +117,70 @@ def test_pyspark_livy_sql_options():
                           u'print({})'\
                           .format(LONG_RANDOM_VARIABLE_NAME, query, LONG_RANDOM_VARIABLE_NAME)))
 
+@with_setup(_setup, _teardown)
+def test_cluster_sampling_commands():
+    query = "abc"
+
+    sqlquery = SQLQuery(query, samplemethod='partition', maxrows=100, compress=False, arrow=False, schema=False)
+    command = sqlquery.to_command("pyspark3", "spark").code
+    assert command.startswith(u'{}_df = spark.sql(u"""abc """)\n'.format(LONG_RANDOM_VARIABLE_NAME))
+    assert command.endswith(u'{0}_df.schema).toJSON().take(100): print({0})'.format(LONG_RANDOM_VARIABLE_NAME))
+
+    sqlquery = SQLQuery(query, samplemethod='reservoir', maxrows=100, compress=False, schema=False)
+    assert_equals(sqlquery._r_command("spark"),
+                  Command(u'for ({0} in (jsonlite:::toJSON(take(limit(orderBy({0}_df, rand()), 100),100)))) '
+                          u'{{cat({0})}}'.format(LONG_RANDOM_VARIABLE_NAME)))
+    assert sqlquery.to_command("sparkr", "spark").code.startswith(u'{}_df <- sql("abc")\n'
+                                                                   .format(LONG_RANDOM_VARIABLE_NAME))
+
+    sqlquery = SQLQuery(query, samplemethod='stratified', maxrows=100, stratify='c', arrow=True, schema=False)
+    assert u'{0}_df.sampleBy("c", {0}_fractions).limit(100)'.format(LONG_RANDOM_VARIABLE_NAME) in \
+        sqlquery.to_command("pyspark", "spark").code
+
+    assert SQLQuery(query, samplemethod='stratified', stratify='c') != \
+        SQLQuery(query, samplemethod='stratified', stratify='d')
+
+
+def _scala_repl_output(code, records):
+    """What Livy's Scala REPL returns for code: the printed schema and records, with an echo line for each val
+    at the top level of the statement, where the REPL shows its type and value."""
+    output = []
+    depth = 0
+    for line in code.split(u'\n'):
+        if depth == 0 and line.startswith(u'println("sparkmagic-schema:'):
+            output.append(u'sparkmagic-schema:{"type":"struct","fields":['
+                          u'{"name":"c","type":"string","nullable":true,"metadata":{}},'
+                          u'{"name":"n","type":"long","nullable":true,"metadata":{}}]}')
+        elif depth == 0 and line.startswith(u'val '):
+            output.append(u'{}: org.apache.spark.sql.DataFrame = [c: string, n: bigint]'
+                          .format(line[len(u'val '):].split(u' ')[0]))
+        depth += line.count(u'{') - line.count(u'}')
+    return u'\n'.join(output + records)
+
+
+@with_setup(_setup, _teardown)
+def test_execute_scala_cluster_sampling_ignores_repl_echo():
+    for method in ('stratified', 'reservoir', 'partition'):
+        disk_cache = MagicMock()
+        disk_cache.enabled.return_value = False
+        sqlquery = SQLQuery("SELECT c, n FROM t", method, 2, stratify='c', compress=False, schema=True,
+                            result_cache=ResultCache(0), disk_cache=disk_cache, spark_events=MagicMock())
+        session = MagicMock()
+        session.kind = "spark"
+        output = lambda command, _: (True, _scala_repl_output(command.code, [u'{"c":"a","n":1}', u'{"c":"b"}']))
+
+        with patch.object(Command, "execute", autospec=True, side_effect=output):
+            result = sqlquery.execute(session)
+
+        assert_frame_equal(pd.DataFrame({"c": ["a", "b"], "n": pd.array([1, None], dtype="Int64")}), result)
+
+
+@with_setup(_setup, _teardown)
+@raises(BadUserDataException)
+def test_sqlquery_rejects_stratified_without_column():
+    _ = SQLQuery("abc", samplemethod='stratified')
+
+
 @with_setup(_setup, _teardown)
 def test_scala_livy_sql_options():
     query = "abc"
@@ -152,6 +223,67 @@ def test_r_livy_sql_options_spark():
                       Command('for ({} in (jsonlite:::toJSON(take(sample(sql({}, "{}"), FALSE, 0.33),3234)))) {{cat({})}}'.format(LONG_RANDOM_VARIABLE_NAME, sqlContext, query, LONG_RANDOM_VARIABLE_NAME)))
 
 
+@with_setup(_setup, _teardown)
+def test_compressed_commands():
+    query = "abc"
+    sqlquery = SQLQuery(query, samplemethod='take', maxrows=100, compress=True)
+
+    assert_equals(sqlquery._pyspark_command("spark"),
+                  Command(PYSPARK_COMPRESSED_PRINT.format(u'spark.sql(u"""{} """).toJSON().take(100)'.format(query))))
+    assert_equals(sqlquery._scala_command("spark"),
+                  Command(SCALA_COMPRESSED_PRINT.format(u'spark.sql("""{}""").toJSON.take(100)'.format(query))))
+    assert_equals(sqlquery._r_command("spark"),
+                  Command(R_COMPRESSED_PRINT.format(u'jsonlite:::toJSON(take(sql("{}"),100))'.format(query))))
+
+
+@with_setup(_setup, _teardown)
+def test_compressed_pyspark_command_round_trips():
+    records = [u'{"z":100,"y":"\u00e9"}', u'{"z":25,"y":"b"}']
+    spark = MagicMock()
+    spark.sql.return_value.toJSON.return_value.take.return_value = records
+    sqlquery = SQLQuery("abc", samplemethod="take", maxrows=2, compress=True, coerce=False)
+    output = []
+    exec(sqlquery._pyspark_command("spark").code, {u"spark": spark, u"print": output.append})
+
+    df = records_to_dataframe(output[0], "pyspark", False)
+
+    assert_frame_equal(pd.DataFrame([{u'z': 100, u'y': u"\u00e9"}, {u'z': 25, u'y': u"b"}], columns=[u'z', u'y']), df)
+
+
+@with_setup(_setup, _teardown)
+@patch('sparkmagic.utils.utils.import_pyarrow')
+def test_arrow_commands(import_pyarrow):
+    query = "abc"
+    sqlquery = SQLQuery(query, samplemethod='sample', samplefraction=0.25, maxrows=100, arrow=True)
+
+    assert_equals(sqlquery.to_command("pyspark", "spark"),
+                  Command(PYSPARK_ARROW_PRINT.format(var=LONG_RANDOM_VARIABLE_NAME,
+                                                     dataframe=u'spark.sql(u"""{} """).sample(False, 0.25).limit(100)'
+                                                     .format(query))))
+    import_pyarrow.assert_called_once_with()
+    # Other session kinds keep using JSON.
+    assert_equals(sqlquery.to_command("spark", "spark"),
+                  Command('spark.sql("""{}""").toJSON.sample(false, 0.25).take(100).foreach(println)'.format(query)))
+
+
+@with_setup(_setup, _teardown)
+def test_schema_commands():
+    query = "abc"
+    sqlquery = SQLQuery(query, samplemethod='take', maxrows=100, schema=True)
+
+    assert_equals(sqlquery.to_command("pyspark3", "spark"),
+                  Command(u'{}\n{}'.format(PYSPARK_SCHEMA_PRINT.format(u'spark.sql(u"""abc """)'),
+                                           sqlquery._pyspark_command("spark", False).code)))
+    assert_equals(sqlquery.to_command("spark", "spark"),
+                  Command(u'{}\n{}'.format(SCALA_SCHEMA_PRINT.format(u'spark.sql("""abc""")'),
+                                           sqlquery._scala_command("spark").code)))
+    assert_equals(sqlquery.to_command("sparkr", "sqlContext"),
+                  Command(u'{}\n{}'.format(R_SCHEMA_PRINT.format(u'sql(sqlContext, "abc")'),
+                                           sqlquery._r_command("sqlContext").code)))
+    assert_equals(SQLQuery(query, schema=False).to_command("spark", "spark"),
+                  SQLQuery(query, schema=False)._scala_command("spark"))
+
+
 @with_setup(_setup, _teardown)
 def test_execute_sql():
     spark_events = MagicMock()
@@ -303,3 +435,130 @@ def test_r_livy_sql_options_spark2():
         sqlquery = SQLQuery(query, samplemethod='sample', samplefraction=0.33, maxrows=3234)
         assert_equals(sqlquery._r_command("spark"),
                       Command('for ({} in (jsonlite:::toJSON(take(sample(sql("{}"), FALSE, 0.33),3234)))) {{cat({})}}'.format(LONG_RANDOM_VARIABLE_NAME, query, LONG_RANDOM_VARIABLE_NAME)))
+
+
+@with_setup(_setup, _teardown)
+def test_execute_sql_uses_result_cache():
+    result_cache = ResultCache(10 ** 6)
+    session = MagicMock()
+    session.kind = "pyspark"
+    session.endpoint.url = "http://livy"
+    session.id = 3
+
+    def sqlquery(query, **kwargs):
+        q = SQLQuery(query, "take", 100, result_cache=result_cache, spark_events=MagicMock(), **kwargs)
+        q.to_command = MagicMock()
+        q.to_command.return_value.execute.return_value = (True, """{"z":100, "y":50}""")
+        return q
+
+    first = sqlquery("SELECT 1")
+    result = first.execute(session)
+    assert_equals(1, first.to_command.return_value.execute.call_count)
+    assert_equals(1, len(result_cache))
+
+    second = sqlquery("SELECT 1")
+    assert_frame_equal(result, second.execute(session))
+    assert_equals(0, second.to_command.call_count)
+    assert_equals(0, second._spark_events.emit_sql_execution_start_event.call_count)
+
+    refreshed = sqlquery("SELECT 1", refresh=True)
+    refreshed.execute(session)
+    assert_equals(1, refreshed.to_command.return_value.execute.call_count)
+
+    other_query = sqlquery("SELECT 2")
+    other_query.execute(session)
+    assert_equals(1, other_query.to_command.return_value.execute.call_count)
+
+    session.id = 4
+    other_session = sqlquery("SELECT 1")
+    other_session.execute(session)
+    assert_equals(1, other_session.to_command.return_value.execute.call_count)
+
+
+@with_setup(_setup, _teardown)
+def test_execute_sql_result_cache_disabled():
+    result_cache = ResultCache(0)
+    sqlquery = SQLQuery("SELECT 1", "take", 100, result_cache=result_cache, spark_events=MagicMock())
+    sqlquery.to_command = MagicMock()
+    sqlquery.to_command.return_value.execute.return_value = (True, """{"z":100, "y":50}""")
+    session = MagicMock()
+    session.kind = "pyspark"
+
+    sqlquery.execute(session)
+    sqlquery.execute(session)
+
+    assert_equals(2, sqlquery.to_command.return_value.execute.call_count)
+    assert_equals(0, len(result_cache))
+
+
+@with_setup(_setup, _teardown)
+def test_execute_sql_uses_disk_cache():
+    disk_cache = MagicMock()
+    disk_cache.get.return_value = None
+    result_cache = ResultCache(10 ** 6)
+    session = MagicMock()
+    session.kind = "pyspark"
+    session.endpoint.url = "http://livy"
+    session.id = 3
+    sqlquery = SQLQuery("SELECT 1", "take", 100, result_cache=result_cache, disk_cache=disk_cache,
+                        spark_events=MagicMock())
+    sqlquery.to_command = MagicMock()
+    sqlquery.to_command.return_value.execute.return_value = (True, """{"z":100, "y":50}""")
+
+    result = sqlquery.execute(session)
+
+    key = DiskResultCache.key("http://livy", None, "SELECT 1", "take", 100, sqlquery.samplefraction, None, None,
+                              False, False)
+    disk_cache.get.assert_called_once_with(key)
+    disk_cache.put.assert_called_once_with(key, result, "SELECT 1", "http://livy", None)
+
+    # A kernel restarted onto the same session has an empty memory cache, but the disk entry still applies.
+    result_cache.clear()
+    disk_cache.get.return_value = result
+    sqlquery = SQLQuery("SELECT 1", "take", 100, result_cache=result_cache, disk_cache=disk_cache,
+                        spark_events=MagicMock())
+    sqlquery.to_command = MagicMock()
+    assert_frame_equal(result, sqlquery.execute(session))
+    assert_equals(0, sqlquery.to_command.call_count)
+    assert_equals(1, len(result_cache))
+
+    # A new session after a restart shares the entry, unless entries are kept apart per session.
+    session.id = 4
+    assert_equals(key, sqlquery._disk_cache_key(session))
+    conf.override_all({"disk_result_cache_per_session": True})
+    assert sqlquery._disk_cache_key(session) != key
+    conf.override_all({})
+
+
+def test_disk_cache_survives_restart_onto_new_session():
+    path = tempfile.mkdtemp()
+    try:
+        disk_cache = DiskResultCache(path, 10 ** 7, 60)
+        session = MagicMock()
+        session.kind = "pyspark"
+        session.endpoint.url = "http://livy"
+
+        def run_in_new_kernel(session_id):
+            session.id = session_id
+            sqlquery = SQLQuery("SELECT 1", "take", 100, result_cache=ResultCache(10 ** 6), disk_cache=disk_cache,
+                                spark_events=MagicMock())
+            sqlquery.to_command = MagicMock()
+            sqlquery.to_command.return_value.execute.return_value = (True, """{"z":100, "y":50}""")
+            result = sqlquery.execute(session)
+            return (result, sqlquery.to_command.call_count)
+
+        (result, runs) = run_in_new_kernel(3)
+        assert_equals(1, runs)
+        # Without persist_kernel_sessions, the restarted kernel has a new session.
+        (cached, runs) = run_in_new_kernel(4)
+        assert_equals(0, runs)
+        assert_frame_equal(result, cached)
+
+        conf.override_all({"disk_result_cache_per_session": True})
+        assert_equals(1, run_in_new_kernel(5)[1])
+        assert_equals(0, run_in_new_kernel(5)[1])
+        disk_cache.invalidate("http://livy", 5)
+        assert_equals(1, run_in_new_kernel(5)[1])
+    finally:
+        conf.override_all({})
+        shutil.rmtree(path)
@@ -1,13 +1,22 @@
+import base64
+import gzip
+import io
+import json
+import sys
+import zlib
 from IPython.core.error import UsageError
-from mock import MagicMock
+from mock import MagicMock, patch
 import numpy as np
+from nose.plugins.skip import SkipTest
 from nose.tools import assert_equals, assert_is
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
 
-from sparkmagic.livyclientlib.exceptions import BadUserDataException
-from sparkmagic.utils.utils import parse_argstring_or_throw, records_to_dataframe
-from sparkmagic.utils.constants import SESSION_KIND_PYSPARK
+from sparkmagic.livyclientlib.exceptions import BadUserDataException, DataFrameParseException, \
+    BadUserConfigurationException
+from sparkmagic.utils.utils import parse_argstring_or_throw, records_to_dataframe, pyspark_arrow_code
+from sparkmagic.utils.constants import SESSION_KIND_PYSPARK, SESSION_KIND_SPARK, SESSION_KIND_SPARKR, \
+    COMPRESSED_RECORDS_PREFIX, ARROW_RECORDS_PREFIX, SCHEMA_PREFIX
 
 
 def test_parse_argstring_or_throw():
@@ -53,6 +62,217 @@ def test_records_to_dataframe_no_coercing():
     assert_frame_equal(expected, df)
 
 
+def test_records_to_dataframe_compressed():
+    result = u"""{"z":100, "y":50}
+{"z":25, "y":10}"""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(result.encode("utf-8"))
+    compressed = COMPRESSED_RECORDS_PREFIX + base64.b64encode(buf.getvalue()).decode("ascii") + u"\n"
+
+    df = records_to_dataframe(compressed, SESSION_KIND_SPARK, False)
+    expected = pd.DataFrame([{'z': 100, 'y': 50}, {'z': 25, 'y': 10}], columns=['z', 'y'])
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_compressed_sparkr():
+    result = u'[{"z":100,"y":50},{"z":25,"y":10}]'
+    compressed = COMPRESSED_RECORDS_PREFIX + base64.b64encode(zlib.compress(result.encode("utf-8"))).decode("ascii")
+
+    df = records_to_dataframe(compressed, SESSION_KIND_SPARKR, False)
+    expected = pd.DataFrame([{'z': 100, 'y': 50}, {'z': 25, 'y': 10}], columns=['z', 'y'])
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_bad_compressed_payload():
+    try:
+        records_to_dataframe(COMPRESSED_RECORDS_PREFIX + u"bm90IGd6aXA=", SESSION_KIND_PYSPARK, False)
+        assert False
+    except DataFrameParseException:
+        pass
+
+
+def test_records_to_dataframe_arrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise SkipTest(u"pyarrow is not installed")
+    expected = pd.DataFrame({u'z': [100, 25], u'y': [u"a", u"b"]}, columns=[u'z', u'y'])
+    table = pyarrow.Table.from_pandas(expected, preserve_index=False)
+    sink = pyarrow.BufferOutputStream()
+    writer = pyarrow.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    result = ARROW_RECORDS_PREFIX + base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii")
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK)
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_arrow_without_pyarrow():
+    with patch.dict(sys.modules, {u"pyarrow": None}):
+        try:
+            records_to_dataframe(ARROW_RECORDS_PREFIX + u"AAAA", SESSION_KIND_PYSPARK)
+            assert False
+        except BadUserConfigurationException:
+            pass
+
+
+@patch('sparkmagic.utils.utils.import_pyarrow')
+def test_pyspark_arrow_code(import_pyarrow):
+    code = pyspark_arrow_code(u'df', u'sample', 10, 0.5)
+
+    import_pyarrow.assert_called_once_with()
+    assert u'from_pandas(df.sample(False, 0.5).limit(10).toPandas()' in code
+    assert u'from_pandas(df.toPandas()' in pyspark_arrow_code(u'df', u'take', -1, 0.5)
+    compile(code, u'<arrow>', u'exec')
+
+
+def test_records_to_dataframe_without_orjson():
+    result = """{"z":100, "y":50}
+
+{"z":25, "nullv":1.0, "y":10}
+"""
+    with patch('sparkmagic.utils.utils._orjson', None):
+        df = records_to_dataframe(result, SESSION_KIND_PYSPARK, False)
+    expected = pd.DataFrame([{'z': 100, "nullv": None, 'y': 50}, {'z':25, "nullv":1, 'y':10}], columns=['z', "nullv", 'y'])
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_nan():
+    result = """{"z":NaN, "y":50}
+{"z":1.5, "y":10}"""
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK, False)
+    expected = pd.DataFrame([{'z': np.nan, 'y': 50}, {'z': 1.5, 'y': 10}], columns=['z', 'y'])
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_invalid_json():
+    try:
+        records_to_dataframe("""{"z":100, "y":50}
+{"z":""", SESSION_KIND_PYSPARK, False)
+        assert False
+    except DataFrameParseException:
+        pass
+
+
+def test_records_to_dataframe_with_schema():
+    schema = {"type": "struct", "fields": [
+        {"name": "id", "type": "long", "nullable": True, "metadata": {}},
+        {"name": "count", "type": "integer", "nullable": True, "metadata": {}},
+        {"name": "price", "type": "decimal(10,2)", "nullable": True, "metadata": {}},
+        {"name": "day", "type": "date", "nullable": True, "metadata": {}},
+        {"name": "at", "type": "timestamp", "nullable": True, "metadata": {}},
+        {"name": "code", "type": "string", "nullable": True, "metadata": {}},
+        {"name": "flag", "type": "boolean", "nullable": True, "metadata": {}},
+        {"name": "empty", "type": "double", "nullable": True, "metadata": {}},
+        {"name": "tags", "type": {"type": "array", "elementType": "string", "containsNull": True},
+         "nullable": True, "metadata": {}}]}
+    result = SCHEMA_PREFIX + json.dumps(schema) + """
+{"flag":true,"id":1,"count":3,"price":1.5,"day":"2016-01-01","at":"2016-01-01T10:00:00.000-08:00","code":"2016","tags":["a"]}
+{"id":2,"price":2,"day":"2016-01-02","at":"2016-06-01T10:00:00.000-07:00","code":"0042","flag":false,"tags":[]}"""
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK, True)
+
+    assert_equals(["id", "count", "price", "day", "at", "code", "flag", "empty", "tags"], list(df.columns))
+    assert_equals(np.dtype("int64"), df["id"].dtype)
+    assert_equals(pd.Int64Dtype(), df["count"].dtype)
+    assert_equals([3, pd.NA], list(df["count"]))
+    assert_equals(np.dtype("float64"), df["price"].dtype)
+    assert_equals(np.dtype("datetime64[ns]"), df["day"].dtype)
+    assert_equals(pd.Timestamp("2016-06-01T17:00:00", tz="UTC"), df["at"][1])
+    assert_equals(["2016", "0042"], list(df["code"]))
+    assert_equals(np.dtype("bool"), df["flag"].dtype)
+    assert_equals(np.dtype("float64"), df["empty"].dtype)
+    assert_equals([["a"], []], list(df["tags"]))
+
+
+def test_records_to_dataframe_with_sparkr_schema_no_coercing():
+    result = SCHEMA_PREFIX + """[["z","int"],["y","string"]]
+[{"y":"2016-01-01","z":"100"},{"y":"2016-01-01","z":"25"}]"""
+
+    df = records_to_dataframe(result, SESSION_KIND_SPARKR, False)
+    expected = pd.DataFrame([{'z': "100", 'y': "2016-01-01"}, {'z': "25", 'y': "2016-01-01"}], columns=['z', 'y'])
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_with_schema_keeps_nullable_values_exact():
+    schema = {"type": "struct", "fields": [
+        {"name": "id", "type": "long", "nullable": True, "metadata": {}},
+        {"name": "flag", "type": "boolean", "nullable": True, "metadata": {}}]}
+    result = SCHEMA_PREFIX + json.dumps(schema) + """
+{"id":9007199254740993,"flag":true}
+{}"""
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK, True, False)
+
+    assert_equals(9007199254740993, df["id"][0])
+    assert df["id"].isnull()[1]
+    assert_equals(pd.BooleanDtype(), df["flag"].dtype)
+    assert_equals([True, pd.NA], list(df["flag"]))
+
+
+def test_records_to_dataframe_with_schema_without_nullable_dtypes():
+    schema = {"type": "struct", "fields": [{"name": "id", "type": "long", "nullable": True, "metadata": {}}]}
+    result = SCHEMA_PREFIX + json.dumps(schema) + """
+{"id":9007199254740993}
+{}"""
+
+    with patch('pandas.Series.astype', side_effect=TypeError):
+        df = records_to_dataframe(result, SESSION_KIND_PYSPARK, True, False)
+
+    assert_equals(np.dtype("object"), df["id"].dtype)
+    assert_equals([9007199254740993, None], list(df["id"]))
+
+
+def test_records_to_dataframe_with_schema_and_no_rows():
+    result = SCHEMA_PREFIX + """{"type":"struct","fields":[{"name":"z","type":"long","nullable":true,"metadata":{}}]}
+"""
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK, True)
+    assert_equals(["z"], list(df.columns))
+    assert_equals(0, len(df))
+
+
+def test_records_to_dataframe_across_chunks():
+    result = """{"z":1, "y":"a"}
+{"z":2}
+{"z":3, "nullv":1.0, "y":"c"}
+
+{"y":"d", "z":4, "nullv":2.0}
+{"z":5, "y":"e"}"""
+
+    with patch('sparkmagic.utils.utils._RECORDS_CHUNK_SIZE', 2):
+        df = records_to_dataframe(result, SESSION_KIND_PYSPARK, False)
+    expected = pd.DataFrame([{'z': 1, 'nullv': None, 'y': "a"}, {'z': 2, 'nullv': None, 'y': None},
+                             {'z': 3, 'nullv': 1.0, 'y': "c"}, {'z': 4, 'nullv': 2.0, 'y': "d"},
+                             {'z': 5, 'nullv': None, 'y': "e"}], columns=['z', 'nullv', 'y'])
+    assert_frame_equal(expected, df)
+
+
+def test_records_to_dataframe_empty():
+    for result in ["", "[]", "\n"]:
+        df = records_to_dataframe(result, SESSION_KIND_PYSPARK, False)
+        assert_equals(0, len(df))
+        assert_equals(0, len(df.columns))
+
+
+def test_records_to_dataframe_compact():
+    result = "\n".join(json.dumps({"id": i, "country": ["US", "DE"][i % 2], "name": "user {}".format(i)})
+                       for i in range(10))
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK, True, True)
+    assert_equals("category", df["country"].dtype.name)
+    assert_equals(["DE", "US"], list(df["country"].cat.categories))
+    assert_equals(np.dtype("object"), df["name"].dtype)
+    assert_equals(np.dtype("int8"), df["id"].dtype)
+
+    df = records_to_dataframe(result, SESSION_KIND_PYSPARK, True, False)
+    assert_equals(np.dtype("object"), df["country"].dtype)
+    assert_equals(np.dtype("int64"), df["id"].dtype)
+
+
 def test_records_to_dataframe_missing_value_later():
     result = """{"z":25, "nullv":1.0, "y":10}
 {"z":100, "y":50}"""
@@ -205,6 +205,11 @@ def heartbeat_retry_seconds():
     return 10
 
 
+@_with_override
+def heartbeat_jitter_seconds():
+    return 5
+
+
 @_with_override
 def livy_server_heartbeat_timeout_seconds():
     return 0
@@ -237,6 +242,149 @@ def configurable_retry_policy_max_retries():
     return 8
 
 
+@_with_override
+def statement_poll_min_seconds():
+    return 0.05
+
+
+@_with_override
+def statement_poll_max_seconds():
+    return 10
+
+
+@_with_override
+def session_status_max_age_seconds():
+    return 0.5
+
+
+@_with_override
+def http_pool_connections():
+    return 1
+
+
+@_with_override
+def http_pool_maxsize():
+    return 10
+
+
+@_with_override
+def kerberos_token_cache_seconds():
+    # 0 disables caching: every new connection gets a fresh SPNEGO negotiation.
+    return 0
+
+
+@_with_override
+def compress_dataframe_transfer():
+    return False
+
+
+@_with_override
+def arrow_dataframe_transfer():
+    # Only used by pyspark and pyspark3 sessions; requires pyarrow on the driver and in the notebook environment.
+    return False
+
+
+@_with_override
+def dataframe_schema_transfer():
+    return False
+
+
+@_with_override
+def dataframe_page_size():
+    # Rows fetched per statement when -o collects every row (-n -1). 0 fetches everything in one statement.
+    return 0
+
+
+@_with_override
+def compact_dataframe():
+    # Converts low-cardinality string columns of -o results to categoricals and downcasts numeric columns.
+    return False
+
+
+@_with_override
+def compact_dataframe_max_category_ratio():
+    # A string column becomes a categorical if it has at most this many distinct values per non-null value.
+    return 0.5
+
+
+@_with_override
+def sql_result_cache_max_bytes():
+    # Memory for caching %%sql results per kernel, so re-running a query skips Livy. 0 disables the cache.
+    return 0
+
+
+@_with_override
+def disk_result_cache_max_bytes():
+    # Disk space for keeping %%sql and -o results across kernel restarts. 0 disables the disk cache.
+    return 0
+
+
+@_with_override
+def disk_result_cache_per_session():
+    # Keeps disk-cached results apart for each Livy session and drops them when the session is deleted, for results
+    # that depend on a session's temporary views. Otherwise results are shared by every session on the endpoint,
+    # so they are reused after a kernel restart or notebook reopen, until they expire or are pulled with --refresh.
+    return False
+
+
+@_with_override
+def disk_result_cache_ttl_seconds():
+    return 24 * 60 * 60
+
+
+@_with_override
+def disk_result_cache_path():
+    return join_paths(HOME_PATH, u"cache")
+
+
+@_with_override
+def autoviz_aggregation_pushdown():
+    # Aggregates autoviz charts of %%sql results with a GROUP BY over the whole query result, on the cluster.
+    return False
+
+
+@_with_override
+def start_session_in_background():
+    # Kernels start their Livy session as soon as they launch, or after %%configure, instead of on the first
+    # Spark cell.
+    return False
+
+
+@_with_override
+def session_pool_size():
+    # Idle Livy sessions the server extension keeps ready per language, so kernels start without waiting for
+    # YARN. 0 disables the pool.
+    return 0
+
+
+@_with_override
+def session_pool_languages():
+    return [LANG_PYTHON]
+
+
+@_with_override
+def session_pool_path():
+    return join_paths(HOME_PATH, u"pool")
+
+
+@_with_override
+def session_info_max_age_seconds():
+    # How long the session JSON from the last status refresh answers app id, Spark UI and driver log URL
+    # lookups before they fetch the session again.
+    return 10
+
+
+@_with_override
+def persist_kernel_sessions():
+    # Kernels leave their Livy session running when they restart, and reattach to it afterwards.
+    return False
+
+
+@_with_override
+def kernel_sessions_path():
+    return join_paths(HOME_PATH, u"kernel_sessions.json")
+
+
 def _credentials_override(f):
     """Provides special handling for credentials. It still calls _override().
     If 'base64_password' in config is set, it will base64 decode it and returned in return value's 'password' field.
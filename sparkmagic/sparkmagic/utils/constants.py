@@ -56,6 +56,82 @@ LANGS_SUPPORTED = [LANG_SCALA, LANG_PYTHON, LANG_PYTHON3, LANG_R]
 
 LONG_RANDOM_VARIABLE_NAME = "yQeKOYBsFgLWWGWZJu3y"
 
+SAMPLE_METHOD_TAKE = u"take"
+SAMPLE_METHOD_SAMPLE = u"sample"
+SAMPLE_METHOD_STRATIFIED = u"stratified"
+SAMPLE_METHOD_RESERVOIR = u"reservoir"
+SAMPLE_METHOD_PARTITION = u"partition"
+SAMPLE_METHODS = [SAMPLE_METHOD_TAKE, SAMPLE_METHOD_SAMPLE, SAMPLE_METHOD_STRATIFIED, SAMPLE_METHOD_RESERVOIR,
+                  SAMPLE_METHOD_PARTITION]
+
+# Compressed dataframe transfer: the remote side prints the records, joined by newlines, as one line holding this
+# prefix followed by the base64 of the gzip (or zlib) compressed text. Each template takes the expression that
+# evaluates to the records.
+COMPRESSED_RECORDS_PREFIX = u"sparkmagic-gzip-base64:"
+PYSPARK_COMPRESSED_PRINT = u'print(u"' + COMPRESSED_RECORDS_PREFIX + u'" + __import__("base64").b64encode(' \
+                           u'__import__("zlib").compress(u"\\n".join({}).encode("utf-8"))).decode("ascii"))'
+SCALA_COMPRESSED_PRINT = u'{{ val bytes = new java.io.ByteArrayOutputStream(); ' \
+                         u'val gzip = new java.util.zip.GZIPOutputStream(bytes); ' \
+                         u'gzip.write({}.mkString("\\n").getBytes("UTF-8")); gzip.close(); ' \
+                         u'println("' + COMPRESSED_RECORDS_PREFIX + \
+                         u'" + java.util.Base64.getEncoder.encodeToString(bytes.toByteArray)) }}'
+R_COMPRESSED_PRINT = u'cat("' + COMPRESSED_RECORDS_PREFIX + \
+                     u'", jsonlite::base64_enc(memCompress(charToRaw(as.character({})), "gzip")), sep="")'
+
+# Schema transfer: the remote side prints this prefix followed by the DataFrame's schema as the first line of the
+# output, so the client can type the columns without guessing. Each template takes the DataFrame expression.
+SCHEMA_PREFIX = u"sparkmagic-schema:"
+PYSPARK_SCHEMA_PRINT = u'print(u"' + SCHEMA_PREFIX + u'" + {}.schema.json())'
+SCALA_SCHEMA_PRINT = u'println("' + SCHEMA_PREFIX + u'" + {}.schema.json)'
+R_SCHEMA_PRINT = u'cat("' + SCHEMA_PREFIX + u'", jsonlite::toJSON(dtypes({})), "\\n", sep="")'
+
+# Arrow dataframe transfer (pyspark only): the remote side prints this prefix followed by the base64 of an Arrow IPC
+# stream holding the DataFrame. The template takes the DataFrame expression and a variable name prefix.
+ARROW_RECORDS_PREFIX = u"sparkmagic-arrow-base64:"
+PYSPARK_ARROW_PRINT = u'import base64 as {var}_base64, pyarrow as {var}_pa\n' \
+                      u'{var} = {var}_pa.Table.from_pandas({dataframe}.toPandas(), preserve_index=False)\n' \
+                      u'{var}_sink = {var}_pa.BufferOutputStream()\n' \
+                      u'{var}_writer = {var}_pa.RecordBatchStreamWriter({var}_sink, {var}.schema)\n' \
+                      u'{var}_writer.write_table({var})\n' \
+                      u'{var}_writer.close()\n' \
+                      u'print(u"' + ARROW_RECORDS_PREFIX + \
+                      u'" + {var}_base64.b64encode({var}_sink.getvalue().to_pybytes()).decode("ascii"))'
+
+# Paged -o output: the setup statement prints this prefix followed by the number of rows. The Scala REPL also echoes
+# the setup's vals and expressions, so only the last line with the prefix is read.
+ROW_COUNT_PREFIX = u"sparkmagic-row-count:"
+
+# Session probe: a single statement run when a session starts, printing a JSON object that tells which context
+# variables exist, whether Hive support is on, the Spark version and the application id and UI URL.
+PYSPARK_SESSION_PROBE = (u'{v} = globals()\n'
+                         u'print(__import__("json").dumps({{"spark": "spark" in {v}, '
+                         u'"sqlContext": "sqlContext" in {v}, '
+                         u'"hive": ("spark" in {v} and '
+                         u'{v}["spark"].conf.get("spark.sql.catalogImplementation", "") == "hive") or '
+                         u'"hive" in type({v}.get("sqlContext")).__name__.lower(), '
+                         u'"version": {v}["sc"].version if "sc" in {v} else None, '
+                         u'"appId": {v}["sc"].applicationId if "sc" in {v} else None, '
+                         u'"uiUrl": getattr({v}["sc"], "uiWebUrl", None) if "sc" in {v} else None}}))\n'
+                         u'del {v}').format(v=LONG_RANDOM_VARIABLE_NAME)
+# Scala cannot test whether a variable is bound, so the contexts are inferred from the Spark version.
+SCALA_SESSION_PROBE = u'{ def q(s: String) = "" + \'"\' + s + \'"\'\n' \
+                      u'val version = sc.version\n' \
+                      u'val session = version.takeWhile(_ != \'.\').toInt >= 2\n' \
+                      u'val uiUrl = scala.util.Try(sc.getClass.getMethod("uiWebUrl").invoke(sc)' \
+                      u'.asInstanceOf[Option[String]]).toOption.flatten\n' \
+                      u'val hive = sc.getConf.get("spark.sql.catalogImplementation", "") == "hive" || ' \
+                      u'sc.getConf.getBoolean("spark.repl.enableHiveContext", false)\n' \
+                      u'println(Seq("spark" -> session.toString, "sqlContext" -> (!session).toString, ' \
+                      u'"hive" -> hive.toString, "version" -> q(version), "appId" -> q(sc.applicationId), ' \
+                      u'"uiUrl" -> uiUrl.map(q).getOrElse("null")).map { case (k, v) => q(k) + ": " + v }' \
+                      u'.mkString("{", ", ", "}")) }'
+R_SESSION_PROBE = u'cat(jsonlite::toJSON(list(spark = exists("spark"), sqlContext = exists("sqlContext"), ' \
+                  u'hive = tryCatch(SparkR:::callJMethod(SparkR:::callJMethod(sc, "getConf"), "get", ' \
+                  u'"spark.sql.catalogImplementation", "") == "hive", error = function(e) FALSE), ' \
+                  u'version = tryCatch(SparkR::sparkR.version(), error = function(e) NULL), ' \
+                  u'appId = tryCatch(SparkR:::callJMethod(sc, "applicationId"), error = function(e) NULL), ' \
+                  u'uiUrl = NULL), auto_unbox = TRUE, null = "null"))'
+
 MAGICS_LOGGER_NAME = "magicsLogger"
 
 IDLE_SESSION_STATUS = "idle"
@@ -3,12 +3,29 @@ from IPython.core.error import UsageError
 from IPython.core.magic_arguments import parse_argstring
 import numpy as np
 import pandas as pd
+import base64
+import binascii
 import json
+import sys
+import zlib
 from collections import OrderedDict
+from itertools import islice
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
 
 import sparkmagic.utils.configuration as conf
 import sparkmagic.utils.constants as constants
-from sparkmagic.livyclientlib.exceptions import BadUserDataException, DataFrameParseException
+from sparkmagic.livyclientlib.exceptions import BadUserDataException, DataFrameParseException, \
+    BadUserConfigurationException
+
+
+# Plain dicts keep insertion order from Python 3.7 on; older versions need OrderedDict to keep the column order.
+_ordered_dict = OrderedDict if sys.version_info < (3, 7) else dict
+_json_decoder = json.JSONDecoder(object_pairs_hook=_ordered_dict if sys.version_info < (3, 7) else None)
 
 
 def get_coerce_value(coerce):
@@ -27,61 +44,346 @@ def parse_argstring_or_throw(magic_func, argstring, parse_argstring=parse_argstr
         raise BadUserDataException(str(e))
         
         
+# Object columns are probed with this many values before a full conversion is attempted.
+_COERCE_SAMPLE_SIZE = 50
+# Frames with at least this many object columns are coerced on a thread pool.
+_COERCE_PARALLEL_MIN_COLUMNS = 16
+# pandas 2 always infers the datetime format and deprecates the flag.
+_TO_DATETIME_KWARGS = {"infer_datetime_format": True} if int(pd.__version__.split(".")[0]) < 2 else {}
+
+
 def coerce_pandas_df_to_numeric_datetime(df):
+    """Converts each object column, in place, to datetimes if all its values parse as dates, or else to numbers
+    if all its values parse as numbers."""
+    for (column_name, coerced) in _coerced_columns(df):
+        df[column_name] = coerced
+
+
+def coerced_pandas_df_to_numeric_datetime(df):
+    """Same as coerce_pandas_df_to_numeric_datetime, but returns a new DataFrame. This is much faster for wide
+    frames, since replacing columns one at a time copies the remaining object columns on every replacement."""
+    coerced = dict(_coerced_columns(df))
+    if not coerced:
+        return df
+    return pd.concat([coerced.get(column_name, df[column_name]) for column_name in df.columns], axis=1)
+
+
+def _coerced_columns(df):
+    """Returns (column name, converted column) for the object columns that convert. A spread-out sample of each
+    column is converted first; since any value that fails makes the whole column fail, a failing sample rules
+    the conversion out without scanning the column. Wide frames are converted on a thread pool."""
+    column_names = [column_name for column_name in df.columns if df[column_name].dtype == np.dtype("object")]
+    columns = [df[column_name] for column_name in column_names]
+
+    threads = min(len(columns), cpu_count())
+    if len(columns) >= _COERCE_PARALLEL_MIN_COLUMNS and threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            coerced_columns = pool.map(_coerce_column, columns)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        coerced_columns = [_coerce_column(column) for column in columns]
+
+    return [(column_name, coerced) for (column_name, coerced) in zip(column_names, coerced_columns)
+            if coerced is not None]
+
+
+def _coerce_column(column):
+    values = column.dropna()
+    if len(values) == 0:
+        return None
+
+    sample = values.iloc[::max(1, len(values) // _COERCE_SAMPLE_SIZE)]
+    for convert in (_to_datetime, _to_numeric):
+        try:
+            convert(sample)
+            return convert(column)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return None
+
+
+def _to_datetime(column):
+    return pd.to_datetime(column, errors="raise", **_TO_DATETIME_KWARGS)
+
+
+def _to_numeric(column):
+    return pd.to_numeric(column, errors="raise")
+
+
+def decompress_records_text(records_text):
+    """Returns the records printed by a compressed transfer command as plain text. Text without the
+    compressed prefix is returned unchanged."""
+    stripped = records_text.strip()
+    if not stripped.startswith(constants.COMPRESSED_RECORDS_PREFIX):
+        return records_text
+    try:
+        payload = base64.b64decode(stripped[len(constants.COMPRESSED_RECORDS_PREFIX):])
+        # MAX_WBITS | 32 accepts both the gzip (Scala) and zlib (Python, R) containers.
+        return zlib.decompress(payload, zlib.MAX_WBITS | 32).decode("utf-8")
+    except (binascii.Error, zlib.error, TypeError, UnicodeDecodeError) as e:
+        raise DataFrameParseException(u"Cannot decompress result: {}".format(e))
+
+
+def import_pyarrow():
+    """pyarrow is only needed for Arrow dataframe transfer, so it is imported lazily."""
+    try:
+        import pyarrow
+    except ImportError:
+        raise BadUserConfigurationException(u"Arrow dataframe transfer requires the pyarrow package. Install it "
+                                            u"or set 'arrow_dataframe_transfer' to false.")
+    return pyarrow
+
+
+def pyspark_arrow_code(dataframe, samplemethod, maxrows, samplefraction):
+    """Returns the PySpark code that prints the sampled dataframe as an Arrow IPC stream, which
+    arrow_records_to_dataframe reads back."""
+    import_pyarrow()
+    if samplemethod == u'sample':
+        dataframe = u'{}.sample(False, {})'.format(dataframe, samplefraction)
+    if maxrows >= 0:
+        dataframe = u'{}.limit({})'.format(dataframe, maxrows)
+    return constants.PYSPARK_ARROW_PRINT.format(var=constants.LONG_RANDOM_VARIABLE_NAME, dataframe=dataframe)
+
+
+def arrow_records_to_dataframe(records_text):
+    """Reads the base64 encoded Arrow IPC stream printed by an Arrow transfer command. Column types come
+    from the Arrow schema, so no coercion is needed."""
+    pyarrow = import_pyarrow()
+    try:
+        payload = base64.b64decode(records_text.strip()[len(constants.ARROW_RECORDS_PREFIX):])
+        return pyarrow.ipc.open_stream(pyarrow.py_buffer(payload)).read_all().to_pandas()
+    except (binascii.Error, TypeError, pyarrow.ArrowException) as e:
+        raise DataFrameParseException(u"Cannot read Arrow result: {}".format(e))
+
+
+def split_schema_line(records_text):
+    """Splits off the schema line a schema transfer command prints ahead of the records. Returns the
+    (column name, Spark type) pairs, or None if there is no schema line, and the remaining text."""
+    stripped = records_text.lstrip()
+    if not stripped.startswith(constants.SCHEMA_PREFIX):
+        return (None, records_text)
+    (line, _, rest) = stripped.partition(u"\n")
+    try:
+        schema = json.loads(line[len(constants.SCHEMA_PREFIX):])
+    except ValueError:
+        raise DataFrameParseException(u"Cannot parse schema as JSON: '{}'".format(line))
+    if isinstance(schema, dict):
+        # StructType.json() from pyspark and Scala. Nested types are objects; their "type" names them.
+        fields = [(f[u"name"], f[u"type"][u"type"] if isinstance(f[u"type"], dict) else f[u"type"])
+                  for f in schema[u"fields"]]
+    else:
+        # dtypes() from SparkR: [name, simpleString] pairs.
+        fields = [(f[0], f[1]) for f in schema]
+    return (fields, rest)
+
+
+_SPARK_INTEGRAL_TYPES = {u"long", u"integer", u"short", u"byte", u"bigint", u"int", u"smallint", u"tinyint"}
+_SPARK_FLOATING_TYPES = {u"double", u"float"}
+
+
+def apply_spark_schema(df, fields, coerce=True):
+    """Orders the columns as in the Spark schema, adds the columns that were null in every row (toJSON leaves
+    them out), and, if coerce is set, converts each column to the pandas dtype of its Spark type."""
+    df = df.reindex(columns=[name for (name, _) in fields])
+    if not coerce:
+        return df
+
+    for (name, spark_type) in fields:
+        column = df[name]
+        has_nulls = column.isnull().any()
+        if spark_type in _SPARK_INTEGRAL_TYPES:
+            if has_nulls:
+                # float64 would round longs above 2**53, so nulls need pandas' nullable Int64.
+                df[name] = _astype_nullable(column, u"Int64")
+            else:
+                df[name] = column.astype(np.int64)
+        elif spark_type in _SPARK_FLOATING_TYPES or spark_type.startswith(u"decimal"):
+            df[name] = column.astype(np.float64)
+        elif spark_type == u"boolean":
+            df[name] = _astype_nullable(column, u"boolean") if has_nulls else column.astype(np.bool_)
+        elif spark_type == u"timestamp":
+            # Spark writes the session's UTC offset, which can change across rows with daylight saving time.
+            df[name] = pd.to_datetime(column, utc=True)
+        elif spark_type == u"date":
+            df[name] = pd.to_datetime(column)
+    return df
+
+
+def _astype_nullable(column, dtype):
+    """Returns column as the pandas nullable dtype, or column unchanged if this pandas does not have it."""
+    try:
+        return column.astype(dtype)
+    except (TypeError, ValueError):
+        return column
+
+
+def _spark_integral_columns(fields):
+    """Returns the names of the schema's integer columns."""
+    return [name for (name, spark_type) in fields if spark_type in _SPARK_INTEGRAL_TYPES]
+
+
+def compact_dataframe(df, max_category_ratio=None):
+    """Returns df with its low-cardinality string columns converted to categoricals, and its integer and
+    float columns downcast to the smallest dtype that holds every value exactly. A string column becomes a
+    categorical when it has at most max_category_ratio distinct values per non-null value."""
+    if max_category_ratio is None:
+        max_category_ratio = conf.compact_dataframe_max_category_ratio()
+    compacted = {}
     for column_name in df.columns:
-        coerced = False
-        
-        if df[column_name].isnull().all():
-            continue
-
-        if not coerced and df[column_name].dtype == np.dtype("object"):
-            try:
-                df[column_name] = pd.to_datetime(df[column_name], errors="raise")
-                coerced = True
-            except (ValueError, TypeError, OverflowError):
-                pass
-
-        if not coerced and df[column_name].dtype == np.dtype("object"):
-            try:
-                df[column_name] = pd.to_numeric(df[column_name], errors="raise")
-                coerced = True
-            except (ValueError, TypeError):
-                pass
-
-
-def records_to_dataframe(records_text, kind, coerce=None):
-    if records_text in ['', '[]']:
-        strings = []
+        compact = _compact_column(df[column_name], max_category_ratio)
+        if compact is not None:
+            compacted[column_name] = compact
+    if not compacted:
+        return df
+    return pd.concat([compacted.get(column_name, df[column_name]) for column_name in df.columns], axis=1)
+
+
+def _compact_column(column, max_category_ratio):
+    dtype = column.dtype
+    if dtype == np.dtype("object"):
+        values = column.dropna()
+        # Only plain strings: lists and dicts from nested Spark types are unhashable.
+        if len(values) == 0 or pd.api.types.infer_dtype(values, skipna=True) != "string":
+            return None
+        if values.nunique() > max_category_ratio * len(values):
+            return None
+        return column.astype("category")
+    if dtype.kind in "iu":
+        compact = pd.to_numeric(column, downcast="unsigned" if dtype.kind == "u" else "integer")
+    elif dtype.kind == "f":
+        compact = pd.to_numeric(column, downcast="float")
+        # Unlike integers, floats are downcast regardless of precision, so check the values survive.
+        if compact.dtype != dtype and not (compact.astype(dtype) == column)[column.notnull()].all():
+            return None
     else:
-        strings = records_text.strip().split('\n')
+        return None
+    return compact if compact.dtype != dtype else None
+
+
+def records_to_dataframe(records_text, kind, coerce=None, compact=None):
+    if compact is None:
+        compact = conf.compact_dataframe()
+    df = _records_text_to_dataframe(records_text, kind, coerce)
+    if compact:
+        df = compact_dataframe(df)
+    return df
+
+
+def _records_text_to_dataframe(records_text, kind, coerce):
+    if records_text.strip().startswith(constants.ARROW_RECORDS_PREFIX):
+        return arrow_records_to_dataframe(records_text)
+
+    (schema, records_text) = split_schema_line(records_text)
+    records_text = decompress_records_text(records_text)
     try:
-        data_array = [json.JSONDecoder(object_pairs_hook=OrderedDict).decode(s) for s in strings]
-
-        if kind == constants.SESSION_KIND_SPARKR and len(data_array) > 0:
-            data_array = data_array[0]
-
-        df = pd.DataFrame(data_array)
-
-        if len(data_array) > 0:    
-            # This will assign the columns in the right order. If we simply did
-            # df = pd.DataFrame(data_array, columns=data_array[0].keys())
-            # in the code defining df, above, we could get an issue where the first element
-            # has some columns as null, and thus would drop the columns from the df altogether.
-            # Refer to https://github.com/jupyter-incubator/sparkmagic/issues/346 for
-            # more details.
-            for data in data_array:
-                if len(data.keys()) == len(df.columns):
-                    df = df[list(data.keys())]
-                    break
-                    
+        if records_text.strip() in (u'', u'[]'):
+            records = []
+        elif kind == constants.SESSION_KIND_SPARKR:
+            # SparkR prints all the records as a single JSON array.
+            data_array = parse_json_lines(list(_iter_lines(records_text)))
+            records = data_array[0] if len(data_array) > 0 else []
+        else:
+            records = _iter_records(_iter_lines(records_text))
+
         if coerce is None:
             coerce = conf.coerce_dataframe()
-        if coerce:
-            coerce_pandas_df_to_numeric_datetime(df)
+        # Integer columns are kept as Python ints until the schema is applied, rather than being read as
+        # float64 wherever they have nulls.
+        exact_columns = _spark_integral_columns(schema) if schema is not None and coerce else ()
+        df = _records_to_dataframe(records, exact_columns)
+
+        if schema is not None:
+            df = apply_spark_schema(df, schema, coerce)
+        elif coerce:
+            df = coerced_pandas_df_to_numeric_datetime(df)
 
         return df
     except ValueError:
-        raise DataFrameParseException(u"Cannot parse object as JSON: '{}'".format(strings))
+        raise DataFrameParseException(u"Cannot parse object as JSON: '{}'".format(records_text))
+
+
+def parse_json_lines(strings):
+    """Parses a list of JSON documents with a single decoder call by joining them into one JSON array.
+    Uses orjson when it is installed, falling back to json for input orjson rejects, such as NaN."""
+    if not strings:
+        return []
+    payload = u"[" + u",".join(strings) + u"]"
+    if _orjson is not None:
+        try:
+            return _orjson.loads(payload)
+        except ValueError:
+            pass
+    return _json_decoder.decode(payload)
+
+
+# Number of lines decoded per parse_json_lines call when streaming records.
+_RECORDS_CHUNK_SIZE = 1000
+
+
+def _iter_lines(text):
+    """Yields the non-blank lines of text without splitting it into a list up front."""
+    start = 0
+    while start < len(text):
+        end = text.find(u"\n", start)
+        if end == -1:
+            end = len(text)
+        line = text[start:end]
+        if line.strip():
+            yield line
+        start = end + 1
+
+
+def _iter_records(lines):
+    """Decodes the lines in chunks, so only one chunk of records is alive at a time."""
+    while True:
+        chunk = list(islice(lines, _RECORDS_CHUNK_SIZE))
+        if not chunk:
+            return
+        for record in parse_json_lines(chunk):
+            yield record
+
+
+def _records_to_dataframe(records, object_columns=()):
+    """Builds a DataFrame by appending each record's values to per-column buffers, so the records can be
+    released as they are consumed.
+
+    Columns are ordered as in the first record that has all of them. If we simply used the first record's
+    keys, columns that are null in that record would be dropped from the df altogether. Refer to
+    https://github.com/jupyter-incubator/sparkmagic/issues/346 for more details.
+
+    The columns named in object_columns keep their values as they were decoded, in object columns."""
+    columns = _ordered_dict()
+    column_order = None
+    row_count = 0
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError(u"Expected a JSON object, got '{}'".format(record))
+        if record.keys() == columns.keys():
+            # The common case: the record has exactly the columns seen so far.
+            for (name, values) in columns.items():
+                values.append(record[name])
+        else:
+            for (name, values) in columns.items():
+                values.append(record.get(name))
+            for (name, value) in record.items():
+                if name not in columns:
+                    columns[name] = [None] * row_count + [value]
+                    # Rows before this one cannot have all the columns.
+                    column_order = None
+        if column_order is None and len(record) == len(columns):
+            column_order = list(record.keys())
+        row_count += 1
+
+    if column_order is None:
+        column_order = list(columns.keys())
+    data = _ordered_dict()
+    for name in column_order:
+        values = columns.pop(name)
+        data[name] = pd.Series(values, dtype=object) if name in object_columns else values
+    return pd.DataFrame(data, columns=column_order)
 
 
 def get_sessions_info_html(info_sessions, current_session_id):